@@ -21,17 +21,48 @@
 
 import os
 import json
+import random
 import logging
 import contextlib
+import multiprocessing
+import concurrent.futures
 from .BaseAction import BaseAction
 from .CalendarDefinition import CalendarDefinition
 from .CalendarGenerator import CalendarGenerator
+from .ImagePoolAssignment import ImagePoolAssignment
+from .JointImagePoolAssignment import JointImagePoolAssignment
+from .Enums import ImagePlacementMethod
 
 _log = logging.getLogger(__spec__.name)
 
 class ActionCreateLayout(BaseAction):
+	# Set in each worker process of the pool that generates variants; the
+	# workers are forked, so the definition and the pool candidates are
+	# shared with the parent instead of being pickled.
+	_worker_generators = None
+
+	@classmethod
+	def _init_worker(cls, generators):
+		cls._worker_generators = generators
+
+	@classmethod
+	def _generate_in_worker(cls, index, symlink_dir):
+		(output_filename, generator) = cls._worker_generators[index]
+		cls._generate(output_filename, generator, symlink_dir)
+		return output_filename
+
+	@staticmethod
+	def _generate(output_filename, generator, symlink_dir):
+		_log.info("Generating: %s", output_filename)
+		layout = generator.generate()
+		with open(output_filename, "w") as f:
+			json.dump(layout, f, indent = 4)
+			f.write("\n")
+		if symlink_dir is not None:
+			generator.create_image_symlinks(symlink_dir)
+
 	def run(self):
-		definition = CalendarDefinition(self._args.input_calendar_file)
+		definition = CalendarDefinition(self._args.input_calendar_file, full_rescan = self._args.full_rescan)
 		if len(self._args.only_variant) == 0:
 			only_variants = set(definition.variant_names)
 		else:
@@ -40,6 +71,8 @@ class ActionCreateLayout(BaseAction):
 		with contextlib.suppress(FileExistsError):
 			os.makedirs(self._args.output_dir)
 
+		variants = [ ]
+		placed_filenames = set()
 		for variant in definition.variants:
 			if variant["name"] not in only_variants:
 				continue
@@ -53,19 +86,47 @@ class ActionCreateLayout(BaseAction):
 				with open(output_filename) as f:
 					previous_data = json.load(f)
 					previous_image_data = { key: value["filename"] for (key, value) in previous_data["images"].items() if value["filename"] is not None }
+				placed_filenames |= set(previous_image_data.values())
 			else:
 				previous_image_data = None
+			variants.append((output_filename, variant, previous_image_data))
+
+		if (len(placed_filenames) > 0) and (definition.image_pool is not None):
+			# Ensure those files which are already placed are part of the pool.
+			definition.image_pool.scan_files(sorted(placed_filenames))
 
-			if previous_image_data is not None:
-				# Ensure those files which are already placed are part of the pool.
-				placed_filenames = previous_image_data.values()
-				definition.image_pool.scan_files(placed_filenames)
-
-			_log.info("Generating: %s", output_filename)
-			generator = CalendarGenerator(definition, variant, previous_image_data = previous_image_data)
-			layout = generator.generate()
-			with open(output_filename, "w") as f:
-				json.dump(layout, f, indent = 4)
-				f.write("\n")
-			if not self._args.no_create_symlinks:
-				generator.create_image_symlinks(self._args.output_dir)
+		if self._args.seed is None:
+			seed = random.randrange(2 ** 32)
+		else:
+			seed = self._args.seed
+		_log.info("Image assignment seed: %d", seed)
+
+		# All variants draw from the same set of pool candidates, which
+		# therefore only needs to be created once. Every variant gets its own
+		# random generator, so its assignment only depends on the seed and not
+		# on the order in which variants are generated.
+		if definition.image_pool is not None:
+			pool_candidates = ImagePoolAssignment.create_pool_candidates(definition.image_pool)
+		else:
+			pool_candidates = None
+		placement_method = ImagePlacementMethod(self._args.placement)
+		generators = [ (output_filename, CalendarGenerator(definition, variant, previous_image_data = previous_image_data, placement_method = placement_method, pool_candidates = pool_candidates, rng = random.Random("%d:%s" % (seed, variant["name"])))) for (output_filename, variant, previous_image_data) in variants ]
+
+		if self._args.joint_placement and (definition.image_pool is not None):
+			_log.info("Jointly assigning images for %d variants", len(generators))
+			joint_assignment = JointImagePoolAssignment([ generator.image_pool_assignment for (output_filename, generator) in generators ], overlap_penalty = self._args.overlap_penalty, rng = random.Random(seed))
+			if not joint_assignment.attempt_placement():
+				_log.warning("Joint image placement is incomplete; variants with unfilled slots are placed once more on their own while they are generated.")
+
+		symlink_dir = None if self._args.no_create_symlinks else self._args.output_dir
+		job_count = min(self._args.max_jobs, len(generators))
+		if job_count <= 1:
+			for (output_filename, generator) in generators:
+				self._generate(output_filename, generator, symlink_dir)
+		else:
+			_log.info("Generating %d variants in %d processes", len(generators), job_count)
+			mp_context = multiprocessing.get_context("fork")
+			with concurrent.futures.ProcessPoolExecutor(max_workers = job_count, mp_context = mp_context, initializer = self._init_worker, initargs = (generators, )) as executor:
+				futures = [ executor.submit(self._generate_in_worker, index, symlink_dir) for index in range(len(generators)) ]
+				for future in futures:
+					future.result()
@@ -24,10 +24,17 @@ import shutil
 import tempfile
 import uuid
 import contextlib
+import logging
 from .BaseAction import BaseAction
 from .LayoutDefinition import LayoutDefinition
 from .LayoutPageRenderer import LayoutPageRenderer
 from .JobServer import JobServer
+from .InkscapeRenderer import InkscapeRenderer
+from .FileCache import FileCache
+from .SharedLayerRegistry import SharedLayerRegistry
+from .ImageCropper import ImageCropper
+
+_log = logging.getLogger(__spec__.name)
 
 class ActionRender(BaseAction):
 	def run(self):
@@ -39,8 +46,21 @@ class ActionRender(BaseAction):
 				for page_no in range(from_page, to_page + 1):
 					included_pages.add(page_no)
 
+		if self._args.no_cache:
+			render_cache = None
+			crop_cache = None
+		else:
+			render_cache = FileCache(self._args.cache_dir, suffix = ".png", max_size_bytes = self._args.cache_max_size)
+			crop_cache = FileCache(self._args.crop_cache_dir, suffix = ".jpg", max_size_bytes = self._args.cache_max_size)
+
+		shared_layers = SharedLayerRegistry()
 		with tempfile.TemporaryDirectory(prefix = "calendargen_") as temp_dir:
-			with JobServer(write_graph_file = self._args.job_graph) as job_server:
+			image_cropper = ImageCropper(temp_dir, crop_cache = crop_cache, oversampling = self._args.image_oversampling, threads = min(ImageCropper.MAX_THREADS, self._args.max_jobs))
+			job_server = JobServer(concurrent_job_count = self._args.max_jobs, max_memory = self._args.max_memory, write_graph_file = self._args.job_graph, write_trace_file = self._args.job_trace, print_summary = self._args.job_summary)
+			with InkscapeRenderer.create(self._args.inkscape_backend, worker_count = job_server.concurrent_job_count) as svg_renderer, job_server:
+				# Plan all pages of all layouts first so that identical layers
+				# are detected before any job is started.
+				root_jobs = [ ]
 				for input_filename in self._args.input_layout_file:
 					calendar_definition = LayoutDefinition(input_filename)
 					output_dir = self._args.output_dir + "/" + calendar_definition.name + "/"
@@ -57,7 +77,18 @@ class ActionRender(BaseAction):
 							page_temp_dir = temp_dir + "/" + str(uuid.uuid4())
 							os.makedirs(page_temp_dir)
 							output_file = "%s%s_%03d.%s" % (output_dir, calendar_definition.name, page_no, self._args.output_format)
-							page_renderer = LayoutPageRenderer(calendar_definition = calendar_definition, page_no = page_no, page_definition = page_definition, resolution_dpi = self._args.resolution_dpi, output_file = output_file, flatten_output = not self._args.no_flatten_output, temp_dir = page_temp_dir)
-							page_renderer.render(job_server)
+							page_renderer = LayoutPageRenderer(calendar_definition = calendar_definition, page_no = page_no, page_definition = page_definition, resolution_dpi = self._args.resolution_dpi, output_file = output_file, flatten_output = not self._args.no_flatten_output, temp_dir = page_temp_dir, svg_renderer = svg_renderer, render_cache = render_cache, shared_layers = shared_layers, image_cropper = image_cropper)
+							root_jobs += page_renderer.create_jobs(job_server)
+				job_server.add_jobs(*root_jobs)
+			if shared_layers.requested_count > 0:
+				print("Rendered %d unique layer(s) for %d layer(s) in total, %.1f%% deduplicated." % (shared_layers.unique_count, shared_layers.requested_count, shared_layers.dedup_ratio * 100))
+			if render_cache is not None:
+				_log.info("Render cache: %d layer(s) reused, %d rendered", render_cache.stats["hit"], render_cache.stats["miss"])
+				render_cache.cleanup()
+			if image_cropper.requested_count > 0:
+				_log.info("Cropped %d unique image(s) for %d placement(s)", image_cropper.unique_count, image_cropper.requested_count)
+			if crop_cache is not None:
+				_log.info("Crop cache: %d crop(s) reused, %d cropped", crop_cache.stats["hit"], crop_cache.stats["miss"])
+				crop_cache.cleanup()
 			if self._args.wait_keypress:
 				input("Waiting for keypress before returning...")
@@ -30,12 +30,12 @@ from .ImagePool import ImagePool
 _log = logging.getLogger(__spec__.name)
 
 class CalendarDefinition():
-	def __init__(self, json_filename):
+	def __init__(self, json_filename, full_rescan = False):
 		with open(json_filename) as f:
 			self._definition = json.load(f)
 		self._plausibilize()
 		if "image_pool" in self._definition:
-			self._image_pool = ImagePool(self._definition["image_pool"]["directories"])
+			self._image_pool = ImagePool(self._definition["image_pool"]["directories"], full_rescan = full_rescan, tag_sources = self._definition["image_pool"].get("tag_sources"))
 			self._plausibilize_image_pool()
 		else:
 			self._image_pool = None
@@ -62,6 +62,9 @@ class CalendarDefinition():
 			PlausibilizationTools.ensure_dict_with_keys("definition[\"pages\"]", page, [ "type" ])
 		if "image_pool" in self._definition:
 			PlausibilizationTools.ensure_dict_with_keys("definition[\"image_pool\"]", self._definition["image_pool"], [ "directories" ])
+			for tag_source in self._definition["image_pool"].get("tag_sources", [ ]):
+				if tag_source not in ImagePool.TAG_SOURCES:
+					raise IllegalCalendarDefinitionException("Unknown image pool tag source '%s', must be one of %s." % (tag_source, ", ".join(ImagePool.TAG_SOURCES)))
 
 		variant_names = set()
 		for variant in self.variants:
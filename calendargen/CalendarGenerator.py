@@ -23,16 +23,23 @@ import os
 import json
 import datetime
 import collections
-import pkgutil
+import random
+import logging
 from .Exceptions import IllegalCalendarDefinitionException
 from .DateTools import DateTools, AgeTools
-from .SVGProcessor import SVGProcessor
+from .SVGTemplateManifest import SVGTemplateManifest
 from .ImagePoolAssignment import ImagePoolAssignment
+from .Enums import ImagePlacementMethod
+
+_log = logging.getLogger(__spec__.name)
 
 class CalendarGenerator():
-	def __init__(self, calendar_definition, variant, previous_image_data = None):
+	def __init__(self, calendar_definition, variant, previous_image_data = None, placement_method = ImagePlacementMethod.Greedy, pool_candidates = None, rng = None):
 		self._def = calendar_definition
 		self._variant = variant
+		self._placement_method = placement_method
+		self._pool_candidates = pool_candidates
+		self._rng = rng if (rng is not None) else random.Random()
 		self._previous_image_data = previous_image_data
 		if self._previous_image_data is None:
 			self._previous_image_data = { }
@@ -42,6 +49,23 @@ class CalendarGenerator():
 		self._images = collections.OrderedDict()
 		self._image_pool_assignment = None
 
+	@property
+	def variant_name(self):
+		return self._variant["name"]
+
+	@property
+	def image_pool_assignment(self):
+		"""Assignment of pool images to all image slots of the calendar. Slots
+		may be filled before generating, e.g., jointly with other variants;
+		generate() only places images if slots are still unfilled."""
+		if self._image_pool_assignment is None:
+			try:
+				self._determine_image_dependencies()
+			finally:
+				self._page = None
+				self._page_no = None
+		return self._image_pool_assignment
+
 	@property
 	def current_layer(self):
 		return self._layers[-1]
@@ -54,12 +78,11 @@ class CalendarGenerator():
 		layer["transform"] = collections.OrderedDict()
 		self._layers.append(layer)
 
-	def _get_svg_processor(self, layer_name = None):
+	def _get_template_manifest(self, layer_name = None):
 		if layer_name is None:
 			layer_name = self.current_layer["template"]
 		svg_name = "%s_%s.svg" % (self._def.format, layer_name)
-		svg_data = pkgutil.get_data("calendargen.data", "templates/%s" % (svg_name))
-		return SVGProcessor(svg_data)
+		return SVGTemplateManifest.load(svg_name)
 
 	def _transform_text(self, key, value):
 		self._transform_noop(key)
@@ -111,16 +134,16 @@ class CalendarGenerator():
 		self._transform_text("header_text", text)
 
 	def _add_images(self, layer_name, *svg_names):
-		svg_processor = self._get_svg_processor(layer_name)
+		manifest = self._get_template_manifest(layer_name)
 		for svg_name in svg_names:
 			image_name = "%03d-%s-%s" % (self._page_no, layer_name, svg_name)
 			self._images[image_name] = collections.OrderedDict()
-			dimensions = svg_processor.get_image_dimensions(svg_name)
-			self._images[image_name]["placement"] = list(dimensions)
+			(width, height) = manifest.element_dimensions(svg_name)
+			self._images[image_name]["placement"] = [ width, height ]
 			self._images[image_name]["dimensions"] = None
 			self._images[image_name]["svg_name"] = svg_name
 			self._images[image_name]["filename"] = None
-			self._image_pool_assignment.add_slot(image_name, dimensions.x / dimensions.y, filled_by_filename = self._previous_image_data.get(image_name))
+			self._image_pool_assignment.add_slot(image_name, width / height, filled_by_filename = self._previous_image_data.get(image_name))
 
 	def _get_image_image_cover_page(self):
 		self._add_images("image_cover_page", "image")
@@ -129,11 +152,11 @@ class CalendarGenerator():
 		self._add_images("landscape_single_image", "image")
 
 	def _fill_images(self, *image_names):
-		svg_processor = self._get_svg_processor()
 		for svg_name in image_names:
 			image_name = "%03d-%s-%s" % (self._page_no, self.current_layer["template"], svg_name)
 			slot = self._image_pool_assignment[image_name]
-			gravity = slot.filled_by.tag_sets.get("gravity", [ None ]).pop()
+			# The candidate may be shared with other variants, do not modify its tags
+			gravity = next(iter(slot.filled_by.tag_sets.get("gravity", [ None ])))
 			self._transform_image(svg_name, image_name, gravity = gravity)
 
 	def _generate_image_cover_page(self):
@@ -223,7 +246,7 @@ class CalendarGenerator():
 		self._append_single_image()
 
 	def _determine_image_dependencies(self):
-		self._image_pool_assignment = ImagePoolAssignment(image_pool = self._def.image_pool, variant_name = self._variant["name"])
+		self._image_pool_assignment = ImagePoolAssignment(image_pool = self._def.image_pool, variant_name = self._variant["name"], placement_method = self._placement_method, pool_candidates = self._pool_candidates, rng = self._rng)
 		for (self._page_no, self._page) in enumerate(self._def.pages, 1):
 			handler_name = "_get_image_%s" % (self._page["type"])
 			handler = getattr(self, handler_name, None)
@@ -250,8 +273,7 @@ class CalendarGenerator():
 
 	def generate(self):
 		try:
-			self._determine_image_dependencies()
-			if self._image_pool_assignment.unfilled_count > 0:
+			if self.image_pool_assignment.unfilled_count > 0:
 				self._image_pool_assignment.attempt_placement()
 
 			if self._image_pool_assignment.unfilled_count > 0:
@@ -24,3 +24,7 @@ import enum
 class LayerCompositionMethod(enum.Enum):
 	AlphaCompose = "compose"
 	InvertedCompose = "inverted"
+
+class ImagePlacementMethod(enum.Enum):
+	Greedy = "greedy"
+	Solver = "solver"
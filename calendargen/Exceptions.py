@@ -25,3 +25,5 @@ class IllegalCalendarDefinitionException(ImplausibleDataException): pass
 class IllegalLayoutDefinitionException(ImplausibleDataException): pass
 class IllegalImagePoolActionException(CalendarException): pass
 class InvalidSVGException(CalendarException): pass
+class InkscapeRenderException(CalendarException): pass
+class InvalidJPEGException(CalendarException): pass
@@ -0,0 +1,133 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import contextlib
+import logging
+
+_log = logging.getLogger(__spec__.name)
+
+class FileCache():
+	"""Persistent content-addressed file store. Files are stored by the hash
+	of an arbitrary JSON-serializable key and are evicted least recently used
+	first once the cache exceeds its size limit. Entries are populated
+	atomically, so concurrent writers never expose partial files."""
+	def __init__(self, cache_dir, suffix = "", max_size_bytes = None):
+		self._cache_dir = os.path.expanduser(cache_dir)
+		self._suffix = suffix
+		self._max_size_bytes = max_size_bytes
+		self._stats = {
+			"hit":		0,
+			"miss":		0,
+		}
+
+	@property
+	def cache_dir(self):
+		return self._cache_dir
+
+	@property
+	def stats(self):
+		return dict(self._stats)
+
+	@staticmethod
+	def file_identity(filename):
+		"""Cheap identity of a file's content, used as part of cache keys."""
+		filename = os.path.realpath(filename)
+		try:
+			statres = os.stat(filename)
+			return [ filename, statres.st_size, statres.st_mtime_ns ]
+		except FileNotFoundError:
+			return [ filename, None, None ]
+
+	@staticmethod
+	def key(*key_parts):
+		serialized_key = json.dumps(key_parts, sort_keys = True, separators = (",", ":"))
+		return hashlib.sha256(serialized_key.encode("utf-8")).hexdigest()
+
+	def filename_for(self, key):
+		return "%s/%s/%s%s" % (self._cache_dir, key[:2], key, self._suffix)
+
+	def lookup(self, key):
+		filename = self.filename_for(key)
+		try:
+			# Touching the file marks it as recently used.
+			os.utime(filename)
+			self._stats["hit"] += 1
+			return filename
+		except FileNotFoundError:
+			self._stats["miss"] += 1
+			return None
+
+	def retrieve(self, key, destination_filename):
+		"""Places the cached file at the destination. Must only be called for
+		keys for which lookup() succeeded."""
+		filename = self.filename_for(key)
+		with contextlib.suppress(FileNotFoundError):
+			os.unlink(destination_filename)
+		try:
+			os.link(filename, destination_filename)
+		except OSError:
+			shutil.copyfile(filename, destination_filename)
+
+	def store(self, key, source_filename):
+		"""Copies the source file into the cache."""
+		filename = self.filename_for(key)
+		with contextlib.suppress(FileExistsError):
+			os.makedirs(os.path.dirname(filename))
+		temp_filename = "%s.%s.tmp" % (filename, uuid.uuid4())
+		try:
+			shutil.copyfile(source_filename, temp_filename)
+			os.replace(temp_filename, filename)
+		finally:
+			with contextlib.suppress(FileNotFoundError):
+				os.unlink(temp_filename)
+		return filename
+
+	def cleanup(self):
+		"""Evicts the least recently used entries until the cache is below its
+		size limit."""
+		if (self._max_size_bytes is None) or (not os.path.isdir(self._cache_dir)):
+			return
+		entries = [ ]
+		total_size = 0
+		for (walk_dir, subdirs, files) in os.walk(self._cache_dir):
+			for filename in files:
+				full_filename = walk_dir + "/" + filename
+				with contextlib.suppress(FileNotFoundError):
+					statres = os.stat(full_filename)
+					entries.append((statres.st_mtime, statres.st_size, full_filename))
+					total_size += statres.st_size
+		if total_size <= self._max_size_bytes:
+			return
+		entries.sort()
+		evicted_count = 0
+		for (mtime, size, filename) in entries:
+			if total_size <= self._max_size_bytes:
+				break
+			with contextlib.suppress(FileNotFoundError):
+				os.unlink(filename)
+				evicted_count += 1
+			total_size -= size
+		_log.debug("Evicted %d entries from cache %s, %d bytes remaining", evicted_count, self._cache_dir, total_size)
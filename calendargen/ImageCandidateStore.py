@@ -0,0 +1,299 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import math
+import bisect
+import random
+import datetime
+from .ImageTools import ImageTools
+
+class ImageCandidateStore():
+	"""Set of image placement candidates, indexed for the queries image
+	placement needs:
+
+	  * Candidates are bucketed into bands of similar aspect ratio. Whether a
+	    candidate fits a slot only depends on its aspect ratio, so entire bands
+	    are either accepted or rejected at once and only the candidates in the
+	    bands at the edge of the compatible range need to be looked at.
+	  * Candidates are sorted by snaptime, so removing all candidates that
+	    were shot within the exclusion window of another one is a bisection.
+	  * An inverted index maps every "grp" tag to its candidates.
+
+	Removing a candidate from its band is O(1). The snaptime and group
+	indices are cleaned up lazily; entries of candidates that are gone are
+	skipped when they are encountered and reused when the candidate is added
+	again."""
+
+	def __init__(self, candidates = None, exclusion_window_secs = 3600, min_usable_ratio = 0.75, band_factor = 1.05):
+		self._exclusion_window = datetime.timedelta(0, exclusion_window_secs)
+		self._min_usable_ratio = min_usable_ratio
+		self._log_band_factor = math.log(band_factor)
+		self._candidates = { }
+		# band_no -> [ candidates ], along with the lowest and highest aspect
+		# ratio that was ever put into the band
+		self._bands = { }
+		self._band_bounds = { }
+		# filename -> (band_no, index in band)
+		self._locations = { }
+		self._by_snaptime = [ ]
+		self._by_group = { }
+		if candidates is not None:
+			for candidate in candidates:
+				self._insert(candidate)
+			self._by_snaptime.sort()
+
+	@property
+	def exclusion_window(self):
+		return self._exclusion_window
+
+	def __len__(self):
+		return len(self._candidates)
+
+	def __iter__(self):
+		return iter(list(self._candidates.values()))
+
+	def __contains__(self, candidate):
+		return candidate.filename in self._candidates
+
+	def copy(self):
+		"""Returns an independent store with the same candidates. The indices
+		are copied instead of being built again."""
+		copy = ImageCandidateStore.__new__(ImageCandidateStore)
+		copy._exclusion_window = self._exclusion_window
+		copy._min_usable_ratio = self._min_usable_ratio
+		copy._log_band_factor = self._log_band_factor
+		copy._candidates = dict(self._candidates)
+		copy._bands = { band_no: list(band) for (band_no, band) in self._bands.items() }
+		copy._band_bounds = dict(self._band_bounds)
+		copy._locations = dict(self._locations)
+		copy._by_snaptime = list(self._by_snaptime)
+		copy._by_group = { grp: list(filenames) for (grp, filenames) in self._by_group.items() }
+		return copy
+
+	@staticmethod
+	def aspect_ratio(candidate):
+		return candidate.width / candidate.height
+
+	def usable_ratio(self, candidate, crop_aspect_ratio):
+		return ImageTools.usable_image_ratio(self.aspect_ratio(candidate), crop_aspect_ratio)
+
+	def fit_score(self, candidate, crop_aspect_ratio):
+		"""Fraction of the image that remains after cropping it to the aspect
+		ratio, 1.0 for a perfect fit."""
+		usable_ratio = self.usable_ratio(candidate, crop_aspect_ratio)
+		return min(usable_ratio, 1 / usable_ratio)
+
+	def compatible(self, candidate, crop_aspect_ratio):
+		return self.usable_ratio(candidate, crop_aspect_ratio) >= self._min_usable_ratio
+
+	def _band_no(self, aspect_ratio):
+		return math.floor(math.log(aspect_ratio) / self._log_band_factor)
+
+	def _insert(self, candidate):
+		if candidate.filename in self._candidates:
+			return False
+		self._candidates[candidate.filename] = candidate
+		aspect_ratio = self.aspect_ratio(candidate)
+		band_no = self._band_no(aspect_ratio)
+		band = self._bands.setdefault(band_no, [ ])
+		self._locations[candidate.filename] = (band_no, len(band))
+		band.append(candidate)
+		(low, high) = self._band_bounds.get(band_no, (aspect_ratio, aspect_ratio))
+		self._band_bounds[band_no] = (min(low, aspect_ratio), max(high, aspect_ratio))
+		if candidate.snaptime is not None:
+			self._by_snaptime.append((candidate.snaptime, candidate.filename))
+		for grp in candidate.tag_sets.get("grp", [ ]):
+			group = self._by_group.setdefault(grp, [ ])
+			# A candidate that was removed by itself is still in the index.
+			if candidate.filename not in group:
+				group.append(candidate.filename)
+		return True
+
+	def add(self, candidate):
+		if self._insert(candidate) and (candidate.snaptime is not None):
+			# _insert appended to the end, move the entry to its sorted place
+			# unless the stale entry of a removed candidate is still there.
+			entry = self._by_snaptime.pop()
+			index = bisect.bisect_left(self._by_snaptime, entry)
+			if (index == len(self._by_snaptime)) or (self._by_snaptime[index] != entry):
+				self._by_snaptime.insert(index, entry)
+
+	def restore(self, candidates):
+		"""Puts back candidates that were previously removed."""
+		for candidate in candidates:
+			self.add(candidate)
+
+	def remove(self, candidate):
+		"""Removes the candidate, returns True if it was present."""
+		if self._candidates.pop(candidate.filename, None) is None:
+			return False
+		(band_no, index) = self._locations.pop(candidate.filename)
+		band = self._bands[band_no]
+		last = band.pop()
+		if index < len(band):
+			band[index] = last
+			self._locations[last.filename] = (band_no, index)
+		return True
+
+	def _remove_filenames(self, filenames):
+		removed = [ ]
+		for filename in filenames:
+			candidate = self._candidates.get(filename)
+			if candidate is not None:
+				self.remove(candidate)
+				removed.append(candidate)
+		return removed
+
+	def remove_timewindow(self, snaptime):
+		"""Removes all candidates shot within the exclusion window around the
+		given snaptime."""
+		if snaptime is None:
+			return [ ]
+		start = bisect.bisect_left(self._by_snaptime, (snaptime - self._exclusion_window, ""))
+		end = start
+		max_ts = snaptime + self._exclusion_window
+		while (end < len(self._by_snaptime)) and (self._by_snaptime[end][0] <= max_ts):
+			end += 1
+		removed = self._remove_filenames(filename for (_, filename) in self._by_snaptime[start : end])
+		del self._by_snaptime[start : end]
+		return removed
+
+	def remove_group(self, grp):
+		return self._remove_filenames(self._by_group.pop(grp, [ ]))
+
+	def remove_with_dependencies(self, candidate, remove_timewindow = True, remove_groups = True):
+		"""Removes the candidate and everything that must not be placed along
+		with it: candidates within its exclusion time window and candidates
+		that share a group with it. The candidate does not need to be present
+		itself, e.g., when it was placed previously. Returns the list of
+		removed candidates."""
+		removed = [ candidate ] if self.remove(candidate) else [ ]
+		if remove_timewindow:
+			removed += self.remove_timewindow(candidate.snaptime)
+		if remove_groups:
+			for grp in candidate.tag_sets.get("grp", [ ]):
+				removed += self.remove_group(grp)
+		return removed
+
+	def conflicting(self, candidate1, candidate2):
+		"""True if the two candidates exclude each other."""
+		if candidate1.filename == candidate2.filename:
+			return True
+		if (candidate1.snaptime is not None) and (candidate2.snaptime is not None) and (abs(candidate1.snaptime - candidate2.snaptime) <= self._exclusion_window):
+			return True
+		return len(candidate1.tag_sets.get("grp", set()) & candidate2.tag_sets.get("grp", set())) > 0
+
+	def dependency_count(self, candidate):
+		"""Number of candidates that remove_with_dependencies() would take
+		out along with the candidate (possibly counting some twice)."""
+		count = 0
+		if candidate.snaptime is not None:
+			start = bisect.bisect_left(self._by_snaptime, (candidate.snaptime - self._exclusion_window, ""))
+			end = bisect.bisect_right(self._by_snaptime, (candidate.snaptime + self._exclusion_window, chr(0x10ffff)))
+			count += end - start
+		for grp in candidate.tag_sets.get("grp", [ ]):
+			count += len(self._by_group.get(grp, [ ]))
+		return count
+
+	def remove_when(self, filter_condition):
+		"""Removes all candidates for which the condition holds. This is a
+		linear scan and intended for one-time filtering only."""
+		return self._remove_filenames([ candidate.filename for candidate in self._candidates.values() if filter_condition(candidate) ])
+
+	def _compatible_bands(self, crop_aspect_ratio):
+		"""Yields (band, complete) tuples of all bands that contain compatible
+		candidates. If complete is True, all candidates of the band are
+		compatible, otherwise they need to be checked one by one. Whether an
+		image fits is monotonic in its aspect ratio, so checking the lowest and
+		highest ratio of a band suffices."""
+		for (band_no, band) in self._bands.items():
+			if len(band) == 0:
+				continue
+			(low, high) = self._band_bounds[band_no]
+			low_fits = ImageTools.usable_image_ratio(low, crop_aspect_ratio) >= self._min_usable_ratio
+			high_fits = ImageTools.usable_image_ratio(high, crop_aspect_ratio) >= self._min_usable_ratio
+			if low_fits and high_fits:
+				yield (band, True)
+			elif low_fits or high_fits:
+				yield (band, False)
+
+	def find_compatible(self, crop_aspect_ratio):
+		"""Returns a list of all candidates that fit the crop aspect ratio."""
+		candidates = [ ]
+		for (band, complete) in self._compatible_bands(crop_aspect_ratio):
+			if complete:
+				candidates += band
+			else:
+				candidates += [ candidate for candidate in band if self.compatible(candidate, crop_aspect_ratio) ]
+		return candidates
+
+	def count_compatible(self, crop_aspect_ratio):
+		count = 0
+		for (band, complete) in self._compatible_bands(crop_aspect_ratio):
+			if complete:
+				count += len(band)
+			else:
+				count += sum(1 for candidate in band if self.compatible(candidate, crop_aspect_ratio))
+		return count
+
+	def choose_compatible(self, crop_aspect_ratio, rng = random):
+		"""Picks one of the candidates that fit the crop aspect ratio uniformly
+		at random without building the list of all of them. Returns None if
+		there is no such candidate."""
+		choices = [ ]
+		total = 0
+		for (band, complete) in self._compatible_bands(crop_aspect_ratio):
+			if not complete:
+				band = [ candidate for candidate in band if self.compatible(candidate, crop_aspect_ratio) ]
+			if len(band) > 0:
+				choices.append(band)
+				total += len(band)
+		if total == 0:
+			return None
+		index = rng.randrange(total)
+		for band in choices:
+			if index < len(band):
+				return band[index]
+			index -= len(band)
+
+if __name__ == "__main__":
+	import time
+	import collections
+	Candidate = collections.namedtuple("Candidate", [ "filename", "snaptime", "width", "height", "tag_sets" ])
+	rng = random.Random(0)
+	t0 = datetime.datetime(2021, 1, 1)
+	candidates = [ ]
+	for i in range(20000):
+		(width, height) = rng.choice([ (4000, 3000), (3000, 4000), (6000, 4000), (4000, 6000), (1920, 1080), (3000, 3000) ])
+		tag_sets = { "grp": set([ "grp%d" % (i // 5) ]) } if (i % 3 == 0) else { }
+		candidates.append(Candidate(filename = "img%05d.jpg" % (i), snaptime = t0 + datetime.timedelta(0, i * 1800), width = width, height = height, tag_sets = tag_sets))
+
+	start = time.time()
+	store = ImageCandidateStore(candidates)
+	print("Indexed %d candidates in %.3f sec, %d bands" % (len(store), time.time() - start, len(store._bands)))
+	start = time.time()
+	placed = 0
+	for slot_no in range(1000):
+		choice = store.choose_compatible(rng.choice([ 16 / 9, 4 / 3, 3 / 4 ]), rng = rng)
+		if choice is not None:
+			store.remove_with_dependencies(choice)
+			placed += 1
+	print("Placed %d images in %.3f sec, %d candidates remaining" % (placed, time.time() - start, len(store)))
@@ -0,0 +1,125 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import subprocess
+import threading
+import collections
+import logging
+from .JobServer import Job
+from .FileCache import FileCache
+from .CmdlineEscape import CmdlineEscape
+
+_log = logging.getLogger(__spec__.name)
+
+CroppedImage = collections.namedtuple("CroppedImage", [ "job", "filename" ])
+
+class ImageCropper():
+	"""Crops source images for placement. Every distinct crop is produced by
+	exactly one job per run, no matter how many pages or variants place the
+	same image into the same geometry; all of them depend on that one job and
+	reference the same cropped file. If a crop cache is given, crops are
+	additionally kept across runs.
+
+	When the size of the placement in the rendered page is known, crops are
+	downscaled to that size times the oversampling factor, so inkscape never
+	has to handle more pixels than end up in the rendered page. Images are
+	never upscaled.
+
+	ImageMagick uses all cores for a single crop by default. Crops are limited
+	to the given number of threads instead, which their jobs declare, so the
+	JobServer can keep the total number of threads within its budget.
+
+	Like the SharedLayerRegistry, all crops must be requested before any of
+	the returned jobs is handed to the JobServer."""
+
+	# Increase whenever the crop command changes in a way that makes
+	# previously cached crops invalid.
+	_CACHE_VERSION = 2
+
+	# Cropping a single photo barely gets faster with more threads than this.
+	MAX_THREADS = 4
+
+	def __init__(self, temp_dir, crop_cache = None, oversampling = 1.0, threads = 1):
+		self._temp_dir = temp_dir
+		self._crop_cache = crop_cache
+		self._oversampling = oversampling
+		self._threads = threads
+		self._crop_env = dict(os.environ, MAGICK_THREAD_LIMIT = str(threads))
+		self._lock = threading.Lock()
+		self._crops = { }
+		self._requested_count = 0
+
+	@property
+	def oversampling(self):
+		return self._oversampling
+
+	@property
+	def requested_count(self):
+		return self._requested_count
+
+	@property
+	def unique_count(self):
+		return len(self._crops)
+
+	def _crop(self, crop_cmd, cache_key, cropped_filename):
+		_log.debug("Crop image: %s", CmdlineEscape().cmdline(crop_cmd))
+		subprocess.check_call(crop_cmd, env = self._crop_env)
+		if cache_key is not None:
+			self._crop_cache.store(cache_key, cropped_filename)
+
+	def _output_dimensions(self, target_dimensions, placement_pixels):
+		if placement_pixels is None:
+			return None
+		width = round(placement_pixels[0] * self._oversampling)
+		height = round(placement_pixels[1] * self._oversampling)
+		if (width >= target_dimensions[0]) or (height >= target_dimensions[1]):
+			return None
+		return (width, height)
+
+	def _create_crop(self, key, image_filename, target_dimensions, gravity, auto_gamma, output_dimensions, memory):
+		cropped_filename = "%s/cropped_%s.jpg" % (self._temp_dir, key)
+		if (self._crop_cache is not None) and (self._crop_cache.lookup(key) is not None):
+			_log.trace("Crop of %s found in crop cache: %s", image_filename, key)
+			job = Job(self._crop_cache.retrieve, (key, cropped_filename), info = "crop_from_cache")
+		else:
+			crop_cmd = [ "convert", image_filename ]
+			if auto_gamma:
+				crop_cmd += [ "-auto-gamma" ]
+			crop_cmd += [ "-gravity", gravity, "-crop", "%dx%d+0+0" % (target_dimensions[0], target_dimensions[1]), "+repage" ]
+			if output_dimensions is not None:
+				crop_cmd += [ "-resize", "%dx%d" % (output_dimensions[0], output_dimensions[1]) ]
+			crop_cmd += [ cropped_filename ]
+			cache_key = key if (self._crop_cache is not None) else None
+			job = Job(self._crop, (crop_cmd, cache_key, cropped_filename), info = "crop-image", memory = memory, threads = self._threads)
+		return CroppedImage(job = job, filename = cropped_filename)
+
+	def crop(self, image_filename, target_dimensions, gravity = "center", auto_gamma = True, placement_pixels = None, memory = 0):
+		"""Returns a CroppedImage whose job produces the cropped image file.
+		The returned job may be shared with other users of the same crop.
+		placement_pixels is the size of the placement in the rendered page."""
+		output_dimensions = self._output_dimensions(target_dimensions, placement_pixels)
+		key = FileCache.key(self._CACHE_VERSION, FileCache.file_identity(image_filename), list(target_dimensions), gravity, auto_gamma, output_dimensions)
+		with self._lock:
+			self._requested_count += 1
+			if key not in self._crops:
+				self._crops[key] = self._create_crop(key, image_filename, target_dimensions, gravity, auto_gamma, output_dimensions, memory)
+			return self._crops[key]
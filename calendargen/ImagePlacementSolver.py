@@ -0,0 +1,174 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import random
+import collections
+import logging
+
+_log = logging.getLogger(__spec__.name)
+
+class _RestartLimitReached(Exception):
+	pass
+
+class ImagePlacementSolver():
+	"""Fills slots with candidates by backtracking search, so that an
+	assignment is found whenever one exists (within the node budget) even if
+	picking images greedily would paint itself into a corner.
+
+	Slots with the same aspect ratio are interchangeable and are treated as
+	one class that needs a number of images. The search always continues with
+	the class that has the least spare candidates (minimum remaining values),
+	and after every tentative placement checks that each remaining class still
+	has enough compatible candidates and that every forced image is still
+	available (forward checking). Candidates are tried in order of how much
+	of the image survives cropping, so the first assignment found uses
+	well-fitting images. Among equally well fitting candidates, those that
+	exclude the fewest other candidates (time window and group) come first,
+	remaining ties are broken randomly.
+
+	Chronological backtracking can get stuck in a hopeless part of the search
+	space for a long time. Therefore the search is restarted with new random
+	tie-breaks whenever it exceeds its node limit, which doubles on every
+	restart, until the overall node budget is used up.
+
+	Forced images are always tried first. With require_forced, an assignment
+	that leaves any of them out is not accepted. The candidate store passed
+	in is not modified."""
+
+	def __init__(self, candidates, slots, forced_images = None, require_forced = True, rng = random, node_budget = 20000, restart_nodes = 250):
+		self._initial_candidates = candidates
+		self._candidates = None
+		self._rng = rng
+		self._node_budget = node_budget
+		self._restart_nodes = restart_nodes
+		self._restart_limit = None
+		self._nodes = 0
+		self._forced_images = list(forced_images) if (forced_images is not None) else [ ]
+		self._require_forced = require_forced
+		self._slot_classes = collections.OrderedDict()
+		for slot in slots:
+			self._slot_classes.setdefault(slot.aspect_ratio, [ ]).append(slot)
+		self._dependency_counts = { candidate.filename: candidates.dependency_count(candidate) for candidate in candidates }
+		self._domains = None
+		self._placed = None
+
+	@property
+	def nodes(self):
+		return self._nodes
+
+	def _domain(self, aspect_ratio):
+		forced_filenames = set(candidate.filename for candidate in self._forced_images)
+		domain = [ ((candidate.filename not in forced_filenames), -self._candidates.fit_score(candidate, aspect_ratio), self._dependency_counts[candidate.filename], self._rng.random(), candidate) for candidate in self._candidates.find_compatible(aspect_ratio) ]
+		domain.sort(key = lambda entry: entry[:4])
+		return [ entry[4] for entry in domain ]
+
+	def _forced_feasible(self, open_slots):
+		placed_filenames = set(candidate.filename for (aspect_ratio, candidate) in self._placed)
+		open_forced = [ candidate for candidate in self._forced_images if candidate.filename not in placed_filenames ]
+		if len(open_forced) > sum(open_slots.values()):
+			return False
+		for candidate in open_forced:
+			if candidate not in self._candidates:
+				return False
+			if not any(self._candidates.compatible(candidate, aspect_ratio) for (aspect_ratio, count) in open_slots.items() if count > 0):
+				return False
+		return True
+
+	def _select_class(self, open_slots):
+		"""Returns the aspect ratio of the slot class to fill next, None if all
+		slots are filled and False if some class can no longer be filled."""
+		selected = None
+		selected_slack = None
+		for (aspect_ratio, count) in open_slots.items():
+			if count == 0:
+				continue
+			slack = self._candidates.count_compatible(aspect_ratio) - count
+			if slack < 0:
+				return False
+			if (selected_slack is None) or (slack < selected_slack):
+				(selected, selected_slack) = (aspect_ratio, slack)
+		return selected
+
+	def _search(self, open_slots):
+		self._nodes += 1
+		if self._nodes > self._restart_limit:
+			raise _RestartLimitReached()
+		if self._require_forced and (not self._forced_feasible(open_slots)):
+			return False
+		aspect_ratio = self._select_class(open_slots)
+		if aspect_ratio is None:
+			return True
+		elif aspect_ratio is False:
+			return False
+
+		open_slots[aspect_ratio] -= 1
+		for candidate in self._domains[aspect_ratio]:
+			if candidate not in self._candidates:
+				continue
+			removed = self._candidates.remove_with_dependencies(candidate)
+			self._placed.append((aspect_ratio, candidate))
+			if self._search(open_slots):
+				return True
+			self._placed.pop()
+			self._candidates.restore(removed)
+		open_slots[aspect_ratio] += 1
+		return False
+
+	def _restart(self, open_slots, node_limit):
+		self._candidates = self._initial_candidates.copy()
+		self._domains = { aspect_ratio: self._domain(aspect_ratio) for aspect_ratio in self._slot_classes }
+		self._placed = [ ]
+		self._restart_limit = self._nodes + node_limit
+		return self._search(dict(open_slots))
+
+	def solve(self):
+		"""Returns a dictionary that maps slot names to candidates if all slots
+		could be filled, None otherwise."""
+		if self._require_forced:
+			for (index, candidate1) in enumerate(self._forced_images):
+				for candidate2 in self._forced_images[index + 1 : ]:
+					if self._initial_candidates.conflicting(candidate1, candidate2):
+						_log.debug("Forced images %s and %s exclude each other.", candidate1.filename, candidate2.filename)
+						return None
+
+		open_slots = { aspect_ratio: len(slots) for (aspect_ratio, slots) in self._slot_classes.items() }
+		node_limit = self._restart_nodes
+		restart_count = 0
+		while True:
+			try:
+				success = self._restart(open_slots, min(node_limit, self._node_budget - self._nodes))
+				break
+			except _RestartLimitReached:
+				if self._nodes >= self._node_budget:
+					_log.debug("Placement search gave up after %d nodes and %d restarts.", self._nodes, restart_count)
+					return None
+				node_limit *= 2
+				restart_count += 1
+		if not success:
+			_log.debug("Placement search space exhausted after %d nodes, no complete assignment exists.", self._nodes)
+			return None
+
+		assignment = { }
+		slots = { aspect_ratio: iter(slots) for (aspect_ratio, slots) in self._slot_classes.items() }
+		for (aspect_ratio, candidate) in self._placed:
+			assignment[next(slots[aspect_ratio]).name] = candidate
+		_log.debug("Placement search found assignment after %d nodes and %d restarts.", self._nodes, restart_count)
+		return assignment
@@ -20,20 +20,56 @@
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
 import os
-import time
-import json
+import threading
+import logging
 from .ImageTools import ImageTools
+from .JPEGMetadata import JPEGMetadata
+from .Exceptions import InvalidJPEGException
 from .JobServer import JobServer, Job
 from .XMPScanner import XMPScanner
+from .ImagePoolCache import ImagePoolCache
+from .Inotify import Inotify
+
+_log = logging.getLogger(__spec__.name)
 
 class ImagePool():
-	_CACHEFILE = os.path.expanduser("~/.cache/calendargen.json")
-	_SCAN_VERSION = 0
+	"""Metadata of all images below a set of directories, kept up to date in a
+	persistent cache. Directories whose modification time (and that of their
+	geeqie metadata directory) did not change since the last scan are not
+	listed again and the files in them are not checked individually. Modifying
+	an image in place does not change the directory's modification time; use
+	full_rescan to pick up such changes.
+
+	Tags are read from the sources given in tag_sources, in order of
+	precedence: "sidecar" (geeqie XMP sidecar file), "xmp" (XMP packet
+	embedded in the JPEG) and "iptc" (IPTC keywords embedded in the JPEG).
+	The first source that yields any tags is used. Embedded tags are read
+	along with the image dimensions, so without "sidecar", scanning an image
+	takes a single read."""
+	TAG_SOURCES = [ "sidecar", "xmp", "iptc" ]
+	_DEFAULT_TAG_SOURCES = [ "sidecar" ]
+	_SCAN_VERSION = 1
+	_SCAN_CHUNK_SIZE = 64
+	_WATCH_MASK = Inotify.IN_CREATE | Inotify.IN_DELETE | Inotify.IN_MOVED_FROM | Inotify.IN_MOVED_TO | Inotify.IN_CLOSE_WRITE | Inotify.IN_DELETE_SELF
 
-	def __init__(self, directories):
+	def __init__(self, directories, full_rescan = False, tag_sources = None):
+		# Entries are stored from JobServer worker threads.
+		self._entries_lock = threading.Lock()
 		self._entries = { }
+		self._directories = directories
+		self._full_rescan = full_rescan
+		self._tag_sources = list(tag_sources or self._DEFAULT_TAG_SOURCES)
+		self._scan_queue = [ ]
 		self.scan_directories(directories)
 
+	def _entry_current(self, entry):
+		# Entries from before tag sources were configurable used the sidecar.
+		return (entry["version"] == self._SCAN_VERSION) and (entry.get("tag_sources", self._DEFAULT_TAG_SOURCES) == self._tag_sources)
+
+	def _set_entry(self, filename, entry):
+		with self._entries_lock:
+			self._entries[filename] = entry
+
 	@staticmethod
 	def _get_mtime(filename):
 		try:
@@ -45,65 +81,252 @@ class ImagePool():
 		return [ self._get_mtime(filename) for filename in filenames ]
 
 	@staticmethod
-	def _get_geeqie_metadata_filename(image_filename):
-		return os.path.expanduser("~/.local/share/geeqie/metadata") + image_filename + ".gq.xmp"
-
-	def _scan_metadata(self, filename, mtimes, cache_data):
-		new_entry = {
-			"mtimes":	mtimes,
-			"version":	self._SCAN_VERSION,
-			"tags":		XMPScanner(self._get_geeqie_metadata_filename(filename)).scan(),
-			"meta":		ImageTools.get_image_stats(filename),
-		}
-		cache_data[filename] = new_entry
-		self._entries[filename] = new_entry
-
-	def _scan_file(self, filename, cache_data, job_server):
+	def _get_geeqie_metadata_dirname(image_dirname):
+		return os.path.expanduser("~/.local/share/geeqie/metadata") + image_dirname
+
+	@classmethod
+	def _get_geeqie_metadata_filename(cls, image_filename):
+		return cls._get_geeqie_metadata_dirname(image_filename) + ".gq.xmp"
+
+	@classmethod
+	def _get_tags(cls, tag_sources, sidecar_tags, jpeg_metadata):
+		for tag_source in tag_sources:
+			if tag_source == "sidecar":
+				tags = sidecar_tags
+			elif jpeg_metadata is None:
+				continue
+			elif (tag_source == "xmp") and (jpeg_metadata.xmp is not None):
+				tags = XMPScanner.scan_data(jpeg_metadata.xmp)
+			elif tag_source == "iptc":
+				tags = XMPScanner.parse_tags(jpeg_metadata.iptc_keywords)
+			else:
+				continue
+			if len(tags) > 0:
+				return tags
+		return { }
+
+	@classmethod
+	def _scan_metadata(cls, scan_items, tag_sources):
+		# Runs in a worker process, must not touch any instance state. Scans a
+		# whole chunk of (filename, mtimes) items at once to amortize the cost
+		# of dispatching to the process pool. Returns (filename, entry, error)
+		# tuples, so that a single broken file (image or sidecar) does not fail
+		# the whole chunk.
+		if "sidecar" in tag_sources:
+			(all_sidecar_tags, sidecar_errors) = XMPScanner.scan_many(cls._get_geeqie_metadata_filename(filename) for (filename, mtimes) in scan_items)
+		else:
+			(all_sidecar_tags, sidecar_errors) = ({ }, { })
+		results = [ ]
+		for (filename, mtimes) in scan_items:
+			try:
+				sidecar_filename = cls._get_geeqie_metadata_filename(filename)
+				if sidecar_filename in sidecar_errors:
+					raise sidecar_errors[sidecar_filename]
+				try:
+					jpeg_metadata = JPEGMetadata(filename)
+				except InvalidJPEGException:
+					jpeg_metadata = None
+				sidecar_tags = all_sidecar_tags.get(sidecar_filename, { })
+				entry = {
+					"mtimes":		mtimes,
+					"version":		cls._SCAN_VERSION,
+					"tag_sources":	tag_sources,
+					"tags":			cls._get_tags(tag_sources, sidecar_tags, jpeg_metadata),
+					"meta":			ImageTools.get_image_metadata(filename, jpeg_metadata = jpeg_metadata),
+				}
+				results.append((filename, entry, None))
+			except Exception as e:
+				results.append((filename, None, "%s: %s" % (e.__class__.__name__, str(e))))
+		return results
+
+	def _store_metadata(self, scan_job, cache):
+		for (filename, new_entry, error) in scan_job.result:
+			if new_entry is None:
+				_log.error("Failed to scan %s: %s", filename, error)
+				continue
+			cache.put(filename, new_entry)
+			self._set_entry(filename, new_entry)
+
+	def _flush_scan_queue(self, job_server, cache):
+		if len(self._scan_queue) == 0:
+			return
+		(scan_items, self._scan_queue) = (self._scan_queue, [ ])
+		scan_job = Job(self._scan_metadata, (scan_items, self._tag_sources), info = "scan_metadata", cpu_bound = True)
+		scan_job.then(Job(self._store_metadata, (scan_job, cache), info = "store_metadata"))
+		job_server.add_jobs(scan_job)
+
+	@staticmethod
+	def _get_cached_entry(filename, cache, cached_entries = None):
+		# cached_entries only holds the entries below the scanned directory,
+		# symlinked images that resolve elsewhere need to be looked up
+		# individually.
+		cached_entry = None
+		if cached_entries is not None:
+			cached_entry = cached_entries.get(filename)
+		if cached_entry is None:
+			cached_entry = cache.get(filename)
+		return cached_entry
+
+	def _scan_file(self, filename, cache, job_server, cached_entries = None):
 		filename = os.path.realpath(filename)
-		all_dependent_files = [ filename, self._get_geeqie_metadata_filename(filename) ]
+		all_dependent_files = [ filename ]
+		if "sidecar" in self._tag_sources:
+			all_dependent_files.append(self._get_geeqie_metadata_filename(filename))
 		mtimes = self._get_mtimes(all_dependent_files)
-		cached_entry = cache_data.get(filename)
+		cached_entry = self._get_cached_entry(filename, cache, cached_entries)
 		if cached_entry is not None:
-			if (cached_entry["mtimes"] == mtimes) and (cached_entry["version"] == self._SCAN_VERSION):
+			if (cached_entry["mtimes"] == mtimes) and self._entry_current(cached_entry):
 				# Still accurate, use it.
-				self._entries[filename] = cached_entry
+				self._set_entry(filename, cached_entry)
 				return
 
-		# Either not cached or
-		job_server.add_jobs(Job(self._scan_metadata, (filename, mtimes, cache_data)))
+		# Either not cached or outdated, queue it for scanning.
+		self._scan_queue.append((filename, mtimes))
+		if len(self._scan_queue) >= self._SCAN_CHUNK_SIZE:
+			self._flush_scan_queue(job_server, cache)
 
-	def _scan_directory(self, dirname, cache_data, job_server):
-		for (walk_dir, subdirs, files) in os.walk(dirname):
-			for filename in files:
-				(base, ext) = os.path.splitext(filename)
-				if ext.lower() not in [ ".jpg", ".jpeg" ]:
-					continue
-				full_filename = walk_dir + "/" + filename
-				self._scan_file(full_filename, cache_data, job_server)
+	@staticmethod
+	def _list_directory(dirname):
+		files = [ ]
+		subdirs = [ ]
+		for entry in os.scandir(dirname):
+			if entry.is_dir(follow_symlinks = False):
+				subdirs.append(entry.path)
+			else:
+				(base, ext) = os.path.splitext(entry.name)
+				if ext.lower() in [ ".jpg", ".jpeg" ]:
+					files.append(os.path.realpath(entry.path) if entry.is_symlink() else entry.path)
+		return (sorted(files), sorted(subdirs))
+
+	def _use_cached_file(self, filename, cache, job_server, cached_entries):
+		cached_entry = self._get_cached_entry(filename, cache, cached_entries)
+		if (cached_entry is not None) and self._entry_current(cached_entry):
+			self._set_entry(filename, cached_entry)
+		else:
+			self._scan_file(filename, cache, job_server, cached_entries = cached_entries)
+
+	def _remove_directory(self, dirname, cache):
+		prefix = dirname + "/"
+		with self._entries_lock:
+			for filename in [ filename for filename in self._entries if filename.startswith(prefix) ]:
+				del self._entries[filename]
+		cache.delete_below(dirname)
+
+	def _scan_directory(self, dirname, cache, job_server, force = False, recursive = True):
+		# Fetch all cached entries and directory snapshots at once instead of
+		# querying them file by file. When forced, the given directory (but not
+		# its subdirectories) is listed and its files are checked even if the
+		# directory itself appears unchanged.
+		dirname = os.path.realpath(dirname)
+		cached_entries = cache.get_below(dirname)
+		snapshots = cache.get_directories_below(dirname)
+		(skipped_count, listed_count) = (0, 0)
+		pending_dirs = [ dirname ]
+		while len(pending_dirs) > 0:
+			current_dir = pending_dirs.pop()
+			mtimes = self._get_mtimes([ current_dir, self._get_geeqie_metadata_dirname(current_dir) ])
+			snapshot = snapshots.get(current_dir)
+			unchanged = (snapshot is not None) and (snapshot[0] == mtimes)
+			if unchanged and (not self._full_rescan) and (not (force and (current_dir == dirname))):
+				# Directory unchanged, trust the cached entries of its files.
+				(_, files, subdirs) = snapshot
+				for filename in files:
+					self._use_cached_file(filename, cache, job_server, cached_entries)
+				skipped_count += 1
+			else:
+				try:
+					(files, subdirs) = self._list_directory(current_dir)
+				except FileNotFoundError:
+					(files, subdirs) = ([ ], [ ])
+				for filename in files:
+					self._scan_file(filename, cache, job_server, cached_entries = cached_entries)
+				if snapshot is not None:
+					removed_files = set(snapshot[1]) - set(files)
+					with self._entries_lock:
+						for filename in removed_files:
+							self._entries.pop(filename, None)
+					cache.delete(removed_files)
+					for removed_dir in set(snapshot[2]) - set(subdirs):
+						self._remove_directory(removed_dir, cache)
+				cache.put_directory(current_dir, mtimes, files, subdirs)
+				listed_count += 1
+			if recursive:
+				pending_dirs += subdirs
+		_log.debug("Scanned %s: %d directories listed, %d unchanged", dirname, listed_count, skipped_count)
 
 	def _scan_action(self, callback):
-		try:
-			with open(self._CACHEFILE) as f:
-				cache_data = json.load(f)
-		except (FileNotFoundError, json.decoder.JSONDecodeError):
-			cache_data = { }
-		with JobServer() as job_server:
-			callback(cache_data, job_server)
-		with open(self._CACHEFILE, "w") as f:
-			json.dump(cache_data, f)
+		with ImagePoolCache() as cache, JobServer() as job_server:
+			try:
+				callback(cache, job_server)
+			finally:
+				self._flush_scan_queue(job_server, cache)
 
 	def scan_files(self, filenames):
-		def callback(cache_data, job_server):
+		def callback(cache, job_server):
 			for filename in filenames:
-				self._scan_file(filename, cache_data, job_server)
+				self._scan_file(filename, cache, job_server)
 		self._scan_action(callback)
 
-	def scan_directories(self, directories):
-		def callback(cache_data, job_server):
+	def scan_directories(self, directories, force = False, recursive = True):
+		def callback(cache, job_server):
 			for directory in directories:
-				self._scan_directory(directory, cache_data, job_server)
+				self._scan_directory(directory, cache, job_server, force = force, recursive = recursive)
 		self._scan_action(callback)
 
+	def _image_dirname(self, path):
+		# Maps a watched path (image directory or geeqie metadata directory)
+		# to the image directory it belongs to.
+		geeqie_root = self._get_geeqie_metadata_dirname("")
+		if path.startswith(geeqie_root + "/"):
+			return path[len(geeqie_root):]
+		return path
+
+	def _add_watches(self, inotify, dirname):
+		for (walk_dir, subdirs, files) in os.walk(dirname):
+			for watch_dir in [ walk_dir, self._get_geeqie_metadata_dirname(walk_dir) ]:
+				if os.path.isdir(watch_dir):
+					inotify.add_watch(watch_dir, self._WATCH_MASK)
+
+	def watch(self, debounce_secs = 2):
+		"""Keeps the pool and its cache up to date until interrupted. Changes
+		are collected until no further change happened for debounce_secs, then
+		all affected directories are rescanned."""
+		directories = [ os.path.realpath(directory) for directory in self._directories ]
+		with Inotify() as inotify:
+			for directory in directories:
+				self._add_watches(inotify, directory)
+			_log.info("Watching %d directories for changes", len(directories))
+			while True:
+				events = inotify.read_events()
+				(changed_dirs, new_dirs, overflow) = (set(), set(), False)
+				while len(events) > 0:
+					for event in events:
+						if event.mask & Inotify.IN_Q_OVERFLOW:
+							overflow = True
+						elif event.path is not None:
+							image_dir = self._image_dirname(event.path)
+							changed_dirs.add(image_dir)
+							if (event.mask & Inotify.IN_ISDIR) and (event.mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO)):
+								new_dirs.add(image_dir + "/" + event.name)
+					events = inotify.read_events(timeout = debounce_secs)
+
+				if overflow:
+					_log.warning("Change events were lost, rescanning all directories")
+					self.scan_directories(directories, force = True)
+				else:
+					for new_dir in new_dirs:
+						if os.path.isdir(new_dir):
+							self._add_watches(inotify, new_dir)
+					# The geeqie metadata directory may have been created since
+					# watches were added.
+					for changed_dir in changed_dirs:
+						geeqie_dir = self._get_geeqie_metadata_dirname(changed_dir)
+						if os.path.isdir(geeqie_dir):
+							inotify.add_watch(geeqie_dir, self._WATCH_MASK)
+					self.scan_directories(sorted(changed_dir for changed_dir in changed_dirs if os.path.isdir(changed_dir)), force = True, recursive = False)
+					self.scan_directories(sorted(new_dirs))
+				_log.info("Rescanned %d changed directories, %d images in pool", len(changed_dirs), len(self._entries))
+
 	def __getitem__(self, filename):
 		filename = os.path.realpath(filename)
 		return self._entries[filename]
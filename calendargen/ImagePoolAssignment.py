@@ -24,7 +24,9 @@ import logging
 import collections
 import random
 from .Exceptions import IllegalImagePoolActionException
-from .ImageTools import ImageTools
+from .ImageCandidateStore import ImageCandidateStore
+from .ImagePlacementSolver import ImagePlacementSolver
+from .Enums import ImagePlacementMethod
 
 PlacementResult = collections.namedtuple("PlacementResults", [ "total_slots", "total_filled", "remaining_open" ])
 ImagePoolCandidate = collections.namedtuple("ImagePoolCandidate", [ "filename", "snaptime", "width", "height", "tag_sets" ])
@@ -70,10 +72,13 @@ class ImagePoolSlot():
 			return "Slot<%s, %.3f: %s>" % (self.name, self.aspect_ratio, self.filled_by.filename)
 
 class ImagePoolAssignment():
-	def __init__(self, image_pool, variant_name = None, exclusion_window_secs = 3600):
+	def __init__(self, image_pool, variant_name = None, exclusion_window_secs = 3600, placement_method = ImagePlacementMethod.Greedy, pool_candidates = None, rng = random):
 		self._image_pool = image_pool
 		self._variant_name = variant_name
 		self._exclusion_window_secs = exclusion_window_secs
+		self._placement_method = placement_method
+		self._pool_candidates = pool_candidates
+		self._rng = rng
 		self._slots = collections.OrderedDict()
 		self._candidates = None
 		self._initial_candidates = None
@@ -86,73 +91,62 @@ class ImagePoolAssignment():
 				count += 1
 		return count
 
+	@property
+	def variant_name(self):
+		return self._variant_name
+
 	@property
 	def slots(self):
 		return iter(self._slots.values())
 
-	def _compatible_aspect_ratio(self, candidate, crop_aspect_ratio):
-		candidate_aspect_ratio = candidate.width / candidate.height
-		coverage_ratio = ImageTools.usable_image_ratio(candidate_aspect_ratio, crop_aspect_ratio)
-		return coverage_ratio >= 0.75
-
-	def _find_candidates(self, filter_condition, source = None):
-		if source is None:
-			source = self._candidates
-		return [ candidate for candidate in source if filter_condition(candidate) ]
-
-	def _remove_candidate_when(self, filter_condition):
-		keep = [ ]
-		removed = [ ]
-		for candidate in self._candidates:
-			if filter_condition(candidate):
-				removed.append(candidate)
-			else:
-				keep.append(candidate)
-		self._candidates = keep
-		return removed
-
-	def _remove_candidate_with_dependencies(self, filter_condition, remove_timewindow = True, remove_groups = True):
-		removed = self._remove_candidate_when(filter_condition)
-		for removed_candidate in removed:
-			if remove_timewindow:
-				min_ts = removed.snaptime - datetime.timedelta(0, self._exclusion_window_secs)
-				max_ts = removed.snaptime + datetime.timedelta(0, self._exclusion_window_secs)
-				self._remove_candidate_when(lambda candidate: min_ts <= candidate.snaptime <= max_ts)
-			if remove_groups:
-				for remove_grp in removed_candidate.tag_sets.get("grp", [ ]):
-					self._remove_candidate_when(lambda candidate: remove_grp in candidate.tag_sets.get("grp", [ ]))
-
-	def _create_candidate(self, filename, meta):
+	@staticmethod
+	def _create_candidate(filename, meta):
 		width = meta["meta"]["geometry"][0]
 		height = meta["meta"]["geometry"][1]
-		snaptime = datetime.datetime.strptime(meta["meta"]["snaptime"], "%Y-%m-%dT%H:%M:%S")
+		if meta["meta"].get("snaptime") is not None:
+			snaptime = datetime.datetime.strptime(meta["meta"]["snaptime"], "%Y-%m-%dT%H:%M:%S")
+		else:
+			snaptime = None
 		tag_sets = { name: set(items) for (name, items) in meta["tags"].items() }
 		candidate = ImagePoolCandidate(filename = filename, snaptime = snaptime, width = width, height = height, tag_sets = tag_sets)
 		return candidate
 
+	@classmethod
+	def create_pool_candidates(cls, image_pool, exclusion_window_secs = 3600):
+		"""Creates the candidates for all images of the pool. When several
+		variants are assigned, they can share this set instead of each creating
+		their own."""
+		candidates = [ ]
+		# Sorted, so that the same seed always yields the same assignment no
+		# matter in which order the pool was scanned.
+		for (filename, meta) in sorted(image_pool, key = lambda item: item[0]):
+			candidate = cls._create_candidate(filename, meta)
+			_log.trace("Candidate: %s", candidate)
+			candidates.append(candidate)
+		return ImageCandidateStore(candidates, exclusion_window_secs = exclusion_window_secs)
+
 	def _calculate_candidates(self):
-		if self._candidates is not None:
+		if self._initial_candidates is not None:
 			return
 
-		# Then create the initial list of all candidates
-		self._candidates = [ ]
-		for (filename, meta) in self._image_pool:
-			candidate = self._create_candidate(filename, meta)
-			_log.trace("Candidate: %s", str(candidate))
-			self._candidates.append(candidate)
-		_log.debug("Initial list of candidates: %d images", len(self._candidates))
+		# Then create the initial set of all candidates
+		if self._pool_candidates is not None:
+			candidates = self._pool_candidates.copy()
+		else:
+			candidates = self.create_pool_candidates(self._image_pool, exclusion_window_secs = self._exclusion_window_secs)
+		_log.debug("Initial list of candidates: %d images", len(candidates))
 
 		# Then filter all those that are already assigned
 		for slot in self.slots:
 			if slot.filled:
-				self._remove_candidate_with_dependencies(lambda candidate: candidate.filename == slot.filename)
+				candidates.remove_with_dependencies(slot.filled_by)
 
 		# Then filter all those which have tags that are incompatible with this variant
 		if self._variant_name is not None:
-			self._remove_candidate_when(lambda candidate: ("only" in candidate.tag_sets) and (self._variant_name not in candidate.tag_sets["only"]))
+			candidates.remove_when(lambda candidate: ("only" in candidate.tag_sets) and (self._variant_name not in candidate.tag_sets["only"]))
 
-		_log.debug("After filtering: %d images", len(self._candidates))
-		self._initial_candidates = list(self._candidates)
+		_log.debug("After filtering: %d images", len(candidates))
+		self._initial_candidates = candidates
 
 	def add_slot(self, name, aspect_ratio, filled_by_filename = None):
 		if filled_by_filename is not None:
@@ -167,42 +161,83 @@ class ImagePoolAssignment():
 		self._slots[name] = ImagePoolSlot(name = name, aspect_ratio = aspect_ratio, filled_by = filled_by)
 		return self
 
-	def _attempt_placement_of(self, slot, forced_images):
+	def _place(self, slot, choice):
+		slot.filled_by = choice
+		self._candidates.remove_with_dependencies(choice)
+
+	def attempt_placement_of(self, slot, forced_images, choose = None):
+		"""Fills a single slot, preferring the forced images. Otherwise, choose
+		is called with the candidate store and the slot aspect ratio to pick a
+		candidate; by default, a random compatible one is taken."""
 		_log.debug("Attempting placement of slot: %s", str(slot))
 
-		# First search for hits in the forced image list
-		candidates = self._find_candidates(lambda candidate: self._compatible_aspect_ratio(candidate, slot.aspect_ratio), forced_images)
+		# First search for hits in the forced image list; forced images that
+		# were excluded by a previous placement are no longer available.
+		candidates = [ candidate for candidate in forced_images if (candidate in self._candidates) and self._candidates.compatible(candidate, slot.aspect_ratio) ]
 		if len(candidates) > 0:
-			choice = random.choice(candidates)
+			choice = self._rng.choice(candidates)
 			forced_images.remove(choice)
-			slot.filled_by = choice.filename
+			self._place(slot, choice)
 			return True
 
 		# Then search among all images
-		candidates = self._find_candidates(lambda candidate: self._compatible_aspect_ratio(candidate, slot.aspect_ratio))
-		if len(candidates) > 0:
-			choice = random.choice(candidates)
-			slot.filled_by = choice
+		if choose is None:
+			choice = self._candidates.choose_compatible(slot.aspect_ratio, rng = self._rng)
+		else:
+			choice = choose(self._candidates, slot.aspect_ratio)
+		if choice is not None:
+			self._place(slot, choice)
 			return True
 		return False
 
-	def attempt_placement(self):
+	def _solve(self, slots, forced_images):
+		assignment = ImagePlacementSolver(self._candidates, slots, forced_images, rng = self._rng).solve()
+		if (assignment is None) and (len(forced_images) > 0):
+			_log.warning("No image assignment places all forced images, retrying without requiring them.")
+			assignment = ImagePlacementSolver(self._candidates, slots, forced_images, require_forced = False, rng = self._rng).solve()
+		if assignment is None:
+			_log.warning("Image placement solver found no complete assignment, falling back to greedy placement.")
+			return False
+		for slot in slots:
+			choice = assignment[slot.name]
+			if choice in forced_images:
+				forced_images.remove(choice)
+			self._place(slot, choice)
+		return True
+
+	def _place_greedily(self, slots, forced_images, choose = None):
+		failed_count = 0
+		while len(slots) > 0:
+			next_slot = slots.pop()
+			success = self.attempt_placement_of(next_slot, forced_images, choose = choose)
+			if not success:
+				failed_count += 1
+		return failed_count
+
+	def begin_placement(self):
+		"""Resets all slots to their initial state and returns the list of
+		slots that need to be filled along with the list of forced images."""
 		self._calculate_candidates()
-		self._candidates = list(self._initial_candidates)
+		self._candidates = self._initial_candidates.copy()
 		for slot in self.slots:
 			slot.reset()
 		remaining_slots = [ slot for slot in self.slots if not slot.filled ]
 		if self._variant_name is not None:
-			forced_images = self._find_candidates(lambda candidate: ("forced" in candidate.tag_sets) and (self._variant_name in candidate.tag_sets["forced"]))
+			forced_images = [ candidate for candidate in self._candidates if ("force" in candidate.tag_sets) and (self._variant_name in candidate.tag_sets["force"]) ]
 		else:
 			forced_images = [ ]
+		return (remaining_slots, forced_images)
+
+	def attempt_placement(self, choose = None):
+		"""Places images in all slots from scratch. Returns True if all slots
+		were filled and all forced images were placed. choose is passed on to
+		attempt_placement_of() for slots that are filled greedily."""
+		(remaining_slots, forced_images) = self.begin_placement()
 		_log.debug("Attempting to fill %d slots.", len(remaining_slots))
-		failed_count = 0
-		while len(remaining_slots) > 0:
-			next_slot = remaining_slots.pop()
-			success = self._attempt_placement_of(next_slot, forced_images)
-			if not success:
-				failed_count += 1
+		if (self._placement_method == ImagePlacementMethod.Solver) and self._solve(remaining_slots, forced_images):
+			failed_count = 0
+		else:
+			failed_count = self._place_greedily(remaining_slots, forced_images, choose = choose)
 		if failed_count > 0:
 			_log.error("Failure of image placement: %d images could not be filled with suitable candidates.", failed_count)
 		if len(forced_images) > 0:
@@ -0,0 +1,239 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import json
+import time
+import sqlite3
+import threading
+import contextlib
+import logging
+from .Exceptions import IllegalImagePoolActionException
+
+_log = logging.getLogger(__spec__.name)
+
+class ImagePoolCache():
+	"""Persistent store of scanned image metadata, one row per image file.
+	The database runs in WAL mode, so concurrent calendargen processes can
+	read while one of them writes. Entries of the former JSON cache file are
+	imported once when the database is first opened.
+
+	Besides the images, a snapshot of every scanned directory is kept: the
+	modification times of the directory and of its geeqie metadata directory
+	along with the image files and subdirectories it contained.
+
+	Image entries are not written by the thread that puts them. Instead, a
+	single writer thread commits them in batches, once batch_size entries are
+	pending or flush_interval_secs have passed. Closing the cache commits all
+	pending entries, so an interrupted scan keeps everything scanned so
+	far."""
+	_DEFAULT_FILENAME = "~/.cache/calendargen/image_pool.sqlite3"
+	_LEGACY_JSON_FILENAME = "~/.cache/calendargen.json"
+	_UPSERT_SQL = """
+		INSERT INTO images (filename, mtime, snaptime, entry) VALUES (?, ?, ?, ?)
+		ON CONFLICT (filename) DO UPDATE SET mtime = excluded.mtime, snaptime = excluded.snaptime, entry = excluded.entry;
+	"""
+
+	def __init__(self, filename = _DEFAULT_FILENAME, legacy_json_filename = _LEGACY_JSON_FILENAME, batch_size = 500, flush_interval_secs = 5):
+		self._filename = os.path.expanduser(filename)
+		with contextlib.suppress(FileExistsError):
+			os.makedirs(os.path.dirname(self._filename))
+		self._batch_size = batch_size
+		self._flush_interval_secs = flush_interval_secs
+		# Serializes access to the database connection.
+		self._lock = threading.Lock()
+		# Protects the pending entries and the writer state.
+		self._pending_cond = threading.Condition()
+		self._pending = { }
+		self._writer = None
+		self._closing = False
+		self._db = sqlite3.connect(self._filename, timeout = 30, check_same_thread = False)
+		self._db.execute("PRAGMA journal_mode = WAL;")
+		self._db.execute("PRAGMA synchronous = NORMAL;")
+		self._create_schema()
+		if legacy_json_filename is not None:
+			self._migrate_json(os.path.expanduser(legacy_json_filename))
+
+	def _create_schema(self):
+		with self._db:
+			self._db.execute("""
+				CREATE TABLE IF NOT EXISTS images (
+					filename TEXT PRIMARY KEY,
+					mtime INTEGER,
+					snaptime TEXT,
+					entry TEXT NOT NULL
+				);
+			""")
+			self._db.execute("CREATE INDEX IF NOT EXISTS images_mtime ON images(mtime);")
+			self._db.execute("CREATE INDEX IF NOT EXISTS images_snaptime ON images(snaptime);")
+			self._db.execute("""
+				CREATE TABLE IF NOT EXISTS directories (
+					dirname TEXT PRIMARY KEY,
+					mtimes TEXT NOT NULL,
+					files TEXT NOT NULL,
+					subdirs TEXT NOT NULL
+				);
+			""")
+			self._db.execute("""
+				CREATE TABLE IF NOT EXISTS properties (
+					key TEXT PRIMARY KEY,
+					value TEXT NOT NULL
+				);
+			""")
+
+	def _migrate_json(self, json_filename):
+		with self._lock:
+			if self._db.execute("SELECT value FROM properties WHERE key = 'json_migrated';").fetchone() is not None:
+				return
+			try:
+				with open(json_filename) as f:
+					cache_data = json.load(f)
+			except (FileNotFoundError, json.decoder.JSONDecodeError):
+				cache_data = { }
+			with self._db:
+				self._db.executemany(self._UPSERT_SQL, (self._row(filename, entry) for (filename, entry) in cache_data.items()))
+				self._db.execute("INSERT OR REPLACE INTO properties (key, value) VALUES ('json_migrated', ?);", (json_filename, ))
+		if len(cache_data) > 0:
+			_log.info("Migrated %d image pool cache entries from %s", len(cache_data), json_filename)
+
+	@staticmethod
+	def _row(filename, entry):
+		mtime = entry["mtimes"][0]
+		snaptime = entry.get("meta", { }).get("snaptime")
+		return (filename, mtime, snaptime, json.dumps(entry))
+
+	def get(self, filename):
+		with self._pending_cond:
+			if filename in self._pending:
+				return self._pending[filename]
+		with self._lock:
+			row = self._db.execute("SELECT entry FROM images WHERE filename = ?;", (filename, )).fetchone()
+		if row is None:
+			return None
+		return json.loads(row[0])
+
+	@staticmethod
+	def _prefix_range(dirname):
+		prefix = dirname.rstrip("/") + "/"
+		# All paths starting with the prefix sort between "dir/" and "dir0",
+		# so the primary key index is used.
+		upper_bound = prefix[:-1] + chr(ord("/") + 1)
+		return (prefix, upper_bound)
+
+	def get_below(self, dirname):
+		"""Returns a dictionary of all entries of files in the given directory
+		and its subdirectories."""
+		with self._lock:
+			rows = self._db.execute("SELECT filename, entry FROM images WHERE (filename >= ?) AND (filename < ?);", self._prefix_range(dirname)).fetchall()
+		entries = { filename: json.loads(entry) for (filename, entry) in rows }
+		(prefix, upper_bound) = self._prefix_range(dirname)
+		with self._pending_cond:
+			entries.update((filename, entry) for (filename, entry) in self._pending.items() if prefix <= filename < upper_bound)
+		return entries
+
+	def _write_pending(self):
+		# The database lock is held from taking the pending entries until they
+		# are committed. Readers therefore never miss an entry that is being
+		# written and deletions cannot be overtaken by the write.
+		with self._lock:
+			with self._pending_cond:
+				(batch, self._pending) = (self._pending, { })
+			if len(batch) > 0:
+				with self._db:
+					self._db.executemany(self._UPSERT_SQL, (self._row(filename, entry) for (filename, entry) in batch.items()))
+				_log.debug("Committed %d image pool cache entries", len(batch))
+
+	def _writer_thread(self):
+		while True:
+			with self._pending_cond:
+				while (len(self._pending) == 0) and (not self._closing):
+					self._pending_cond.wait()
+				deadline = time.monotonic() + self._flush_interval_secs
+				while (len(self._pending) < self._batch_size) and (not self._closing):
+					remaining = deadline - time.monotonic()
+					if remaining <= 0:
+						break
+					self._pending_cond.wait(remaining)
+				closing = self._closing
+			self._write_pending()
+			if closing:
+				return
+
+	def put(self, filename, entry):
+		"""Queues the entry for writing; may be called from any thread, but not
+		after the cache has been closed."""
+		with self._pending_cond:
+			if self._closing:
+				raise IllegalImagePoolActionException("Cannot store %s, the image pool cache is already closed." % (filename))
+			self._pending[filename] = entry
+			if self._writer is None:
+				self._writer = threading.Thread(target = self._writer_thread, name = "ImagePoolCache-writer", daemon = True)
+				self._writer.start()
+			if len(self._pending) >= self._batch_size:
+				self._pending_cond.notify()
+
+	def delete(self, filenames):
+		filenames = list(filenames)
+		with self._pending_cond:
+			for filename in filenames:
+				self._pending.pop(filename, None)
+		with self._lock, self._db:
+			self._db.executemany("DELETE FROM images WHERE filename = ?;", ((filename, ) for filename in filenames))
+
+	def delete_below(self, dirname):
+		"""Removes all images and directory snapshots of a removed directory."""
+		(prefix, upper_bound) = self._prefix_range(dirname)
+		with self._pending_cond:
+			for filename in [ filename for filename in self._pending if prefix <= filename < upper_bound ]:
+				del self._pending[filename]
+		with self._lock, self._db:
+			self._db.execute("DELETE FROM images WHERE (filename >= ?) AND (filename < ?);", (prefix, upper_bound))
+			self._db.execute("DELETE FROM directories WHERE (dirname = ?) OR ((dirname >= ?) AND (dirname < ?));", (dirname.rstrip("/"), prefix, upper_bound))
+
+	def get_directories_below(self, dirname):
+		"""Returns a dictionary of the snapshots of the given directory and of
+		all directories below it. Each snapshot is a (mtimes, files, subdirs)
+		tuple."""
+		(prefix, upper_bound) = self._prefix_range(dirname)
+		with self._lock:
+			rows = self._db.execute("SELECT dirname, mtimes, files, subdirs FROM directories WHERE (dirname = ?) OR ((dirname >= ?) AND (dirname < ?));", (dirname.rstrip("/"), prefix, upper_bound)).fetchall()
+		return { dirname: (json.loads(mtimes), json.loads(files), json.loads(subdirs)) for (dirname, mtimes, files, subdirs) in rows }
+
+	def put_directory(self, dirname, mtimes, files, subdirs):
+		with self._lock, self._db:
+			self._db.execute("INSERT OR REPLACE INTO directories (dirname, mtimes, files, subdirs) VALUES (?, ?, ?, ?);", (dirname, json.dumps(mtimes), json.dumps(files), json.dumps(subdirs)))
+
+	def close(self):
+		"""Commits all pending entries and closes the database."""
+		with self._pending_cond:
+			self._closing = True
+			self._pending_cond.notify()
+			writer = self._writer
+		if writer is not None:
+			writer.join()
+		with self._lock:
+			self._db.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
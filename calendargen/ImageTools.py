@@ -24,13 +24,46 @@ import json
 import fractions
 import collections
 import re
+from .JPEGMetadata import JPEGMetadata
+from .Exceptions import InvalidJPEGException
 
 class ImageTools():
 	_SNAPTIME_RE = re.compile("(?P<year>\d{4}):(?P<month>\d{2}):(?P<day>\d{2}) (?P<hour>\d{2}):(?P<minute>\d{2}):(?P<second>\d{2})")
 	_AspectRatio = collections.namedtuple("AspectRatio", [ "value", "width", "height", "ideal", "short" ])
 
+	@classmethod
+	def _format_snaptime(cls, snaptime):
+		if snaptime is None:
+			return None
+		result = cls._SNAPTIME_RE.fullmatch(snaptime)
+		if result is None:
+			return None
+		result = result.groupdict()
+		return "%04d-%02d-%02dT%02d:%02d:%02d" % (int(result["year"]), int(result["month"]), int(result["day"]), int(result["hour"]), int(result["minute"]), int(result["second"]))
+
+	@classmethod
+	def get_image_metadata(cls, filename, jpeg_metadata = None):
+		"""Returns geometry and EXIF timestamp of an image. For JPEG files,
+		only the headers are read (unless they have already been read, then
+		they can be passed as jpeg_metadata). Other files (or JPEGs that cannot
+		be parsed) are fully decoded by ImageMagick."""
+		try:
+			metadata = jpeg_metadata or JPEGMetadata(filename)
+			return {
+				"geometry":		metadata.geometry,
+				"snaptime":		cls._format_snaptime(metadata.snaptime),
+			}
+		except InvalidJPEGException:
+			stats = cls.get_image_stats(filename)
+			return {
+				"geometry":		stats["geometry"],
+				"snaptime":		stats["snaptime"],
+			}
+
 	@classmethod
 	def get_image_stats(cls, filename):
+		"""Decodes the whole image with ImageMagick and returns its metadata
+		along with per-image and per-channel statistics. Slow."""
 		json_data = subprocess.check_output([ "convert", filename, "json:-" ])
 		data = json.loads(json_data)
 		image = data[0]["image"]
@@ -44,12 +77,7 @@ class ImageTools():
 			print("No EXIF timestamp:")
 			print(image["properties"])
 
-		if snaptime is not None:
-			result = cls._SNAPTIME_RE.fullmatch(snaptime)
-			result = result.groupdict()
-			snaptime_fmt = "%04d-%02d-%02dT%02d:%02d:%02d" % (int(result["year"]), int(result["month"]), int(result["day"]), int(result["hour"]), int(result["minute"]), int(result["second"]))
-		else:
-			snaptime_fmt = None
+		snaptime_fmt = cls._format_snaptime(snaptime)
 		return {
 			"geometry":		(image["geometry"]["width"], image["geometry"]["height"]),
 			"snaptime":		snaptime_fmt,
@@ -61,7 +89,7 @@ class ImageTools():
 
 	@classmethod
 	def get_image_geometry(cls, filename):
-		return cls.get_image_stats(filename)["geometry"]
+		return cls.get_image_metadata(filename)["geometry"]
 
 	@classmethod
 	def approximate_aspect_ratio(cls, width, height, shorten_above = 20):
@@ -0,0 +1,224 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import time
+import queue
+import select
+import threading
+import subprocess
+import logging
+from .CmdlineEscape import CmdlineEscape
+from .Exceptions import InkscapeRenderException
+
+_log = logging.getLogger(__spec__.name)
+
+class InkscapeOneshotRenderer():
+	"""Renders every SVG by starting a fresh inkscape process."""
+	def render(self, svg_filename, png_filename, resolution_dpi):
+		render_cmd = [ "inkscape", "-d", str(resolution_dpi), "-o", png_filename, svg_filename ]
+		_log.debug("Render SVG: %s", CmdlineEscape().cmdline(render_cmd))
+		subprocess.check_call(render_cmd, stdout = _log.subproc_target, stderr = _log.subproc_target)
+
+	def close(self):
+		pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+class InkscapeShellWorker():
+	"""A single long-lived inkscape instance running in --shell mode that
+	accepts actions on stdin and signals completion of each command line by
+	printing its prompt. A worker that does not respond within timeout_secs
+	is considered hung and is killed."""
+	_PROMPT = b"> "
+
+	def __init__(self, worker_id, timeout_secs = 600):
+		self._worker_id = worker_id
+		self._timeout_secs = timeout_secs
+		self._proc = None
+		self._render_count = 0
+
+	@property
+	def alive(self):
+		return (self._proc is not None) and (self._proc.poll() is None)
+
+	def _read_until_prompt(self):
+		response = bytearray()
+		fd = self._proc.stdout.fileno()
+		deadline = time.monotonic() + self._timeout_secs
+		while not response.endswith(self._PROMPT):
+			(readable, _, _) = select.select([ fd ], [ ], [ ], max(0, deadline - time.monotonic()))
+			if len(readable) == 0:
+				raise InkscapeRenderException("inkscape shell worker %d did not respond within %d seconds after %d renders." % (self._worker_id, self._timeout_secs, self._render_count))
+			chunk = os.read(fd, 4096)
+			if len(chunk) == 0:
+				raise InkscapeRenderException("inkscape shell worker %d terminated unexpectedly (exit code %s) after %d renders." % (self._worker_id, str(self._proc.poll()), self._render_count))
+			response += chunk
+		return bytes(response[: -len(self._PROMPT)])
+
+	def spawn(self):
+		self.kill()
+		_log.debug("Spawning inkscape shell worker %d", self._worker_id)
+		self._proc = subprocess.Popen([ "inkscape", "--shell" ], stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = _log.subproc_target)
+		self._render_count = 0
+		try:
+			self._read_until_prompt()
+		except InkscapeRenderException:
+			self.kill()
+			raise
+
+	def kill(self):
+		if self._proc is None:
+			return
+		if self._proc.poll() is None:
+			self._proc.kill()
+		self._proc.wait()
+		self._proc = None
+
+	def _command(self, actions):
+		for action in actions:
+			if any(char in action for char in ";\r\n"):
+				raise InkscapeRenderException("Unable to pass action to inkscape shell, contains illegal characters: %s" % (action))
+		command = ";".join(actions) + "\n"
+		self._proc.stdin.write(command.encode("utf-8"))
+		self._proc.stdin.flush()
+		return self._read_until_prompt()
+
+	def render(self, svg_filename, png_filename, resolution_dpi):
+		if not self.alive:
+			self.spawn()
+		# Remove stale output so that a silently failed export is detected.
+		if os.path.exists(png_filename):
+			os.unlink(png_filename)
+		actions = [
+			"file-open:%s" % (svg_filename),
+			"export-filename:%s" % (png_filename),
+			"export-dpi:%d" % (resolution_dpi),
+			"export-do",
+			"file-close",
+		]
+		_log.debug("Render SVG on shell worker %d: %s", self._worker_id, "; ".join(actions))
+		try:
+			response = self._command(actions)
+		except (BrokenPipeError, InkscapeRenderException):
+			self.kill()
+			raise
+		self._render_count += 1
+		if not os.path.isfile(png_filename):
+			raise InkscapeRenderException("inkscape shell worker %d did not produce %s: %s" % (self._worker_id, png_filename, response.decode("utf-8", errors = "replace").strip()))
+
+	def close(self):
+		if self.alive:
+			try:
+				self._proc.stdin.write(b"quit\n")
+				self._proc.stdin.flush()
+				self._proc.wait(timeout = 5)
+			except (BrokenPipeError, subprocess.TimeoutExpired):
+				pass
+		self.kill()
+
+class InkscapeShellRenderer():
+	"""Pool of long-lived inkscape --shell workers. Workers are spawned lazily
+	up to the given worker count and are respawned when they crash or hang."""
+	def __init__(self, worker_count, max_attempts = 2, timeout_secs = 600):
+		assert(worker_count >= 1)
+		self._max_attempts = max_attempts
+		self._workers = [ InkscapeShellWorker(worker_id, timeout_secs = timeout_secs) for worker_id in range(worker_count) ]
+		self._idle_workers = queue.LifoQueue()
+		for worker in reversed(self._workers):
+			self._idle_workers.put(worker)
+		self._lock = threading.Lock()
+		self._closed = False
+
+	def render(self, svg_filename, png_filename, resolution_dpi):
+		worker = self._idle_workers.get()
+		try:
+			for attempt in range(1, self._max_attempts + 1):
+				try:
+					worker.render(svg_filename, png_filename, resolution_dpi)
+					return
+				except (BrokenPipeError, InkscapeRenderException) as e:
+					if worker.alive or (attempt == self._max_attempts):
+						raise
+					_log.warning("inkscape shell worker failed while rendering %s (attempt %d of %d), respawning: %s", svg_filename, attempt, self._max_attempts, str(e))
+		finally:
+			self._idle_workers.put(worker)
+
+	def close(self):
+		with self._lock:
+			if self._closed:
+				return
+			self._closed = True
+		for worker in self._workers:
+			worker.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+class InkscapeRenderer():
+	BACKENDS = [ "shell", "oneshot" ]
+
+	@classmethod
+	def create(cls, backend_name, worker_count):
+		if backend_name == "shell":
+			return InkscapeShellRenderer(worker_count = worker_count)
+		elif backend_name == "oneshot":
+			return InkscapeOneshotRenderer()
+		else:
+			raise ValueError("Unknown inkscape render backend: %s" % (backend_name))
+
+if __name__ == "__main__":
+	import sys
+	import time
+	import tempfile
+	import statistics
+	import concurrent.futures
+	import multiprocessing
+	from .FriendlyArgumentParser import FriendlyArgumentParser
+
+	parser = FriendlyArgumentParser(description = "Benchmark per-layer render latency of the inkscape render backends.")
+	parser.add_argument("-n", "--iterations", metavar = "count", type = int, default = 20, help = "Number of renders per backend. Defaults to %(default)d.")
+	parser.add_argument("-j", "--workers", metavar = "count", type = int, default = multiprocessing.cpu_count(), help = "Number of concurrent renders. Defaults to %(default)d.")
+	parser.add_argument("-d", "--resolution-dpi", metavar = "dpi", type = int, default = 72, help = "Resolution to render at, in dpi. Defaults to %(default)d dpi.")
+	parser.add_argument("svg_file", help = "SVG file which should be rendered repeatedly.")
+	args = parser.parse_args(sys.argv[1:])
+
+	logging.basicConfig(format = "{name:>30s} [{levelname:.1s}]: {message}", style = "{", level = logging.INFO)
+	with tempfile.TemporaryDirectory(prefix = "calendargen_bench_") as temp_dir:
+		for backend_name in InkscapeRenderer.BACKENDS:
+			def timed_render(render_no):
+				t0 = time.time()
+				renderer.render(os.path.realpath(args.svg_file), "%s/%s_%04d.png" % (temp_dir, backend_name, render_no), args.resolution_dpi)
+				return time.time() - t0
+
+			with InkscapeRenderer.create(backend_name, worker_count = args.workers) as renderer:
+				t0 = time.time()
+				with concurrent.futures.ThreadPoolExecutor(max_workers = args.workers) as executor:
+					latencies = sorted(executor.map(timed_render, range(args.iterations)))
+				total = time.time() - t0
+			print("%-10s %4d renders in %7.2f sec: mean %.3f sec, median %.3f sec, max %.3f sec per layer" % (backend_name, args.iterations, total, statistics.mean(latencies), statistics.median(latencies), latencies[-1]))
@@ -0,0 +1,96 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import struct
+import select
+import ctypes
+import ctypes.util
+import collections
+
+InotifyEvent = collections.namedtuple("InotifyEvent", [ "path", "mask", "name" ])
+
+class Inotify():
+	"""Minimal wrapper around the Linux inotify API."""
+	IN_MODIFY = 0x00000002
+	IN_ATTRIB = 0x00000004
+	IN_CLOSE_WRITE = 0x00000008
+	IN_MOVED_FROM = 0x00000040
+	IN_MOVED_TO = 0x00000080
+	IN_CREATE = 0x00000100
+	IN_DELETE = 0x00000200
+	IN_DELETE_SELF = 0x00000400
+	IN_MOVE_SELF = 0x00000800
+	IN_Q_OVERFLOW = 0x00004000
+	IN_IGNORED = 0x00008000
+	IN_ISDIR = 0x40000000
+	IN_CLOEXEC = 0o2000000
+
+	_EVENT_HEADER = struct.Struct("iIII")
+
+	def __init__(self):
+		self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno = True)
+		self._fd = self._libc.inotify_init1(self.IN_CLOEXEC)
+		if self._fd < 0:
+			errno = ctypes.get_errno()
+			raise OSError(errno, os.strerror(errno))
+		self._paths = { }
+
+	def add_watch(self, path, mask):
+		wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+		if wd < 0:
+			errno = ctypes.get_errno()
+			raise OSError(errno, os.strerror(errno), path)
+		self._paths[wd] = path
+		return wd
+
+	def read_events(self, timeout = None):
+		"""Returns a list of InotifyEvents. Blocks until at least one event is
+		available or the timeout (in seconds) expires."""
+		(readable, _, _) = select.select([ self._fd ], [ ], [ ], timeout)
+		if len(readable) == 0:
+			return [ ]
+		data = os.read(self._fd, 64 * 1024)
+		events = [ ]
+		offset = 0
+		while offset < len(data):
+			(wd, mask, cookie, name_length) = self._EVENT_HEADER.unpack_from(data, offset)
+			offset += self._EVENT_HEADER.size
+			name = os.fsdecode(data[offset : offset + name_length].rstrip(b"\x00"))
+			offset += name_length
+			if mask & self.IN_IGNORED:
+				# Watch was removed, e.g., because the directory was deleted.
+				path = self._paths.pop(wd, None)
+			else:
+				path = self._paths.get(wd)
+			events.append(InotifyEvent(path = path, mask = mask, name = name))
+		return events
+
+	def close(self):
+		if self._fd is not None:
+			os.close(self._fd)
+			self._fd = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
@@ -0,0 +1,199 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import struct
+from .Exceptions import InvalidJPEGException
+
+class JPEGMetadata():
+	"""Reads the image dimensions, EXIF data, embedded XMP packet and IPTC
+	keywords of a JPEG file from its headers only. Segments are skipped by
+	their length and parsing stops at the first start-of-frame marker, so
+	usually only a few kB of the file are read and no image data is
+	decoded."""
+	_SOF_MARKERS = set(range(0xc0, 0xd0)) - set([ 0xc4, 0xc8, 0xcc ])
+	_STANDALONE_MARKERS = set(range(0xd0, 0xd8)) | set([ 0x01 ])
+	_MARKER_SOS = 0xda
+	_MARKER_EOI = 0xd9
+	_MARKER_APP1 = 0xe1
+	_MARKER_APP13 = 0xed
+	_XMP_SIGNATURE = b"http://ns.adobe.com/xap/1.0/\x00"
+	_PHOTOSHOP_SIGNATURE = b"Photoshop 3.0\x00"
+	_PHOTOSHOP_RESOURCE_IPTC = 0x0404
+	_IPTC_RECORD_APPLICATION = 2
+	_IPTC_DATASET_KEYWORDS = 25
+
+	_EXIF_TAG_DATETIME = 0x0132
+	_EXIF_TAG_EXIF_IFD = 0x8769
+	_EXIF_TAG_DATETIME_ORIGINAL = 0x9003
+	_EXIF_TYPE_ASCII = 2
+	_EXIF_TYPE_SHORT = 3
+	_EXIF_TYPE_LONG = 4
+
+	def __init__(self, filename):
+		self._filename = filename
+		self._geometry = None
+		self._exif = { }
+		self._xmp = None
+		self._iptc_keywords = [ ]
+		with open(filename, "rb") as f:
+			self._parse(f)
+
+	@property
+	def geometry(self):
+		return self._geometry
+
+	@property
+	def exif(self):
+		return self._exif
+
+	@property
+	def xmp(self):
+		"""Embedded XMP packet as bytes, None if there is none."""
+		return self._xmp
+
+	@property
+	def iptc_keywords(self):
+		return self._iptc_keywords
+
+	@property
+	def snaptime(self):
+		"""EXIF timestamp as a string ("YYYY:MM:DD HH:MM:SS"), None if there is
+		none."""
+		for tag in [ self._EXIF_TAG_DATETIME_ORIGINAL, self._EXIF_TAG_DATETIME ]:
+			if tag in self._exif:
+				return self._exif[tag]
+		return None
+
+	def _read_exactly(self, f, length):
+		data = f.read(length)
+		if len(data) != length:
+			raise InvalidJPEGException("Premature end of JPEG file: %s" % (self._filename))
+		return data
+
+	def _read_marker(self, f):
+		if self._read_exactly(f, 1) != b"\xff":
+			raise InvalidJPEGException("Expected JPEG marker in %s at offset %d." % (self._filename, f.tell() - 1))
+		marker = self._read_exactly(f, 1)[0]
+		while marker == 0xff:
+			# Fill bytes
+			marker = self._read_exactly(f, 1)[0]
+		return marker
+
+	def _parse(self, f):
+		if self._read_exactly(f, 2) != b"\xff\xd8":
+			raise InvalidJPEGException("Not a JPEG file: %s" % (self._filename))
+		while self._geometry is None:
+			marker = self._read_marker(f)
+			if marker in self._STANDALONE_MARKERS:
+				continue
+			if marker in [ self._MARKER_SOS, self._MARKER_EOI ]:
+				raise InvalidJPEGException("No start of frame marker found in %s." % (self._filename))
+			(length, ) = struct.unpack(">H", self._read_exactly(f, 2))
+			if length < 2:
+				raise InvalidJPEGException("Invalid segment length %d in %s." % (length, self._filename))
+			if marker in self._SOF_MARKERS:
+				(precision, height, width) = struct.unpack(">BHH", self._read_exactly(f, 5))
+				self._geometry = (width, height)
+			elif marker == self._MARKER_APP1:
+				segment = self._read_exactly(f, length - 2)
+				if segment.startswith(b"Exif\x00\x00"):
+					self._parse_exif(segment[6:])
+				elif segment.startswith(self._XMP_SIGNATURE):
+					self._xmp = segment[len(self._XMP_SIGNATURE):]
+			elif marker == self._MARKER_APP13:
+				segment = self._read_exactly(f, length - 2)
+				if segment.startswith(self._PHOTOSHOP_SIGNATURE):
+					self._parse_photoshop_resources(segment[len(self._PHOTOSHOP_SIGNATURE):])
+			else:
+				f.seek(length - 2, os.SEEK_CUR)
+
+	def _read_ifd(self, tiff, endian, offset):
+		entries = { }
+		(entry_count, ) = struct.unpack_from(endian + "H", tiff, offset)
+		for entry_no in range(entry_count):
+			(tag, value_type, count) = struct.unpack_from(endian + "HHL", tiff, offset + 2 + (12 * entry_no))
+			value_offset = offset + 2 + (12 * entry_no) + 8
+			if value_type == self._EXIF_TYPE_ASCII:
+				if count > 4:
+					(value_offset, ) = struct.unpack_from(endian + "L", tiff, value_offset)
+				entries[tag] = tiff[value_offset : value_offset + count].rstrip(b"\x00").decode("ascii", errors = "replace")
+			elif (value_type == self._EXIF_TYPE_SHORT) and (count == 1):
+				(entries[tag], ) = struct.unpack_from(endian + "H", tiff, value_offset)
+			elif (value_type == self._EXIF_TYPE_LONG) and (count == 1):
+				(entries[tag], ) = struct.unpack_from(endian + "L", tiff, value_offset)
+		return entries
+
+	def _parse_exif(self, tiff):
+		if tiff[:2] == b"II":
+			endian = "<"
+		elif tiff[:2] == b"MM":
+			endian = ">"
+		else:
+			return
+		try:
+			(magic, ifd0_offset) = struct.unpack_from(endian + "HL", tiff, 2)
+			if magic != 42:
+				return
+			self._exif = self._read_ifd(tiff, endian, ifd0_offset)
+			if self._EXIF_TAG_EXIF_IFD in self._exif:
+				self._exif.update(self._read_ifd(tiff, endian, self._exif[self._EXIF_TAG_EXIF_IFD]))
+		except struct.error:
+			# Truncated or corrupt EXIF data is not fatal, the image itself may
+			# still be fine.
+			pass
+
+	def _parse_iptc(self, data):
+		offset = 0
+		while offset + 5 <= len(data):
+			(tag_marker, record, dataset, length) = struct.unpack_from(">BBBH", data, offset)
+			if (tag_marker != 0x1c) or (length & 0x8000):
+				# Not a standard dataset (or an extended one), stop here.
+				break
+			value = data[offset + 5 : offset + 5 + length]
+			if (record == self._IPTC_RECORD_APPLICATION) and (dataset == self._IPTC_DATASET_KEYWORDS):
+				self._iptc_keywords.append(value.decode("utf-8", errors = "replace"))
+			offset += 5 + length
+
+	def _parse_photoshop_resources(self, data):
+		offset = 0
+		try:
+			while data[offset : offset + 4] == b"8BIM":
+				(resource_id, name_length) = struct.unpack_from(">HB", data, offset + 4)
+				# Pascal string name (length byte and characters), padded to even
+				# length
+				offset += 7 + name_length + ((name_length + 1) % 2)
+				(size, ) = struct.unpack_from(">L", data, offset)
+				offset += 4
+				if resource_id == self._PHOTOSHOP_RESOURCE_IPTC:
+					self._parse_iptc(data[offset : offset + size])
+				offset += size + (size % 2)
+		except struct.error:
+			pass
+
+if __name__ == "__main__":
+	import sys
+	import time
+	t0 = time.time()
+	for filename in sys.argv[1:]:
+		metadata = JPEGMetadata(filename)
+		print("%s: %d x %d, %s, %d bytes XMP, IPTC keywords %s" % (filename, metadata.geometry[0], metadata.geometry[1], metadata.snaptime, len(metadata.xmp or b""), metadata.iptc_keywords))
+	print("%d files in %.3f sec" % (len(sys.argv) - 1, time.time() - t0))
@@ -19,14 +19,20 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
+import os
 import sys
+import json
+import time
 import enum
+import heapq
 import multiprocessing
 import threading
 import traceback
 import logging
 import collections
+import concurrent.futures
 import uuid
+import itertools
 
 _log = logging.getLogger("JobServer" if (__spec__ is None) else __spec__.name)
 
@@ -62,7 +68,7 @@ class JobGraph():
 				return "\"%s\" [label=\"%s\"]" % (job.jid, str(job.info))
 
 	def _add_node(self, job):
-		if job.jid in self._seen_nodes:
+		if job.jid not in self._seen_nodes:
 			self._seen_nodes.add(job.jid)
 			print("	%s" % (self._dot_str(job)), file = self._f)
 
@@ -78,7 +84,7 @@ class JobGraph():
 		self._add_edge(depends_on, job)
 
 	def add_job(self, job):
-		print("	%s" % (self._dot_str(job)), file = self._f)
+		self._add_node(job)
 		for notify in job.notify_after:
 			self._add_dependency(notify, job)
 		for notify in job.cleanup_after:
@@ -89,12 +95,116 @@ class JobGraph():
 		self._f.close()
 		self._f = None
 
+JobTraceRecord = collections.namedtuple("JobTraceRecord", [ "info", "jid", "cpu_bound", "enqueued", "started", "finished", "worker_no", "success" ])
+
+class JobTrace():
+	"""Records when each job was enqueued, started and finished, on which
+	worker it ran and whether it succeeded. The recorded trace can be written
+	in the Chrome trace event format (viewable in chrome://tracing or
+	Perfetto) and summarized per job category (the job's info)."""
+	def __init__(self):
+		self._t0 = time.monotonic()
+		self._records = [ ]
+
+	@property
+	def records(self):
+		return iter(self._records)
+
+	def record(self, job, enqueued, started, finished, worker_no, success):
+		# Only keep what is needed so that finished jobs can be freed.
+		self._records.append(JobTraceRecord(info = str(job.info), jid = str(job.jid), cpu_bound = job.cpu_bound, enqueued = enqueued, started = started, finished = finished, worker_no = worker_no, success = success))
+
+	def _usecs(self, timestamp):
+		return round((timestamp - self._t0) * 1e6)
+
+	def write_chrome_trace(self, filename):
+		pid = os.getpid()
+		events = [ ]
+		for worker_no in sorted(set(record.worker_no for record in self._records)):
+			events.append({ "name": "thread_name", "ph": "M", "pid": pid, "tid": worker_no, "args": { "name": "worker %d" % (worker_no) } })
+		for record in self._records:
+			events.append({
+				"name":	record.info,
+				"cat":	"job",
+				"ph":	"X",
+				"pid":	pid,
+				"tid":	record.worker_no,
+				"ts":	self._usecs(record.started),
+				"dur":	self._usecs(record.finished) - self._usecs(record.started),
+				"args": {
+					"jid":			record.jid,
+					"status":		"success" if record.success else "failed",
+					"queued_ms":	round((record.started - record.enqueued) * 1000, 3),
+					"cpu_bound":	record.cpu_bound,
+				},
+			})
+		with open(filename, "w") as f:
+			json.dump({ "traceEvents": events, "displayTimeUnit": "ms" }, f)
+
+	@staticmethod
+	def _percentile(sorted_values, percentile):
+		# Nearest-rank percentile of a non-empty, sorted list.
+		index = max(0, -(-len(sorted_values) * percentile // 100) - 1)
+		return sorted_values[index]
+
+	def summary(self):
+		"""Returns a list of dictionaries, one per job category, ordered by
+		descending total run time."""
+		by_info = collections.defaultdict(list)
+		for record in self._records:
+			by_info[record.info].append(record)
+		summary = [ ]
+		for (info, records) in by_info.items():
+			durations = sorted(record.finished - record.started for record in records)
+			queued = sorted(record.started - record.enqueued for record in records)
+			summary.append({
+				"info":		info,
+				"count":	len(records),
+				"failed":	sum(1 for record in records if not record.success),
+				"total":	sum(durations),
+				"p50":		self._percentile(durations, 50),
+				"p95":		self._percentile(durations, 95),
+				"queued_p50":	self._percentile(queued, 50),
+			})
+		summary.sort(key = lambda entry: -entry["total"])
+		return summary
+
+	def print_summary(self, f = None):
+		f = f or sys.stdout
+		print("%-30s %6s %6s %10s %9s %9s %10s" % ("Job", "Count", "Failed", "Total [s]", "p50 [s]", "p95 [s]", "Queued p50"), file = f)
+		for entry in self.summary():
+			print("%-30s %6d %6d %10.3f %9.3f %9.3f %10.3f" % (entry["info"][:30], entry["count"], entry["failed"], entry["total"], entry["p50"], entry["p95"], entry["queued_p50"]), file = f)
+
 class Job():
-	def __init__(self, callback, args = (), info = None):
+	"""A unit of work. By default, the callback runs in a JobServer worker
+	thread, which is appropriate for jobs that mostly wait on I/O or on
+	subprocesses. Jobs which do CPU-intensive work in Python should be marked
+	as cpu_bound; they are then executed in a process pool so that they do
+	not serialize on the GIL. For these, callback and arguments need to be
+	picklable and the return value is available as the job's result.
+
+	Among runnable jobs, those with higher priority are always started first.
+	Ties are broken by the estimated length of the longest chain of jobs that
+	depend on the job (its critical path).
+
+	Jobs may declare the resources they occupy while running: the estimated
+	peak memory in bytes and the number of CPU threads they use. The
+	JobServer only starts a job if the declared resources fit into its
+	budgets."""
+	def __init__(self, callback, args = (), info = None, cpu_bound = False, priority = 0, memory = 0, threads = 1):
 		self._callback = callback
 		self._args = args
 		self._info = info
+		self._cpu_bound = cpu_bound
+		self._priority = priority
+		self._memory = memory
+		self._threads = threads
+		self._critical_path = None		# Determined by the JobServer
+		self._critical_path_generation = None
+		self._enqueued = None			# Determined by the JobServer
+		self._result = None
 		self._depends_on = [ ]			# Prerequisites
+		self._pending_count = 0			# Number of prerequisites not yet finished
 		self._notify_after = [ ]		# Notify these on success
 		self._cleanup_after = [ ]		# Notify these on finish, regardless if successful or not
 		self._jobserver = None
@@ -109,6 +219,27 @@ class Job():
 	def info(self):
 		return self._info
 
+	@property
+	def cpu_bound(self):
+		return self._cpu_bound
+
+	@property
+	def priority(self):
+		return self._priority
+
+	@property
+	def memory(self):
+		return self._memory
+
+	@property
+	def threads(self):
+		return self._threads
+
+	@property
+	def result(self):
+		assert(self._state == JobState.Finished)
+		return self._result
+
 	@property
 	def jobserver(self):
 		return self._jobserver
@@ -127,27 +258,34 @@ class Job():
 		return iter(self._cleanup_after)
 
 	def recurse_untracked(self):
+		# Iterative instead of recursive so that long chains of jobs do not
+		# exhaust the recursion limit.
 		if self.jobserver is None:
 			yield self
-		for parent in self._depends_on:
-			if parent.jobserver is None:
-				yield from parent.recurse_untracked()
-		for child in self._notify_after:
-			if child.jobserver is None:
-				yield from child.recurse_untracked()
-		for child in self._cleanup_after:
-			if child.jobserver is None:
-				yield from child.recurse_untracked()
+		seen = set([ self ])
+		stack = [ self ]
+		while len(stack) > 0:
+			job = stack.pop()
+			for neighbor in itertools.chain(job._depends_on, job._notify_after, job._cleanup_after):
+				if (neighbor.jobserver is None) and (neighbor not in seen):
+					seen.add(neighbor)
+					stack.append(neighbor)
+					yield neighbor
 
 	@property
 	def state(self):
 		return self._state
 
+	@property
+	def terminated(self):
+		return self._state in [ JobState.Finished, JobState.Failed ]
+
 	def depends_on(self, *parent_jobs):
 		if len(parent_jobs) == 0:
 			return self
 		assert(self._state in [ JobState.Waiting, JobState.Blocked ])
 		self._depends_on += parent_jobs
+		self._pending_count += len(parent_jobs)
 		for parent_job in parent_jobs:
 			parent_job._notify_after.append(self)
 		self._state = JobState.Blocked
@@ -159,6 +297,7 @@ class Job():
 		assert(self._state in [ JobState.Waiting, JobState.Blocked ])
 		self._state = JobState.Blocked
 		self._depends_on += parent_jobs
+		self._pending_count += len(parent_jobs)
 		for parent_job in parent_jobs:
 			parent_job._cleanup_after.append(self)
 		return self
@@ -180,43 +319,45 @@ class Job():
 		for notify in self._cleanup_after:
 			notify.dump()
 
-	def notify_parent_finished(self, parent_job, result):
-		# One dependency less.
-		self._depends_on.remove(parent_job)
-		if (len(self._depends_on) == 0) and (self.state == JobState.Blocked):
-			# Ready to be scheduled!
+	def notify_parent_finished(self, parent_job):
+		"""One dependency less. Returns True if the job just became ready to
+		be scheduled. Must be called with the JobServer lock held."""
+		self._pending_count -= 1
+		if (self._pending_count == 0) and (self._state == JobState.Blocked):
 			self._state = JobState.Waiting
-
-	def notify_parent_failed(self, parent_job, exception):
-		# If the dependency failed, this job implicitly also failed. Notify all
-		# children they won't be able to run.
+			return True
+		return False
+
+	def notify_parent_failed(self, parent_job):
+		"""If the dependency failed, this job implicitly also failed. Returns
+		True if the job was not failed before, in which case its children need
+		to be notified in turn. Must be called with the JobServer lock held."""
+		self._pending_count -= 1
+		if self.terminated:
+			return False
 		self._state = JobState.Failed
-		for child in self._notify_after:
-			child.notify_parent_failed(self, exception)
-		for child in self._cleanup_after:
-			child.notify_parent_finished(self, exception)
+		return True
 
-	def run(self):
+	def run(self, executor = None):
+		"""Executes the job, either directly or by submitting it to the given
+		executor and blocking until it finishes. Returns a (success, result or
+		JobException) tuple. Notifying dependent jobs is left to the
+		JobServer."""
 		assert(self._state in [ JobState.Waiting ])
 		self._state = JobState.Running
 		try:
-			result = self._callback(*self._args)
+			if executor is None:
+				result = self._callback(*self._args)
+			else:
+				result = executor.submit(self._callback, *self._args).result()
+			self._result = result
 			self._state = JobState.Finished
-			for child in self._notify_after:
-				child.notify_parent_finished(self, result)
-			for child in self._cleanup_after:
-				child.notify_parent_finished(self, result)
-			self.jobserver.notify_success(self)
+			return (True, result)
 		except Exception as exception:
 			self._state = JobState.Failed
 			(exc_type, exc_value, exc_traceback) = sys.exc_info()
 			stacktrace = "".join(traceback.format_exception(exc_type, exc_value, exc_traceback))
-			job_exception = JobException(exception = exception, stacktrace = stacktrace)
-			for child in self._notify_after:
-				child.notify_parent_failed(self, job_exception)
-			for child in self._cleanup_after:
-				child.notify_parent_finished(self, result)
-			self.jobserver.notify_failure(self, job_exception)
+			return (False, JobException(exception = exception, stacktrace = stacktrace))
 
 	def _custom_str(self, suffix = ""):
 		if self.info is None:
@@ -236,21 +377,68 @@ class Job():
 		return self._custom_str(suffix = deps)
 
 class JobServer():
-	def __init__(self, concurrent_job_count = multiprocessing.cpu_count(), exception_on_failed = True, write_graph_file = None):
+	"""Executes a DAG of jobs on a fixed pool of worker threads. Jobs whose
+	prerequisites are all fulfilled are put in a ready queue from which idle
+	workers pull them; every job keeps a counter of unfinished prerequisites
+	so that scheduling cost does not depend on the number of waiting jobs.
+
+	concurrent_job_count is both the number of workers and the budget of CPU
+	threads that running jobs may declare in total; max_memory optionally
+	limits the total declared memory of all running jobs. A job that exceeds
+	a budget on its own is still run, but only while no other job is
+	running.
+
+	The critical path of a job is estimated from the observed run times of
+	earlier jobs with the same info. Critical paths are determined when a job
+	becomes ready and are reused until the estimates have changed by more than
+	_ESTIMATE_CHANGE_FACTOR, so that scheduling cost stays linear in the
+	number of jobs. When the estimates change, jobs that are already ready
+	are reprioritized as well.
+
+	Timing of every job that is run is recorded in a JobTrace, which can be
+	written to a file in Chrome trace event format once all jobs have
+	completed and optionally be summarized on stdout."""
+	_ESTIMATE_CHANGE_FACTOR = 1.5
+
+	def __init__(self, concurrent_job_count = multiprocessing.cpu_count(), exception_on_failed = True, write_graph_file = None, max_memory = None, write_trace_file = None, print_summary = False):
 		self._concurrent_job_count = concurrent_job_count
+		self._max_memory = max_memory
 		self._exception_on_failed = exception_on_failed
 		if write_graph_file is not None:
 			self._graph_file = JobGraph(write_graph_file)
 		else:
 			self._graph_file = None
+		self._trace = JobTrace()
+		self._write_trace_file = write_trace_file
+		self._print_summary = print_summary
 		self._lock = threading.Lock()
-		self._cond = threading.Condition(self._lock)
+		self._work_cond = threading.Condition(self._lock)
+		self._done_cond = threading.Condition(self._lock)
 		self._stats = {
 			"successful":	0,
 			"failed":		0,
 		}
-		self._running_jobs = [ ]
-		self._waiting_jobs = [ ]
+		self._ready_jobs = [ ]			# Heap of (-priority, -critical path, sequence number, job)
+		self._ready_seqno = itertools.count()
+		self._durations = { }			# Observed (count, total seconds) by job info
+		self._estimates = { }			# Estimated duration by job info, used for critical paths
+		self._default_estimate = 1		# Estimated duration of jobs with unknown info
+		self._estimates_generation = 0	# Increased whenever the estimates change
+		self._running_count = 0
+		self._running_threads = 0
+		self._running_memory = 0
+		self._outstanding_count = 0		# Added, but not yet terminated
+		self._workers = [ ]
+		self._shutdown = False
+		self._process_pool = None
+
+	@property
+	def concurrent_job_count(self):
+		return self._concurrent_job_count
+
+	@property
+	def trace(self):
+		return self._trace
 
 	def __enter__(self):
 		return self
@@ -260,96 +448,208 @@ class JobServer():
 
 	def notify_success(self, job):
 		_log.debug("%s successfully terminated.", str(job))
-		with self._lock:
-			self._stats["successful"] += 1
-		self.start_jobs()
 
 	def notify_failure(self, job, exception):
 		_log.error("%s failed with %s: %s", str(job), exception.exception.__class__.__name__, str(exception.exception))
 		if _log.isEnabledFor(logging.DEBUG):
 			_log.error(exception.stacktrace)
+
+	def _estimated_duration(self, job):
+		# Called with the lock held.
+		return self._estimates.get(job.info, self._default_estimate)
+
+	def _critical_path(self, job):
+		# Called with the lock held. The critical path of a job is its own
+		# estimated duration plus the longest critical path of all dependent
+		# jobs. It is determined by an iterative post-order traversal that also
+		# determines it for all dependent jobs; values that were determined with
+		# the current estimates are reused.
+		generation = self._estimates_generation
+		stack = [ (job, False) ]
+		while len(stack) > 0:
+			(current, children_done) = stack.pop()
+			if current._critical_path_generation == generation:
+				continue
+			if not children_done:
+				stack.append((current, True))
+				for child in itertools.chain(current._notify_after, current._cleanup_after):
+					if child._critical_path_generation != generation:
+						stack.append((child, False))
+			else:
+				longest_child_path = max((child._critical_path for child in itertools.chain(current._notify_after, current._cleanup_after)), default = 0)
+				current._critical_path = self._estimated_duration(current) + longest_child_path
+				current._critical_path_generation = generation
+		return job._critical_path
+
+	def _enqueue(self, job):
+		# Called with the lock held.
+		job._enqueued = time.monotonic()
+		heapq.heappush(self._ready_jobs, (-job.priority, -self._critical_path(job), next(self._ready_seqno), job))
+		self._work_cond.notify()
+
+	def _record_duration(self, job, duration):
+		# Called with the lock held.
+		(count, total) = self._durations.get(job.info, (0, 0))
+		(count, total) = (count + 1, total + duration)
+		self._durations[job.info] = (count, total)
+
+		# Only invalidate the critical paths of all jobs if the estimate
+		# changed significantly, e.g., when the first job of a kind finished.
+		estimate = total / count
+		previous_estimate = self._estimates.get(job.info)
+		if (previous_estimate is None) or (not (previous_estimate / self._ESTIMATE_CHANGE_FACTOR <= estimate <= previous_estimate * self._ESTIMATE_CHANGE_FACTOR)):
+			self._estimates[job.info] = estimate
+			self._default_estimate = sum(total for (count, total) in self._durations.values()) / sum(count for (count, total) in self._durations.values())
+			self._estimates_generation += 1
+			self._reprioritize_ready_jobs()
+
+	def _reprioritize_ready_jobs(self):
+		# Called with the lock held.
+		self._ready_jobs = [ (-job.priority, -self._critical_path(job), seqno, job) for (_, _, seqno, job) in self._ready_jobs ]
+		heapq.heapify(self._ready_jobs)
+
+	def _job_terminated(self, job, success, result):
+		# Called with the lock held. Propagate iteratively so that long chains
+		# of failing jobs do not exhaust the recursion limit.
+		self._outstanding_count -= 1
+		terminated = [ (job, success) ]
+		while len(terminated) > 0:
+			(parent, success) = terminated.pop()
+			for child in parent._notify_after:
+				if success:
+					if child.notify_parent_finished(parent):
+						self._enqueue(child)
+				elif child.notify_parent_failed(parent):
+					self._outstanding_count -= 1
+					terminated.append((child, False))
+			for child in parent._cleanup_after:
+				if child.notify_parent_finished(parent):
+					self._enqueue(child)
+		self._done_cond.notify_all()
+
+	def _next_job_admissible(self):
+		# Called with the lock held. Jobs are admitted strictly in order, so a
+		# large job at the head of the queue cannot be starved by smaller ones.
+		if len(self._ready_jobs) == 0:
+			return False
+		if self._running_count == 0:
+			return True
+		job = self._ready_jobs[0][-1]
+		if self._running_threads + job.threads > self._concurrent_job_count:
+			return False
+		if (self._max_memory is not None) and (self._running_memory + job.memory > self._max_memory):
+			return False
+		return True
+
+	def _worker_thread(self, worker_no):
+		while True:
+			with self._lock:
+				while (not self._next_job_admissible()) and (not self._shutdown):
+					self._work_cond.wait()
+				if len(self._ready_jobs) == 0:
+					return
+				job = heapq.heappop(self._ready_jobs)[-1]
+				self._running_count += 1
+				self._running_threads += job.threads
+				self._running_memory += job.memory
+				_log.debug("Starting job [currently %d running %d ready, %d threads and %d MiB in use]: %s", self._running_count, len(self._ready_jobs), self._running_threads, self._running_memory // (1024 * 1024), str(job))
+
+			t0 = time.monotonic()
+			if job.cpu_bound:
+				(success, result) = job.run(executor = self._get_process_pool())
+			else:
+				(success, result) = job.run()
+			t1 = time.monotonic()
+			if success:
+				self.notify_success(job)
+			else:
+				self.notify_failure(job, result)
+
+			with self._lock:
+				self._running_count -= 1
+				self._running_threads -= job.threads
+				self._running_memory -= job.memory
+				# Freed resources may allow waiting workers to start jobs.
+				self._work_cond.notify_all()
+				self._stats["successful" if success else "failed"] += 1
+				self._record_duration(job, t1 - t0)
+				self._trace.record(job, enqueued = job._enqueued, started = t0, finished = t1, worker_no = worker_no, success = success)
+				self._job_terminated(job, success, result)
+
+	def _get_process_pool(self):
+		with self._lock:
+			if self._process_pool is None:
+				# Worker threads are already running at this point, so use a
+				# forkserver instead of forking this process directly.
+				self._process_pool = concurrent.futures.ProcessPoolExecutor(max_workers = self._concurrent_job_count, mp_context = multiprocessing.get_context("forkserver"))
+			return self._process_pool
+
+	def _start_workers(self):
+		# Called with the lock held.
+		if len(self._workers) > 0:
+			return
+		self._shutdown = False
+		for worker_no in range(self._concurrent_job_count):
+			worker = threading.Thread(target = self._worker_thread, args = (worker_no, ), name = "JobServer-worker-%d" % (worker_no), daemon = True)
+			worker.start()
+			self._workers.append(worker)
+
+	def _stop_workers(self):
+		with self._lock:
+			self._shutdown = True
+			self._work_cond.notify_all()
+			workers = self._workers
+			self._workers = [ ]
+		for worker in workers:
+			worker.join()
 		with self._lock:
-			self._stats["failed"] += 1
-		self.start_jobs()
+			(process_pool, self._process_pool) = (self._process_pool, None)
+		if process_pool is not None:
+			process_pool.shutdown()
 
 	def await_completion(self):
 		with self._lock:
-			while (len(self._waiting_jobs) > 0) or (len(self._running_jobs) > 0):
+			while self._outstanding_count > 0:
 				try:
-					self._cond.wait()
+					self._done_cond.wait()
 				except KeyboardInterrupt:
-					_log.error("Interrupted: %d running jobs, %d waiting", len(self._running_jobs), len(self._waiting_jobs))
-					for waiting_job in self._waiting_jobs:
-						_log.debug("Waiting when keyboard interrupt hit: %s", str(waiting_job))
-					for running_job in self._running_jobs:
-						_log.debug("Running when keyboard interrupt hit: %s", str(running_job))
+					_log.error("Interrupted: %d running jobs, %d ready, %d outstanding in total", self._running_count, len(self._ready_jobs), self._outstanding_count)
+					for (_, _, _, ready_job) in self._ready_jobs:
+						_log.debug("Ready when keyboard interrupt hit: %s", str(ready_job))
+					self._ready_jobs.clear()
 					raise
+		self._stop_workers()
+		if self._write_trace_file is not None:
+			self._trace.write_chrome_trace(self._write_trace_file)
+		if self._print_summary:
+			self._trace.print_summary()
 		if (self._stats["failed"] > 0) and self._exception_on_failed:
 			raise JobServerExecutionFailed("There were %d job(s) that failed (%d completed successfully)." % (self._stats["failed"], self._stats["successful"]))
 
-	def __start_job(self, job):
-		_log.debug("Starting job [currently %d running %d waiting]: %s", len(self._running_jobs), len(self._waiting_jobs), str(job))
-		def run_job_thread():
-			job.run()
-			with self._lock:
-				self._running_jobs.remove(job)
-				self._cond.notify_all()
-			self.start_jobs()
-
-		self._running_jobs.append(job)
-		job.thread = threading.Thread(target = run_job_thread)
-		job.thread.start()
-
-	def start_jobs(self):
-		with self._lock:
-			runnable_jobs = [ ]
-			blocked_jobs = [ ]
-			for waiting_job in self._waiting_jobs:
-				if waiting_job.state == JobState.Waiting:
-					runnable_jobs.append(waiting_job)
-				elif waiting_job.state == JobState.Blocked:
-					blocked_jobs.append(waiting_job)
-				else:
-					_log.debug("Removed job: %s", waiting_job)
-			_log.debug("At start %d jobs runnable, %d blocked", len(runnable_jobs), len(blocked_jobs))
-			self._waiting_jobs = blocked_jobs
-			while (len(runnable_jobs) > 0) and (len(self._running_jobs) < self._concurrent_job_count):
-				next_job = runnable_jobs.pop(0)
-				self.__start_job(next_job)
-			self._waiting_jobs += runnable_jobs
-
 	def add_jobs(self, *jobs):
-		added_jobs = False
-		for primary_job in jobs:
-			for job in primary_job.recurse_untracked():
-				assert(isinstance(job, Job))
-				if self._graph_file is not None:
-					self._graph_file.add_job(job)
-				# Not added yet, claim job
-				job.jobserver = self
-				added_jobs = True
-				with self._lock:
-					self._waiting_jobs.append(job)
-		if added_jobs:
-			self.start_jobs()
+		with self._lock:
+			for primary_job in jobs:
+				for job in primary_job.recurse_untracked():
+					assert(isinstance(job, Job))
+					if self._graph_file is not None:
+						self._graph_file.add_job(job)
+					# Not added yet, claim job
+					job.jobserver = self
+					self._outstanding_count += 1
+					if job.state == JobState.Waiting:
+						self._enqueue(job)
+			if self._outstanding_count > 0:
+				self._start_workers()
 
 	def wait(self, *jobs):
-		remaining = list(jobs)
 		with self._lock:
-			while True:
-				still_remaining = [ ]
-				for job in remaining:
-					if (job in self._running_jobs) or (job in self._waiting_jobs):
-						still_remaining.append(job)
-				remaining = still_remaining
-				if len(remaining) == 0:
-					break
-				self._cond.wait()
+			while any((job.jobserver is self) and (not job.terminated) for job in jobs):
+				self._done_cond.wait()
 
 if __name__ == "__main__":
-	import time
 	logging.basicConfig(format = "{name:>30s} [{levelname:.1s}]: {message}", style = "{", level = logging.DEBUG)
 
+	demo = sys.argv[1] if (len(sys.argv) > 1) else "finally"
 	with JobServer(concurrent_job_count = 3) as js:
 		def my_long_job(name):
 			print("RUN", name)
@@ -363,7 +663,6 @@ if __name__ == "__main__":
 		def finalize_job():
 			print("FINALIZE RUNNING")
 
-		demo = "finally"
 
 		if demo == "1parent-2child":
 			# Run two that depend on one
@@ -397,3 +696,43 @@ if __name__ == "__main__":
 		job2 = Job(my_long_job, ("wll run2", ))
 		js.add_jobs(job1, job2)
 		js.wait(job1, job2)
+
+	if demo == "cpu_bound":
+		# Callbacks of CPU-bound jobs run in a process pool and therefore must be
+		# picklable, which functions defined in __main__ are not.
+		import math
+		with JobServer() as js:
+			jobs = [ Job(math.factorial, (50000 + i, ), info = "factorial", cpu_bound = True) for i in range(8) ]
+			failing_job = Job(int, ("not a number", ), info = "failing", cpu_bound = True)
+			Job(lambda: print("Bit lengths:", [ job.result.bit_length() for job in jobs ]), info = "print").depends_on(*jobs)
+			js.add_jobs(*jobs, failing_job)
+
+	if demo == "memory":
+		# Four workers, but only two of the big jobs fit into the memory budget
+		# at the same time. Admission is strictly in order, so the small jobs
+		# only start once all big jobs have been admitted.
+		js = JobServer(concurrent_job_count = 4, max_memory = 1024 * 1024 * 1024)
+		big_jobs = [ Job(my_long_job, ("big%d" % (i), ), info = "big", memory = 450 * 1024 * 1024) for i in range(4) ]
+		small_jobs = [ Job(my_long_job, ("small%d" % (i), ), info = "small", memory = 100 * 1024 * 1024) for i in range(4) ]
+		t0 = time.time()
+		js.add_jobs(*big_jobs, *small_jobs)
+		js.await_completion()
+		print("Finished after %.1f sec" % (time.time() - t0))
+
+	if demo == "benchmark":
+		# Schedule a layered DAG of no-op jobs in which every job depends on
+		# two jobs of the previous layer.
+		(width, depth) = (100, 1000)
+		logging.getLogger().setLevel(logging.WARNING)
+		t0 = time.time()
+		js = JobServer()
+		previous_layer = [ Job(int) for _ in range(width) ]
+		roots = list(previous_layer)
+		for layer_no in range(depth - 1):
+			layer = [ Job(int).depends_on(previous_layer[i], previous_layer[(i + 1) % width]) for i in range(width) ]
+			previous_layer = layer
+		t1 = time.time()
+		js.add_jobs(*roots)
+		js.await_completion()
+		t2 = time.time()
+		print("%d jobs: %.2f sec to create, %.2f sec to schedule and run (%.0f jobs/sec)" % (width * depth, t1 - t0, t2 - t1, width * depth / (t2 - t1)))
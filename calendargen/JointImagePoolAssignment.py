@@ -0,0 +1,110 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import random
+import collections
+import logging
+
+_log = logging.getLogger(__spec__.name)
+
+class JointImagePoolAssignment():
+	"""Places images for several ImagePoolAssignments (one per variant) in a
+	single pass, so that the variants end up with mostly different images.
+
+	The variants take turns, each filling one slot per round, so no variant
+	gets to pick all the best images first. Every variant keeps its own
+	constraints (only/force tags, groups and time windows within the
+	variant). For a slot, sample_size compatible candidates are drawn at
+	random and the one with the lowest cost is placed:
+
+		cost = overlap_penalty * (times already used by other variants) - fit
+
+	where fit is the fraction of the image that survives cropping (between
+	0.75 and 1). With the default penalty of 1, an image that is unused
+	elsewhere always wins over one that is; small penalties only avoid
+	overlap between otherwise equally well fitting images."""
+
+	def __init__(self, assignments, overlap_penalty = 1.0, sample_size = 32, rng = random):
+		self._assignments = list(assignments)
+		self._rng = rng
+		self._overlap_penalty = overlap_penalty
+		self._sample_size = sample_size
+		self._use_counts = collections.Counter()
+
+	def _choose(self, candidates, aspect_ratio):
+		best_choice = None
+		best_cost = None
+		for _ in range(self._sample_size):
+			candidate = candidates.choose_compatible(aspect_ratio, rng = self._rng)
+			if candidate is None:
+				return None
+			cost = (self._overlap_penalty * self._use_counts[candidate.filename]) - candidates.fit_score(candidate, aspect_ratio)
+			if (best_cost is None) or (cost < best_cost):
+				(best_choice, best_cost) = (candidate, cost)
+		return best_choice
+
+	def _count_uses(self, assignment, increment):
+		for slot in assignment.slots:
+			if slot.filled:
+				self._use_counts[slot.filled_by.filename] += increment
+
+	def attempt_placement(self):
+		"""Returns True if all slots of all variants were filled and all forced
+		images were placed. Variants for which the joint pass does not achieve
+		this are placed again on their own, with their own placement method;
+		slots which that fills greedily still avoid the images used by the
+		other variants."""
+		pending = collections.OrderedDict()
+		forced = { }
+		for assignment in self._assignments:
+			(remaining_slots, forced_images) = assignment.begin_placement()
+			self._count_uses(assignment, 1)
+			pending[assignment] = remaining_slots
+			forced[assignment] = forced_images
+		_log.debug("Jointly filling %d slots of %d variants.", sum(len(remaining_slots) for remaining_slots in pending.values()), len(pending))
+
+		failed = collections.Counter()
+		while len(pending) > 0:
+			for (assignment, remaining_slots) in list(pending.items()):
+				if len(remaining_slots) == 0:
+					del pending[assignment]
+					continue
+				slot = remaining_slots.pop()
+				if assignment.attempt_placement_of(slot, forced[assignment], choose = self._choose):
+					self._use_counts[slot.filled_by.filename] += 1
+				else:
+					failed[assignment] += 1
+
+		success = True
+		for assignment in self._assignments:
+			if (failed[assignment] > 0) or (len(forced[assignment]) > 0):
+				_log.warning("Joint image placement for variant %s left %d slot(s) unfilled and %d forced image(s) unplaced, placing variant individually.", assignment.variant_name, failed[assignment], len(forced[assignment]))
+				self._count_uses(assignment, -1)
+				complete = assignment.attempt_placement(choose = self._choose)
+				self._count_uses(assignment, 1)
+				if not complete:
+					_log.error("Individual image placement for variant %s did not succeed either, %d slot(s) unfilled.", assignment.variant_name, assignment.unfilled_count)
+				success = complete and success
+
+		use_counts = [ count for count in self._use_counts.values() if count > 0 ]
+		overlap_count = sum(count - 1 for count in use_counts)
+		_log.info("Jointly placed %d images in %d variants, %d distinct images, %d reused.", sum(use_counts), len(self._assignments), len(use_counts), overlap_count)
+		return success
@@ -0,0 +1,113 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import logging
+from .Enums import LayerCompositionMethod
+from .Exceptions import IllegalLayoutDefinitionException
+
+_log = logging.getLogger(__spec__.name)
+
+class LayerCompositor():
+	"""Composes rendered RGBA layers in memory. Images are PIL images in RGBA
+	mode (straight alpha), so alpha composition can be done directly by
+	Pillow and only the inverted composition needs to be computed by hand.
+
+	Pillow and NumPy are only imported when layers are actually composed, so
+	that creating layouts does not require them."""
+
+	# Number of rows processed at once during inverted composition; bounds the
+	# size of the floating point temporaries at high resolutions.
+	_STRIPE_HEIGHT = 256
+
+	# Formats which Pillow can write directly, by file extension.
+	_PIL_FORMATS = {
+		"jpg":	"JPEG",
+		"jpeg":	"JPEG",
+		"png":	"PNG",
+	}
+
+	def __init__(self, resolution_dpi = None, jpeg_quality = 92):
+		self._resolution_dpi = resolution_dpi
+		self._jpeg_quality = jpeg_quality
+
+	@staticmethod
+	def load(filename):
+		import PIL.Image
+		with PIL.Image.open(filename) as image:
+			return image.convert("RGBA")
+
+	def _alpha_compose(self, lower, upper):
+		import PIL.Image
+		return PIL.Image.alpha_composite(lower, upper)
+
+	def _inverted_compose(self, lower, upper):
+		# Equivalent to the previously used ImageMagick chain: with A being the
+		# alpha channel of the upper layer and L the lower layer's color,
+		#   result = L * (1 - A) + (1 - L * A) * A^2
+		# i.e., the lower layer is color-inverted wherever the upper layer is
+		# opaque. The colors of the upper layer are ignored and the alpha
+		# channel of the lower layer is retained.
+		import numpy
+		import PIL.Image
+		lower_data = numpy.asarray(lower)
+		upper_alpha = numpy.asarray(upper.getchannel("A"))
+		result = numpy.array(lower_data)
+		for y in range(0, lower_data.shape[0], self._STRIPE_HEIGHT):
+			rows = slice(y, y + self._STRIPE_HEIGHT)
+			color = lower_data[rows, :, :3].astype(numpy.float32) / 255
+			alpha = upper_alpha[rows, :, numpy.newaxis].astype(numpy.float32) / 255
+			composed = (color * (1 - alpha)) + ((1 - (color * alpha)) * (alpha * alpha))
+			result[rows, :, :3] = numpy.clip(numpy.rint(composed * 255), 0, 255).astype(numpy.uint8)
+		return PIL.Image.fromarray(result, mode = "RGBA")
+
+	def compose(self, lower, upper, composition_method):
+		assert(isinstance(composition_method, LayerCompositionMethod))
+		if lower.size != upper.size:
+			raise IllegalLayoutDefinitionException("Unable to compose layers of different size: %d x %d and %d x %d pixels." % (lower.size[0], lower.size[1], upper.size[0], upper.size[1]))
+		if composition_method == LayerCompositionMethod.AlphaCompose:
+			return self._alpha_compose(lower, upper)
+		elif composition_method == LayerCompositionMethod.InvertedCompose:
+			return self._inverted_compose(lower, upper)
+		else:
+			raise IllegalLayoutDefinitionException("Unsupported layer composition method: %s" % (composition_method.name))
+
+	@classmethod
+	def can_write(cls, output_filename):
+		extension = output_filename.rsplit(".", maxsplit = 1)[-1].lower()
+		return extension in cls._PIL_FORMATS
+
+	def write(self, image, output_filename, flatten):
+		import PIL.Image
+		extension = output_filename.rsplit(".", maxsplit = 1)[-1].lower()
+		pil_format = self._PIL_FORMATS[extension]
+		if flatten:
+			background = PIL.Image.new("RGBA", image.size, (255, 255, 255, 255))
+			image = PIL.Image.alpha_composite(background, image).convert("RGB")
+		elif pil_format == "JPEG":
+			image = image.convert("RGB")
+
+		save_args = { }
+		if self._resolution_dpi is not None:
+			save_args["dpi"] = (self._resolution_dpi, self._resolution_dpi)
+		if pil_format == "JPEG":
+			save_args["quality"] = self._jpeg_quality
+		_log.debug("Writing %d x %d composed image to %s", image.size[0], image.size[1], output_filename)
+		image.save(output_filename, format = pil_format, **save_args)
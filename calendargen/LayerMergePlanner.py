@@ -0,0 +1,126 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import logging
+from .JobServer import Job
+from .Enums import LayerCompositionMethod
+
+_log = logging.getLogger(__spec__.name)
+
+class MergeNode():
+	"""A node in the merge tree. Leaf nodes refer to a rendered layer file,
+	inner nodes hold the in-memory result of their merge job. The result can
+	only be taken once so that intermediate buffers are released as early as
+	possible."""
+	def __init__(self, job, filename = None):
+		self._job = job
+		self._filename = filename
+		self._image = None
+
+	@property
+	def job(self):
+		return self._job
+
+	@job.setter
+	def job(self, value):
+		assert(self._job is None)
+		self._job = value
+
+	@property
+	def image(self):
+		return self._image
+
+	@image.setter
+	def image(self, value):
+		self._image = value
+
+	def take(self, compositor):
+		if self._filename is not None:
+			return compositor.load(self._filename)
+		(image, self._image) = (self._image, None)
+		assert(image is not None)
+		return image
+
+class LayerMergePlanner():
+	"""Plans the merge jobs of all layers of a page. Alpha composition is
+	associative, so consecutive runs of alpha composed layers are merged as a
+	balanced tree. Inverted composition depends on everything below it and
+	therefore acts as a barrier: all lower layers are merged first, then the
+	inverted layer is applied. Runs above an inverted layer are still merged
+	in parallel to everything below it.
+
+	Merge jobs are scheduled with elevated priority, so pages whose layers
+	are rendered are finished (and their buffers released) before rendering
+	of further layers continues."""
+	MERGE_PRIORITY = 1
+
+	def __init__(self, compositor, page_pixels = None):
+		self._compositor = compositor
+		self._merge_count = 0
+		self._merge_memory = self.merge_memory(page_pixels)
+
+	@staticmethod
+	def merge_memory(page_pixels, buffer_count = 3):
+		"""Memory needed by a job that holds the given number of full-page RGBA
+		buffers at once (two inputs and one output for a merge)."""
+		if page_pixels is None:
+			return 0
+		return page_pixels[0] * page_pixels[1] * 4 * buffer_count
+
+	def _merge(self, target, lower, upper, composition_method):
+		target.image = self._compositor.compose(lower.take(self._compositor), upper.take(self._compositor), composition_method)
+
+	def _merge_nodes(self, lower, upper, composition_method):
+		if lower is None:
+			return upper
+		if upper is None:
+			return lower
+		self._merge_count += 1
+		node = MergeNode(job = None)
+		node.job = Job(self._merge, (node, lower, upper, composition_method), info = "merge", priority = self.MERGE_PRIORITY, memory = self._merge_memory).depends_on(lower.job, upper.job)
+		return node
+
+	def _merge_tree(self, nodes):
+		if len(nodes) == 0:
+			return None
+		elif len(nodes) == 1:
+			return nodes[0]
+		split = len(nodes) // 2
+		return self._merge_nodes(self._merge_tree(nodes[:split]), self._merge_tree(nodes[split:]), LayerCompositionMethod.AlphaCompose)
+
+	def plan(self, layers):
+		"""Takes an iterable of (render_job, filename, composition_method)
+		tuples, bottom layer first, and returns the root node. Its job finishes
+		once the whole page is merged. The composition method of the bottom
+		layer is ignored."""
+		accumulated = None
+		alpha_run = [ ]
+		for (render_job, filename, composition_method) in layers:
+			leaf = MergeNode(render_job, filename = filename)
+			if (composition_method == LayerCompositionMethod.InvertedCompose) and ((accumulated is not None) or (len(alpha_run) > 0)):
+				accumulated = self._merge_nodes(accumulated, self._merge_tree(alpha_run), LayerCompositionMethod.AlphaCompose)
+				accumulated = self._merge_nodes(accumulated, leaf, LayerCompositionMethod.InvertedCompose)
+				alpha_run = [ ]
+			else:
+				alpha_run.append(leaf)
+		root = self._merge_nodes(accumulated, self._merge_tree(alpha_run), LayerCompositionMethod.AlphaCompose)
+		_log.trace("Planned %d merge jobs", self._merge_count)
+		return root
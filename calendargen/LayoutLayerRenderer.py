@@ -19,33 +19,87 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
-import pkgutil
 import tempfile
-import subprocess
 import logging
 from .SVGProcessor import SVGProcessor
+from .SVGTemplate import SVGTemplate
+from .SVGTemplateManifest import SVGTemplateManifest
 from .JobServer import Job
-from .CmdlineEscape import CmdlineEscape
+from .FileCache import FileCache
 
 _log = logging.getLogger(__spec__.name)
 
 class LayoutLayerRenderer():
-	def __init__(self, layout_definition, page_no, layer_definition, resolution_dpi, output_file, temp_dir):
+	# Increase whenever the rendering pipeline changes in a way that makes
+	# previously cached layers invalid.
+	_CACHE_VERSION = 2
+
+	# Rough estimate of inkscape's peak memory usage: a fixed base plus
+	# several full-page RGBA buffers.
+	_INKSCAPE_BASE_MEMORY = 200 * 1024 * 1024
+	_INKSCAPE_BYTES_PER_PIXEL = 4 * 3
+
+	def __init__(self, layout_definition, page_no, layer_definition, resolution_dpi, output_file, temp_dir, svg_renderer, render_cache = None, image_cropper = None):
 		self._layout_definition = layout_definition
 		self._page_no = page_no
 		self._layer_definition = layer_definition
 		self._resolution_dpi = resolution_dpi
 		self._output_file = output_file
 		self._temp_dir = temp_dir
+		self._svg_renderer = svg_renderer
+		self._render_cache = render_cache
+		self._image_cropper = image_cropper
+		self._cache_key = None
+		self._page_pixels = None
+
+	@property
+	def svg_name(self):
+		return "%s_%s.svg" % (self._layout_definition.format, self._layer_definition["template"])
+
+	@property
+	def template(self):
+		return SVGTemplate.load(self.svg_name)
+
+	@property
+	def page_pixels(self):
+		"""Size of the rendered layer, in pixels."""
+		if self._page_pixels is None:
+			self._page_pixels = SVGTemplateManifest.load(self.svg_name).get_page_pixels(self._resolution_dpi)
+		return self._page_pixels
 
-	def _render_svg(self, svg_processor):
+	def _image_identity(self, img_ref):
+		image = self._layout_definition.images.get(img_ref)
+		if (image is None) or (image.get("filename") is None):
+			return [ image, None ]
+		return [ image, FileCache.file_identity(image["filename"]) ]
+
+	def cache_key(self):
+		"""Hash over everything that influences the rendered layer. Image
+		references are replaced by the referenced image's metadata and file
+		identity, so that the same image placed on different pages or in
+		different layouts results in the same key."""
+		if self._cache_key is not None:
+			return self._cache_key
+		transform = { }
+		for (element_name, transform_instructions) in self._layer_definition.get("transform", { }).items():
+			transform[element_name] = [ ]
+			for instruction in transform_instructions:
+				if "img_ref" in instruction:
+					instruction = dict(instruction)
+					instruction["img_ref"] = self._image_identity(instruction["img_ref"])
+				transform[element_name].append(instruction)
+		oversampling = None if (self._image_cropper is None) else self._image_cropper.oversampling
+		self._cache_key = FileCache.key(self._CACHE_VERSION, SVGTemplateManifest.load(self.svg_name).digest, transform, self._resolution_dpi, oversampling)
+		return self._cache_key
+
+	def _render_svg(self, svg_processor, cache_key):
 		# Then render the SVG. Note we're already in a job thread, so we can
 		# block here.
 		with tempfile.NamedTemporaryFile(prefix = "calgen_layer_", suffix = ".svg") as svg_file:
 			svg_processor.write(svg_file.name)
-			render_cmd = [ "inkscape", "-d", str(self._resolution_dpi), "-o", self._output_file, svg_file.name ]
-			_log.debug("Render SVG: %s", CmdlineEscape().cmdline(render_cmd))
-			subprocess.check_call(render_cmd, stdout = _log.subproc_target, stderr = _log.subproc_target)
+			self._svg_renderer.render(svg_file.name, self._output_file, self._resolution_dpi)
+		if cache_key is not None:
+			self._render_cache.store(cache_key, self._output_file)
 
 	def render(self, job_server):
 		layer_vars = {
@@ -54,16 +108,23 @@ class LayoutLayerRenderer():
 		}
 		if "vars" in self._layer_definition:
 			layer_vars.update(self._layer_definition["vars"])
-		svg_name = "%s_%s.svg" % (self._layout_definition.format, self._layer_definition["template"])
-		svg_data = pkgutil.get_data("calendargen.data", "templates/" + svg_name)
+		svg_name = self.svg_name
+		if self._render_cache is not None:
+			cache_key = self.cache_key()
+			if self._render_cache.lookup(cache_key) is not None:
+				_log.debug("Layer %s of page %d found in render cache: %s", svg_name, self._page_no, cache_key)
+				return Job(self._render_cache.retrieve, (cache_key, self._output_file), info = "layer_from_cache")
+		else:
+			cache_key = None
 
-		svg_processor = SVGProcessor(svg_data, self._temp_dir)
-		image_metadata = self._layout_definition.images
-		for (element_name, transform_instructions) in self._layer_definition.get("transform", { }).items():
-			svg_processor.handle_instructions(element_name, image_metadata, transform_instructions)
+		svg_processor = SVGProcessor(self.template, self._temp_dir, image_cropper = self._image_cropper, resolution_dpi = self._resolution_dpi)
+		self._page_pixels = svg_processor.get_page_pixels(self._resolution_dpi)
+		svg_processor.transform(self._layer_definition.get("transform", { }), self._layout_definition.images)
 
 		if len(svg_processor.unused_elements) > 0:
 			_log.warning("SVG transformation of %s had %d unhandled elements: %s", svg_name, len(svg_processor.unused_elements), ", ".join(sorted(svg_processor.unused_elements)))
 
-		render_svg_job = Job(self._render_svg, (svg_processor, ), info = "layer_render_svg").depends_on(*svg_processor.dependent_jobs)
+		(width, height) = self.page_pixels
+		render_memory = self._INKSCAPE_BASE_MEMORY + (width * height * self._INKSCAPE_BYTES_PER_PIXEL)
+		render_svg_job = Job(self._render_svg, (svg_processor, cache_key), info = "layer_render_svg", memory = render_memory).depends_on(*svg_processor.dependent_jobs)
 		return render_svg_job
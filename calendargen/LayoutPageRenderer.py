@@ -23,6 +23,8 @@ import subprocess
 import logging
 from .JobServer import Job
 from .LayoutLayerRenderer import LayoutLayerRenderer
+from .LayerCompositor import LayerCompositor
+from .LayerMergePlanner import LayerMergePlanner
 from .Enums import LayerCompositionMethod
 from .Exceptions import IllegalLayoutDefinitionException
 from .CmdlineEscape import CmdlineEscape
@@ -30,7 +32,7 @@ from .CmdlineEscape import CmdlineEscape
 _log = logging.getLogger(__spec__.name)
 
 class LayoutPageRenderer():
-	def __init__(self, calendar_definition, page_no, page_definition, resolution_dpi, output_file, flatten_output, temp_dir):
+	def __init__(self, calendar_definition, page_no, page_definition, resolution_dpi, output_file, flatten_output, temp_dir, svg_renderer, render_cache = None, shared_layers = None, image_cropper = None):
 		self._calendar_definition = calendar_definition
 		self._page_no = page_no
 		self._page_definition = page_definition
@@ -38,6 +40,10 @@ class LayoutPageRenderer():
 		self._output_file = output_file
 		self._flatten_output = flatten_output
 		self._temp_dir = temp_dir
+		self._svg_renderer = svg_renderer
+		self._render_cache = render_cache
+		self._shared_layers = shared_layers
+		self._image_cropper = image_cropper
 		if self.layer_count == 0:
 			raise IllegalLayoutDefinitionException("No layers defined for page.")
 
@@ -49,24 +55,12 @@ class LayoutPageRenderer():
 		output_filename = base_dir + "/layer_%03d.png" % (layer_no)
 		return output_filename
 
-	def _render_layer_job(self, layer_definition, output_filename, job_server):
-		layer_renderer = LayoutLayerRenderer(self._calendar_definition, self._page_no, layer_definition, self._resolution_dpi, output_filename, temp_dir = self._temp_dir)
-		return layer_renderer.render(job_server)
-
-	def _compose_layers(self, lower_filename, upper_filename, composition_method):
-		assert(isinstance(composition_method, LayerCompositionMethod))
-		if composition_method == LayerCompositionMethod.AlphaCompose:
-			conversion_cmd = [ "convert", "-background", "transparent", "-layers", "flatten", lower_filename, upper_filename, upper_filename ]
-		elif composition_method == LayerCompositionMethod.InvertedCompose:
-			conversion_cmd = [ "convert" ]
-			conversion_cmd += [ lower_filename, "+write", "mpr:lower" ]
-			conversion_cmd += [ "(", upper_filename, "-alpha", "extract", "+write", "mpr:upper", ")" ]
-			conversion_cmd += [ "-compose", "multiply", "-composite", "-negate" ]
-			conversion_cmd += [ "mpr:upper", "-compose", "multiply", "-composite" ]
-			conversion_cmd += [ "mpr:lower", "+swap", "mpr:upper", "-compose", "over", "-composite" ]
-			conversion_cmd += [ upper_filename ]
-		_log.debug("Compose layers using %s: %s", composition_method.name, CmdlineEscape().cmdline(conversion_cmd))
-		subprocess.check_call(conversion_cmd)
+	def _render_layer_job(self, layer_renderer, output_filename, job_server):
+		if self._shared_layers is None:
+			return (layer_renderer.render(job_server), output_filename)
+		else:
+			shared_layer = self._shared_layers.get(layer_renderer.cache_key(), lambda: (layer_renderer.render(job_server), output_filename))
+			return (shared_layer.job, shared_layer.filename)
 
 	def _final_conversion(self, input_filename):
 		conversion_cmd = [ "convert" ]
@@ -79,29 +73,39 @@ class LayoutPageRenderer():
 		_log.debug("Final conversion: %s", CmdlineEscape().cmdline(conversion_cmd))
 		subprocess.check_call(conversion_cmd)
 
-	def render(self, job_server):
+	def _write_page(self, compositor, root_node):
+		page_image = root_node.take(compositor)
+		if compositor.can_write(self._output_file):
+			compositor.write(page_image, self._output_file, flatten = self._flatten_output)
+		else:
+			# Output format not supported by Pillow, let ImageMagick convert
+			# the composed page.
+			composed_filename = self._temp_dir + "/composed.png"
+			compositor.write(page_image, composed_filename, flatten = False)
+			del page_image
+			self._final_conversion(composed_filename)
+
+	def create_jobs(self, job_server):
+		"""Creates all jobs required to render the page and returns the layer
+		render jobs, which are the roots of the job graph."""
 		layer_jobs = [ ]
+		layers = [ ]
+		page_pixels = None
 		for (layer_no, layer) in enumerate(self._page_definition, 1):
 			output_filename = self._layer_filename(self._temp_dir, layer_no)
-			info = {
-				"name": "layer%d" % (layer_no),
-				"output": output_filename,
-			}
-			layer_jobs.append(self._render_layer_job(layer, output_filename, job_server))
+			composition_method = LayerCompositionMethod(layer.get("compose", "compose"))
+			layer_renderer = LayoutLayerRenderer(self._calendar_definition, self._page_no, layer, self._resolution_dpi, output_filename, temp_dir = self._temp_dir, svg_renderer = self._svg_renderer, render_cache = self._render_cache, image_cropper = self._image_cropper)
+			if page_pixels is None:
+				page_pixels = layer_renderer.page_pixels
+			(layer_job, layer_filename) = self._render_layer_job(layer_renderer, output_filename, job_server)
+			layer_jobs.append(layer_job)
+			layers.append((layer_job, layer_filename, composition_method))
 
-		last_merge_job = layer_jobs[0]
-		if self.layer_count > 1:
-			# Need to always merge two layers, then
-			for (lower_layer_no, layer) in enumerate(self._page_definition[:-1], 1):
-				next_render_job = layer_jobs[lower_layer_no]
-				upper_layer_no = lower_layer_no + 1
-				upper_layer = self._page_definition[lower_layer_no]
-				lower_filename = self._layer_filename(self._temp_dir, lower_layer_no)
-				upper_filename = self._layer_filename(self._temp_dir, upper_layer_no)
-				composition_method = LayerCompositionMethod(upper_layer.get("compose", "compose"))
-				last_merge_job = Job(self._compose_layers, (lower_filename, upper_filename, composition_method), info = "merge%d" % (lower_layer_no)).depends_on(last_merge_job, next_render_job)
+		compositor = LayerCompositor(resolution_dpi = self._resolution_dpi)
+		root_node = LayerMergePlanner(compositor, page_pixels = page_pixels).plan(layers)
+		final_memory = LayerMergePlanner.merge_memory(page_pixels, buffer_count = 2)
+		Job(self._write_page, (compositor, root_node), info = "final", priority = LayerMergePlanner.MERGE_PRIORITY, memory = final_memory).depends_on(root_node.job)
+		return layer_jobs
 
-		last_layer_filename = self._layer_filename(self._temp_dir, self.layer_count)
-		finalization_job = Job(self._final_conversion, (last_layer_filename, ), info = "final").depends_on(last_merge_job)
-
-		job_server.add_jobs(*layer_jobs)
+	def render(self, job_server):
+		job_server.add_jobs(*self.create_jobs(job_server))
@@ -19,14 +19,12 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
-import subprocess
+import functools
 import logging
-import lxml.etree
-import geo
-from .CmdlineEscape import CmdlineEscape
 from .Exceptions import InvalidSVGException, IllegalLayoutDefinitionException
+from .SVGTemplate import SVGTemplate
 from .ImageTools import ImageTools
-from .JobServer import Job
+from .ImageCropper import ImageCropper
 
 _log = logging.getLogger(__spec__.name)
 
@@ -69,16 +67,23 @@ class SVGStyle():
 		return "Style<%s>" % (self.to_string())
 
 class SVGProcessor():
-	def __init__(self, template_svg_data, temp_dir = None):
-		self._ns = {
-			"svg": "http://www.w3.org/2000/svg",
-		}
-		self._xml = lxml.etree.ElementTree(lxml.etree.fromstring(template_svg_data))
+	def __init__(self, template, temp_dir = None, image_cropper = None, resolution_dpi = None):
+		"""template is either an SVGTemplate or raw SVG data. The template
+		itself is left untouched, all transformations are applied to a copy of
+		it."""
+		if not isinstance(template, SVGTemplate):
+			template = SVGTemplate(template)
+		self._template = template
+		(self._xml, self._desc_nodes) = template.copy()
 		self._temp_dir = temp_dir
-		self._desc_nodes = self._find_desc_nodes()
+		self._image_cropper = image_cropper
+		self._resolution_dpi = resolution_dpi
 		self._unused_elements = set(self._desc_nodes)
 		self._dependent_jobs = [ ]
-		self._image_no = 0
+
+	@property
+	def template(self):
+		return self._template
 
 	@property
 	def unused_elements(self):
@@ -88,15 +93,11 @@ class SVGProcessor():
 	def dependent_jobs(self):
 		return self._dependent_jobs
 
-	def _find_desc_nodes(self):
-		desc_nodes = { }
-		for desc_node in self._xml.xpath("//svg:desc", namespaces = self._ns):
-			target_node = desc_node.getparent()
-			description = desc_node.text
-			if description in desc_nodes:
-				raise InvalidSVGException("SVG data contains duplicate description element '%s'." % (description))
-			desc_nodes[description] = target_node
-		return desc_nodes
+	@property
+	def image_cropper(self):
+		if self._image_cropper is None:
+			self._image_cropper = ImageCropper(self._temp_dir)
+		return self._image_cropper
 
 	def _transform_desc(self, node, command_text):
 		svg_commands = SVGCommands.parse(command_text)
@@ -105,51 +106,71 @@ class SVGProcessor():
 	def _handle_noop(self, element, image_metadata, instruction):
 		pass
 
-	def _handle_set_text(self, element, image_metadata, instruction):
+	@staticmethod
+	def _text_node(element):
+		"""Returns the node whose text a set_text instruction replaces, or None
+		if a text element has no tspan."""
 		if element.tag == "{http://www.w3.org/2000/svg}text":
-			tspan = element.find("{http://www.w3.org/2000/svg}tspan")
-			if tspan is not None:
-				tspan.text = instruction["text"]
-			else:
-				_log.error("No tspan found in text element.")
+			return element.find("{http://www.w3.org/2000/svg}tspan")
 		elif element.tag == "{http://www.w3.org/2000/svg}flowRoot":
 			para = element.find("{http://www.w3.org/2000/svg}flowPara")
-			if para is not None:
-				para.text = instruction["text"]
-			else:
+			if para is None:
 				raise InvalidSVGException("No flowPara found in flowRoot element.")
+			return para
 		else:
 			raise InvalidSVGException("Do not know how to substitute text in element '%s'." % (element.tag))
 
-	def _handle_set_style(self, element, image_metadata, instruction):
-		style = SVGStyle.parse(element.get("style"))
-		for keyword in [ "fill", "stroke", "opacity", "stroke-opacity", "fill-opacity", "stoke-width" ]:
-			if keyword in instruction:
-				style[keyword] = instruction[keyword]
+	def _handle_set_text(self, element, image_metadata, instruction):
+		text_node = self._text_node(element)
+		if text_node is not None:
+			text_node.text = instruction["text"]
+		else:
+			_log.error("No tspan found in text element.")
+
+	@staticmethod
+	def _style_changes(instruction):
+		changes = tuple((keyword, instruction[keyword]) for keyword in [ "fill", "stroke", "opacity", "stroke-opacity", "fill-opacity", "stoke-width" ] if keyword in instruction)
 		if instruction.get("hide"):
-			style.hide()
-		element.set("style", style.to_string())
-
-	def _get_transformation_matrix(self, element):
-		matrix = geo.TransformationMatrix.identity()
-		current = element
-		while current is not None:
-			transform_str = current.get("transform")
-			if transform_str is not None:
-				transform = geo.SVGTools.parse_transform(transform_str)
-				matrix *= transform
-			current = current.getparent()
-		return matrix
-
-	def _get_element_dimensions(self, element):
-		orig_box = geo.Box2d(base = geo.Vector2d(float(element.get("x")), float(element.get("y"))), dimensions = geo.Vector2d(float(element.get("width")), float(element.get("height"))))
-		matrix = self._get_transformation_matrix(element)
-		modified_box = orig_box.transform(matrix)
-		dimensions = modified_box.dimensions
-		return dimensions
+			changes += ((None, None), )
+		return changes
+
+	@staticmethod
+	@functools.lru_cache(maxsize = 1024)
+	def _restyle(style_text, changes):
+		# Most styled elements of a template (e.g., all day boxes) share the
+		# same style and receive the same changes, so the result is cached.
+		style = SVGStyle.parse(style_text)
+		for (keyword, value) in changes:
+			if keyword is None:
+				style.hide()
+			else:
+				style[keyword] = value
+		return style.to_string()
+
+	def _handle_set_style(self, element, image_metadata, instruction):
+		self._handle_set_styles(element, [ instruction ])
+
+	def _handle_set_styles(self, element, instructions):
+		"""Applies several set_style instructions with a single parse and
+		serialization of the style attribute."""
+		changes = tuple(change for instruction in instructions for change in self._style_changes(instruction))
+		element.set("style", self._restyle(element.get("style"), changes))
 
 	def get_image_dimensions(self, element_name):
-		return self._get_element_dimensions(self._desc_nodes[element_name])
+		return self._template.element_dimensions(element_name)
+
+	def get_page_pixels(self, resolution_dpi):
+		"""Returns the size of the rendered page in pixels."""
+		return self._template.get_page_pixels(resolution_dpi)
+
+	def _get_element_pixels(self, element):
+		"""Returns the size an element will have in the rendered page, in
+		pixels, or None if the resolution is not known."""
+		if self._resolution_dpi is None:
+			return None
+		dimensions = SVGTemplate.get_element_dimensions(element)
+		scale = self._resolution_dpi / self._template.user_units_per_inch()
+		return (max(1, round(dimensions[0] * scale)), max(1, round(dimensions[1] * scale)))
 
 	def _handle_place_image(self, element, image_metadata, instruction):
 		img_ref = instruction["img_ref"]
@@ -157,7 +178,7 @@ class SVGProcessor():
 			raise IllegalLayoutDefinitionException("Image '%s' referenced by instruction %s, but not defined in the 'images' section." % (img_ref, str(instruction)))
 		image = image_metadata[img_ref]
 
-		dimensions = self._get_element_dimensions(element)
+		dimensions = SVGTemplate.get_element_dimensions(element)
 
 		image_filename = image["filename"]
 		image_dimensions = image["dimensions"]
@@ -180,38 +201,145 @@ class SVGProcessor():
 			cropped_ratio = (image_dimensions[1] - target_height) / image_dimensions[1]
 			cropped_target = "width"
 
-		self._image_no += 1
-		cropped_image_filename = self._temp_dir + "/cropped_%03d.jpg" % (self._image_no)
-
-		_log.trace("Cropping %s: %d x %d (gravity %s) to %s", image_filename, target_dimensions[0], target_dimensions[1], crop_gravity, cropped_image_filename)
+		_log.trace("Cropping %s: %d x %d (gravity %s)", image_filename, target_dimensions[0], target_dimensions[1], crop_gravity)
 		threshold_percent = 2
 		if cropped_ratio > (threshold_percent / 100):
 			_log.warning("Warning: More than %.1f%% of the image %s of %s are cropped (%.1f%% cropped).", threshold_percent, image_filename, cropped_target, cropped_ratio * 100)
 
-		crop_cmd = [ "convert", image_filename, "-auto-gamma", "-gravity", crop_gravity, "-crop", "%dx%d+0+0" % (target_dimensions[0], target_dimensions[1]), cropped_image_filename ]
-		_log.debug("Crop image: %s", CmdlineEscape().cmdline(crop_cmd))
-		self._dependent_jobs.append(Job(subprocess.check_call, (crop_cmd, ), info = "crop-image"))
-
-		element.set("{http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd}absref", cropped_image_filename)
-		element.set("{http://www.w3.org/1999/xlink}href", cropped_image_filename)
-
-	def handle_instruction(self, element_name, image_metadata, instruction):
-		if element_name not in self._desc_nodes:
-			raise IllegalLayoutDefinitionException("Unknown element specified for SVG transformation: %s" % (element_name))
-		if "cmd" not in instruction:
-			raise IllegalLayoutDefinitionException("No 'cmd' key given in SVG transformation: %s" % (element_name))
-		if element_name in self._unused_elements:
-			self._unused_elements.remove(element_name)
-		element = self._desc_nodes[element_name]
+		# ImageMagick holds the decoded source image with 16 bit per channel.
+		crop_memory = image_dimensions[0] * image_dimensions[1] * 4 * 2
+		cropped_image = self.image_cropper.crop(image_filename, target_dimensions, gravity = crop_gravity, auto_gamma = instruction.get("auto_gamma", True), placement_pixels = self._get_element_pixels(element), memory = crop_memory)
+		if cropped_image.job not in self._dependent_jobs:
+			self._dependent_jobs.append(cropped_image.job)
+
+		element.set("{http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd}absref", cropped_image.filename)
+		element.set("{http://www.w3.org/1999/xlink}href", cropped_image.filename)
+
+	# noop only marks the element as used and set_style instructions of an
+	# element are merged by _handle_set_styles(), so neither is dispatched
+	# through this table.
+	_HANDLERS = {
+		"set_text":		_handle_set_text,
+		"place_image":	_handle_place_image,
+	}
+
+	def _check_instruction(self, element, image_metadata, instruction):
+		"""Raises for everything that would make a handler fail halfway through
+		applying a plan."""
 		cmd = instruction["cmd"]
-		handler = getattr(self, "_handle_" + cmd, None)
-		if handler is None:
-			raise IllegalLayoutDefinitionException("Unknown command specified for SVG transformation: %s" % (cmd))
-		handler(element, image_metadata, instruction)
+		if cmd == "set_text":
+			if "text" not in instruction:
+				raise IllegalLayoutDefinitionException("No 'text' key given in instruction %s." % (str(instruction)))
+			self._text_node(element)
+		elif cmd == "place_image":
+			if "img_ref" not in instruction:
+				raise IllegalLayoutDefinitionException("No 'img_ref' key given in instruction %s." % (str(instruction)))
+			if (image_metadata is not None) and (instruction["img_ref"] not in image_metadata):
+				raise IllegalLayoutDefinitionException("Image '%s' referenced by instruction %s, but not defined in the 'images' section." % (instruction["img_ref"], str(instruction)))
+
+	def compile_transform(self, transform, image_metadata = None):
+		"""Validates the transformation of a layer, given as a dictionary that
+		maps element names to lists of instructions, and returns it as a plan
+		for apply_transform(). In the plan, the handler of every instruction is
+		already looked up and the set_style instructions of each element are
+		collected, so they can be applied at once. When image_metadata is
+		given, image references are validated against it as well."""
+		plan = [ ]
+		for (element_name, instructions) in transform.items():
+			if element_name not in self._desc_nodes:
+				raise IllegalLayoutDefinitionException("Unknown element specified for SVG transformation: %s" % (element_name))
+			element = self._desc_nodes[element_name]
+			handlers = [ ]
+			style_instructions = [ ]
+			for instruction in instructions:
+				if "cmd" not in instruction:
+					raise IllegalLayoutDefinitionException("No 'cmd' key given in SVG transformation: %s" % (element_name))
+				cmd = instruction["cmd"]
+				if cmd == "set_style":
+					style_instructions.append(instruction)
+				elif cmd == "noop":
+					continue
+				elif cmd in self._HANDLERS:
+					self._check_instruction(element, image_metadata, instruction)
+					handlers.append((self._HANDLERS[cmd], instruction))
+				else:
+					raise IllegalLayoutDefinitionException("Unknown command specified for SVG transformation: %s" % (cmd))
+			plan.append((element_name, handlers, style_instructions))
+		return plan
+
+	def apply_transform(self, plan, image_metadata):
+		for (element_name, handlers, style_instructions) in plan:
+			self._unused_elements.discard(element_name)
+			element = self._desc_nodes[element_name]
+			for (handler, instruction) in handlers:
+				handler(self, element, image_metadata, instruction)
+			if len(style_instructions) > 0:
+				self._handle_set_styles(element, style_instructions)
+
+	def transform(self, transform, image_metadata):
+		"""Applies all instructions of a layer's transformation. Nothing is
+		modified if any of the instructions is invalid."""
+		self.apply_transform(self.compile_transform(transform, image_metadata), image_metadata)
 
 	def handle_instructions(self, element_name, image_metadata, instructions):
-		for instruction in instructions:
-			self.handle_instruction(element_name, image_metadata, instruction)
+		self.transform({ element_name: instructions }, image_metadata)
+
+	def handle_instruction(self, element_name, image_metadata, instruction):
+		self.handle_instructions(element_name, image_metadata, [ instruction ])
 
 	def write(self, output_filename):
 		self._xml.write(output_filename, xml_declaration = True, encoding = "utf-8")
+
+if __name__ == "__main__":
+	import sys
+	import time
+	from .FriendlyArgumentParser import FriendlyArgumentParser
+
+	parser = FriendlyArgumentParser(description = "Benchmark applying the transformation of a month calendar layer to its template.")
+	parser.add_argument("-n", "--iterations", metavar = "count", type = int, default = 200, help = "Number of times the layer is transformed. Defaults to %(default)d.")
+	parser.add_argument("-t", "--template", metavar = "svg_name", default = "30x20_month_calendar.svg", help = "Month calendar template to use. Defaults to %(default)s.")
+	args = parser.parse_args(sys.argv[1:])
+
+	# Same instructions that CalendarGenerator creates for a 30-day month
+	# with a few highlighted days.
+	transform = {
+		"month_text":			[ { "cmd": "noop" }, { "cmd": "set_text", "text": "September" } ],
+		"year_text":			[ { "cmd": "noop" }, { "cmd": "set_text", "text": "2021" } ],
+		"month_comment_text":	[ { "cmd": "noop" }, { "cmd": "set_text", "text": "1: Alice (30); 17: Bob (40)" } ],
+	}
+	for day_no in range(1, 31 + 1):
+		if day_no <= 30:
+			day_style = { "fill": "#ff0000" } if (day_no % 7 == 0) else { }
+			transform["day_box_%02d" % (day_no)] = [ dict(cmd = "set_style", **day_style) ]
+			transform["dow_%02d_text" % (day_no)] = [ { "cmd": "noop" }, { "cmd": "set_text", "text": "Mo" }, dict(cmd = "set_style", **day_style) ]
+			transform["star_%02d" % (day_no)] = [ { "cmd": "set_style", "hide": True } ]
+			if day_no >= 29:
+				transform["group_%02d" % (day_no)] = [ { "cmd": "noop" } ]
+		else:
+			transform["group_%02d" % (day_no)] = [ { "cmd": "set_style", "hide": True } ]
+			transform["star_%02d" % (day_no)] = [ { "cmd": "noop" } ]
+			transform["day_box_%02d" % (day_no)] = [ { "cmd": "noop" } ]
+			transform["dow_%02d_text" % (day_no)] = [ { "cmd": "noop" } ]
+	instruction_count = sum(len(instructions) for instructions in transform.values())
+
+	template = SVGTemplate.load(args.template)
+	def benchmark(apply):
+		SVGProcessor._restyle.cache_clear()
+		processors = [ SVGProcessor(template) for _ in range(args.iterations) ]
+		t0 = time.time()
+		apply(processors[0])
+		t1 = time.time()
+		for processor in processors[1 : ]:
+			apply(processor)
+		t2 = time.time()
+		return (t1 - t0, (t2 - t1) / max(1, args.iterations - 1))
+
+	def apply_per_instruction(processor):
+		for (element_name, instructions) in transform.items():
+			for instruction in instructions:
+				processor.handle_instruction(element_name, { }, instruction)
+
+	print("%d instructions on %d elements of %s" % (instruction_count, len(transform), args.template))
+	for (name, apply) in [ ("per instruction", apply_per_instruction), ("planned", lambda processor: processor.transform(transform, { })) ]:
+		(first, mean) = benchmark(apply)
+		print("%-16s first layer %.3f ms, then %.3f ms per layer" % (name, first * 1000, mean * 1000))
@@ -0,0 +1,196 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import re
+import copy
+import hashlib
+import pkgutil
+import threading
+import lxml.etree
+import geo
+from .Exceptions import InvalidSVGException
+
+class SVGTemplate():
+	"""A parsed template SVG. The parsed tree is never modified; users which
+	transform the template (i.e., SVGProcessors) get their own deep copy of it,
+	which is much cheaper than parsing the template again. The elements that
+	carry a description are indexed by their position in the tree, so they
+	can be found in a copy without searching for them, and their dimensions
+	are computed only once.
+
+	Templates that ship with calendargen are loaded through load(), which
+	keeps one instance per template for the lifetime of the process."""
+	_NS = {
+		"svg": "http://www.w3.org/2000/svg",
+	}
+	_LENGTH_RE = re.compile(r"\s*(?P<value>[0-9.]+)\s*(?P<unit>[a-z]*)\s*")
+	_UNITS_PER_INCH = {
+		"":		96,
+		"px":	96,
+		"pt":	72,
+		"pc":	6,
+		"in":	1,
+		"cm":	2.54,
+		"mm":	25.4,
+	}
+
+	_templates = { }
+	_templates_lock = threading.Lock()
+
+	def __init__(self, svg_data, name = None):
+		self._data = svg_data
+		self._name = name
+		self._xml = lxml.etree.ElementTree(lxml.etree.fromstring(svg_data))
+		self._digest = hashlib.sha256(svg_data).hexdigest()
+		# lxml trees must not be used from several threads at once, not even
+		# for reading.
+		self._lock = threading.Lock()
+		self._desc_nodes = self._find_desc_nodes()
+		self._desc_paths = { description: self._element_path(element) for (description, element) in self._desc_nodes.items() }
+		self._element_dimensions = { }
+
+	@classmethod
+	def load(cls, svg_name):
+		"""Returns the parsed template of the given name from
+		calendargen/data/templates, parsing it on first use only."""
+		with cls._templates_lock:
+			if svg_name not in cls._templates:
+				svg_data = pkgutil.get_data("calendargen.data", "templates/" + svg_name)
+				cls._templates[svg_name] = cls(svg_data, name = svg_name)
+			return cls._templates[svg_name]
+
+	@property
+	def name(self):
+		return self._name
+
+	@property
+	def data(self):
+		return self._data
+
+	@property
+	def digest(self):
+		"""SHA-256 of the template data, as hex string."""
+		return self._digest
+
+	@property
+	def element_names(self):
+		return self._desc_nodes.keys()
+
+	def _find_desc_nodes(self):
+		desc_nodes = { }
+		for desc_node in self._xml.xpath("//svg:desc", namespaces = self._NS):
+			target_node = desc_node.getparent()
+			description = desc_node.text
+			if description in desc_nodes:
+				raise InvalidSVGException("SVG data contains duplicate description element '%s'." % (description))
+			desc_nodes[description] = target_node
+		return desc_nodes
+
+	@staticmethod
+	def _element_path(element):
+		path = [ ]
+		parent = element.getparent()
+		while parent is not None:
+			path.append(parent.index(element))
+			(element, parent) = (parent, parent.getparent())
+		path.reverse()
+		return path
+
+	def copy(self):
+		"""Returns a deep copy of the template tree and the dictionary of
+		described elements within that copy."""
+		with self._lock:
+			xml = copy.deepcopy(self._xml)
+		root = xml.getroot()
+		desc_nodes = { }
+		for (description, path) in self._desc_paths.items():
+			element = root
+			for index in path:
+				element = element[index]
+			desc_nodes[description] = element
+		return (xml, desc_nodes)
+
+	@staticmethod
+	def get_transformation_matrix(element):
+		matrix = geo.TransformationMatrix.identity()
+		current = element
+		while current is not None:
+			transform_str = current.get("transform")
+			if transform_str is not None:
+				transform = geo.SVGTools.parse_transform(transform_str)
+				matrix *= transform
+			current = current.getparent()
+		return matrix
+
+	@classmethod
+	def get_element_dimensions(cls, element):
+		orig_box = geo.Box2d(base = geo.Vector2d(float(element.get("x")), float(element.get("y"))), dimensions = geo.Vector2d(float(element.get("width")), float(element.get("height"))))
+		matrix = cls.get_transformation_matrix(element)
+		modified_box = orig_box.transform(matrix)
+		dimensions = modified_box.dimensions
+		return dimensions
+
+	def element_dimensions(self, element_name):
+		"""Dimensions of the described element in user units, with all
+		transformations of it and its ancestors applied."""
+		with self._lock:
+			if element_name not in self._element_dimensions:
+				self._element_dimensions[element_name] = self.get_element_dimensions(self._desc_nodes[element_name])
+			return self._element_dimensions[element_name]
+
+	def element_type(self, element_name):
+		"""Local tag name of the described element, e.g., "rect" or "text"."""
+		return lxml.etree.QName(self._desc_nodes[element_name]).localname
+
+	def element_box(self, element_name):
+		"""Absolute (x, y, width, height) of the described element in user
+		units, or None if the element has no box of its own (e.g., a group)."""
+		element = self._desc_nodes[element_name]
+		if any(element.get(attribute) is None for attribute in [ "x", "y", "width", "height" ]):
+			return None
+		with self._lock:
+			orig_box = geo.Box2d(base = geo.Vector2d(float(element.get("x")), float(element.get("y"))), dimensions = geo.Vector2d(float(element.get("width")), float(element.get("height"))))
+			box = orig_box.transform(self.get_transformation_matrix(element))
+		return (box.base.x, box.base.y, box.dimensions.x, box.dimensions.y)
+
+	def _parse_length_inches(self, length_str):
+		result = self._LENGTH_RE.fullmatch(length_str or "")
+		if (result is None) or (result["unit"] not in self._UNITS_PER_INCH):
+			raise InvalidSVGException("Unable to parse SVG length: %s" % (length_str))
+		return float(result["value"]) / self._UNITS_PER_INCH[result["unit"]]
+
+	def get_page_inches(self):
+		root = self._xml.getroot()
+		return (self._parse_length_inches(root.get("width")), self._parse_length_inches(root.get("height")))
+
+	def get_page_pixels(self, resolution_dpi):
+		"""Returns the size of the rendered page in pixels."""
+		(width, height) = self.get_page_inches()
+		return (round(width * resolution_dpi), round(height * resolution_dpi))
+
+	def user_units_per_inch(self):
+		root = self._xml.getroot()
+		view_box = root.get("viewBox")
+		if view_box is None:
+			# Without a viewBox, user units are CSS pixels.
+			return self._UNITS_PER_INCH["px"]
+		view_box_width = float(view_box.replace(",", " ").split()[2])
+		return view_box_width / self._parse_length_inches(root.get("width"))
@@ -0,0 +1,174 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import json
+import uuid
+import hashlib
+import pkgutil
+import threading
+import contextlib
+import logging
+from .Exceptions import InvalidSVGException
+from .SVGTemplate import SVGTemplate
+
+_log = logging.getLogger(__spec__.name)
+
+class SVGTemplateManifest():
+	"""Geometry of a template SVG that is needed for layout generation: the
+	page size and, for every element that carries a description, its type,
+	absolute box and aspect ratio. The manifest is valid for exactly one
+	version of the template, identified by the hash of the SVG data.
+
+	Manifests are looked up next to the template (as "<template>.json" in
+	calendargen/data/templates) and then in the user's cache directory. Only
+	if neither matches the template is the SVG parsed, and the resulting
+	manifest is stored in the cache. The repository ships no manifests, they
+	only exist next to the templates if running this module generated them,
+	e.g., when packaging."""
+
+	# Increase whenever the manifest content changes.
+	_VERSION = 1
+	_CACHE_DIR = "~/.cache/calendargen/templates"
+
+	_manifests = { }
+	_manifests_lock = threading.Lock()
+
+	def __init__(self, manifest_data):
+		self._data = manifest_data
+
+	@classmethod
+	def load(cls, svg_name, cache_dir = _CACHE_DIR):
+		"""Returns the manifest of the template of the given name, creating it
+		on first use only."""
+		with cls._manifests_lock:
+			if svg_name not in cls._manifests:
+				cls._manifests[svg_name] = cls._load(svg_name, os.path.expanduser(cache_dir))
+			return cls._manifests[svg_name]
+
+	@classmethod
+	def _load(cls, svg_name, cache_dir):
+		digest = hashlib.sha256(pkgutil.get_data("calendargen.data", "templates/" + svg_name)).hexdigest()
+		with contextlib.suppress(FileNotFoundError, json.decoder.JSONDecodeError):
+			manifest_data = json.loads(pkgutil.get_data("calendargen.data", "templates/%s.json" % (svg_name)))
+			if cls._matches(manifest_data, digest):
+				return cls(manifest_data)
+
+		cache_filename = "%s/%s.json" % (cache_dir, svg_name)
+		with contextlib.suppress(FileNotFoundError, json.decoder.JSONDecodeError), open(cache_filename) as f:
+			manifest_data = json.load(f)
+			if cls._matches(manifest_data, digest):
+				return cls(manifest_data)
+
+		_log.debug("Creating geometry manifest of template %s", svg_name)
+		manifest_data = cls.create(svg_name)
+		cls._write(cache_filename, manifest_data)
+		return cls(manifest_data)
+
+	@classmethod
+	def _matches(cls, manifest_data, digest):
+		return (manifest_data.get("version") == cls._VERSION) and (manifest_data.get("digest") == digest)
+
+	@staticmethod
+	def _write(filename, manifest_data):
+		with contextlib.suppress(FileExistsError):
+			os.makedirs(os.path.dirname(filename))
+		# Concurrent processes may write the same manifest, so replace it
+		# atomically.
+		temp_filename = "%s.%s.tmp" % (filename, uuid.uuid4())
+		try:
+			with open(temp_filename, "w") as f:
+				json.dump(manifest_data, f, indent = 4, sort_keys = True)
+				f.write("\n")
+			os.replace(temp_filename, filename)
+		finally:
+			with contextlib.suppress(FileNotFoundError):
+				os.unlink(temp_filename)
+
+	@classmethod
+	def create(cls, svg_name):
+		"""Parses the template and returns its manifest data."""
+		template = SVGTemplate.load(svg_name)
+		elements = { }
+		for element_name in template.element_names:
+			element = {
+				"type":		template.element_type(element_name),
+			}
+			box = template.element_box(element_name)
+			if box is not None:
+				element["box"] = list(box)
+				element["aspect_ratio"] = box[2] / box[3]
+			elements[element_name] = element
+		return {
+			"version":		cls._VERSION,
+			"template":		svg_name,
+			"digest":		template.digest,
+			"page_inches":	list(template.get_page_inches()),
+			"elements":		elements,
+		}
+
+	@property
+	def digest(self):
+		return self._data["digest"]
+
+	@property
+	def element_names(self):
+		return self._data["elements"].keys()
+
+	def _element(self, element_name):
+		if element_name not in self._data["elements"]:
+			raise InvalidSVGException("Template %s has no element '%s'." % (self._data["template"], element_name))
+		return self._data["elements"][element_name]
+
+	def element_type(self, element_name):
+		return self._element(element_name)["type"]
+
+	def element_box(self, element_name):
+		"""Absolute (x, y, width, height) of the element in user units, None if
+		the element has no box of its own."""
+		box = self._element(element_name).get("box")
+		return None if (box is None) else tuple(box)
+
+	def element_dimensions(self, element_name):
+		box = self.element_box(element_name)
+		if box is None:
+			raise InvalidSVGException("Element '%s' of template %s has no dimensions." % (element_name, self._data["template"]))
+		return (box[2], box[3])
+
+	def element_aspect_ratio(self, element_name):
+		(width, height) = self.element_dimensions(element_name)
+		return width / height
+
+	def get_page_pixels(self, resolution_dpi):
+		"""Returns the size of the rendered page in pixels."""
+		(width, height) = self._data["page_inches"]
+		return (round(width * resolution_dpi), round(height * resolution_dpi))
+
+if __name__ == "__main__":
+	# Writes the manifests of all templates next to them, so that installations
+	# never need to create them.
+	import sys
+	template_dir = os.path.dirname(__file__) + "/data/templates"
+	svg_names = sys.argv[1:] or sorted(filename for filename in os.listdir(template_dir) if filename.endswith(".svg"))
+	for svg_name in svg_names:
+		manifest_data = SVGTemplateManifest.create(svg_name)
+		SVGTemplateManifest._write("%s/%s.json" % (template_dir, svg_name), manifest_data)
+		print("%s: %d elements" % (svg_name, len(manifest_data["elements"])))
@@ -0,0 +1,58 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import collections
+
+SharedLayer = collections.namedtuple("SharedLayer", [ "job", "filename" ])
+
+class SharedLayerRegistry():
+	"""Keeps track of all layers rendered during one run, keyed by the layer's
+	cache key. Identical layers (e.g., the same month page in two variants)
+	are only rendered once and the rendered file is shared by all pages that
+	use it. All jobs must be registered before any of them is handed to the
+	JobServer, otherwise a page could depend on a render job which has
+	already finished."""
+	def __init__(self):
+		self._layers = { }
+		self._requested_count = 0
+
+	@property
+	def requested_count(self):
+		return self._requested_count
+
+	@property
+	def unique_count(self):
+		return len(self._layers)
+
+	@property
+	def dedup_ratio(self):
+		if self._requested_count == 0:
+			return 0
+		return 1 - (self.unique_count / self._requested_count)
+
+	def get(self, key, create_callback):
+		"""Returns the SharedLayer for the given key. If it does not exist yet,
+		create_callback() is called and must return a (job, filename) tuple."""
+		self._requested_count += 1
+		if key not in self._layers:
+			(job, filename) = create_callback()
+			self._layers[key] = SharedLayer(job = job, filename = filename)
+		return self._layers[key]
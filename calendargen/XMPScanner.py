@@ -19,35 +19,83 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
-import os
+import io
 import collections
 import lxml.etree
 
 class XMPScanner():
+	"""Reads the tags of geeqie XMP sidecar files. Only the subject bag of the
+	first rdf:Description is of interest, so files are parsed incrementally
+	and parsing stops as soon as that bag has been read. XMP packets embedded
+	in images are handled alike, except that the subject bag may be in any
+	rdf:Description."""
 	_XMP_NS = {
 		"x":	"adobe:ns:meta/",
 		"rdf":	"http://www.w3.org/1999/02/22-rdf-syntax-ns#",
 		"dc":	"http://purl.org/dc/elements/1.1/",
 		"xmp":	"http://ns.adobe.com/xap/1.0/",
 	}
+	_SUBJECT_TAG = "{%s}subject" % (_XMP_NS["dc"])
+	_DESCRIPTION_TAG = "{%s}Description" % (_XMP_NS["rdf"])
+	_BAG_ITEMS_XPATH = lxml.etree.XPath("./rdf:Bag/rdf:li", namespaces = _XMP_NS)
 
 	def __init__(self, xmp_filename):
 		self._xmp_filename = xmp_filename
 
-	def scan(self):
-		if not os.path.isfile(self._xmp_filename):
+	@staticmethod
+	def parse_tags(tag_strings):
+		tags = collections.defaultdict(set)
+		for tag in tag_strings:
+			if (tag is not None) and ("=" in tag):
+				(key, values) = tag.split("=", maxsplit = 1)
+				values = values.split("+")
+				tags[key] |= set(values)
+		return { key: list(values) for (key, values) in tags.items() }
+
+	@classmethod
+	def _is_first_description(cls, element):
+		if (element is None) or (element.tag != cls._DESCRIPTION_TAG):
+			return False
+		return next(element.itersiblings(cls._DESCRIPTION_TAG, preceding = True), None) is None
+
+	@classmethod
+	def _scan_source(cls, source, first_description_only = True):
+		for (event, subject) in lxml.etree.iterparse(source, events = ("end", ), tag = cls._SUBJECT_TAG):
+			description = subject.getparent()
+			if cls._is_first_description(description) or ((not first_description_only) and (description.tag == cls._DESCRIPTION_TAG)):
+				return cls.parse_tags(item.text for item in cls._BAG_ITEMS_XPATH(subject))
+		return { }
+
+	@classmethod
+	def _scan_file(cls, xmp_filename):
+		# Parsing stops early, so the file is opened here to make sure it is
+		# closed again.
+		try:
+			with open(xmp_filename, "rb") as f:
+				return cls._scan_source(f)
+		except FileNotFoundError:
 			return { }
 
-		meta_xml = lxml.etree.parse(self._xmp_filename).getroot()
-		tags = collections.defaultdict(set)
-		if meta_xml is not None:
-			desc = meta_xml.xpath("/x:xmpmeta/rdf:RDF/rdf:Description[1]", namespaces = self._XMP_NS)[0]
-			bag = desc.xpath("./dc:subject/rdf:Bag/rdf:li", namespaces = self._XMP_NS)
-			for tag_node in bag:
-				tag = tag_node.text
-				if "=" in tag:
-					(key, values) = tag.split("=", maxsplit = 1)
-					values = values.split("+")
-					tags[key] |= set(values)
-		tags = { key: list(values) for (key, values) in tags.items() }
-		return tags
+	@classmethod
+	def scan_data(cls, xmp_data):
+		"""Returns the tags of an XMP packet embedded in an image."""
+		try:
+			return cls._scan_source(io.BytesIO(xmp_data.strip(b"\x00 \t\r\n")), first_description_only = False)
+		except lxml.etree.XMLSyntaxError:
+			return { }
+
+	@classmethod
+	def scan_many(cls, xmp_filenames):
+		"""Returns two dictionaries: the tags of all given sidecar files and the
+		exceptions of those files that could not be read. Files that do not
+		exist have no tags, a broken file does not affect the others."""
+		(all_tags, errors) = ({ }, { })
+		for xmp_filename in xmp_filenames:
+			try:
+				all_tags[xmp_filename] = cls._scan_file(xmp_filename)
+			except (lxml.etree.LxmlError, OSError) as e:
+				errors[xmp_filename] = e
+		return (all_tags, errors)
+
+	def scan(self):
+		return self._scan_file(self._xmp_filename)
@@ -20,9 +20,13 @@
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
 import sys
+import multiprocessing
 from .MultiCommand import MultiCommand
+from .FriendlyArgumentParser import baseint_unit
 from .ActionRender import ActionRender
 from .ActionCreateLayout import ActionCreateLayout
+from .ActionWatchPool import ActionWatchPool
+from .InkscapeRenderer import InkscapeRenderer
 #from .ScanPoolCommand import ScanPoolCommand
 #from .SelectPoolCommand import SelectPoolCommand
 
@@ -43,13 +47,28 @@ def main():
 		parser.add_argument("-f", "--force", action = "store_true", help = "Force overwriting of already rendered templates if they exist.")
 		parser.add_argument("-o", "--output-dir", metavar = "dirname", default = "generated_calendars", help = "Output directory in which genereated calendars reside. Defaults to %(default)s.")
 		parser.add_argument("-c", "--no-create-symlinks", action = "store_true", help = "Do not create symlinks to the images selected from the pool.")
+		parser.add_argument("--placement", choices = [ "greedy", "solver" ], default = "greedy", help = "Method used to assign pool images to image slots. \"greedy\" picks a random fitting image for one slot after the other and may fail when the pool is tight. \"solver\" tries to find an assignment that fills all slots and places all forced images, preferring images that need little cropping; if its search gives up without finding one, it falls back to greedy placement. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("--joint-placement", action = "store_true", help = "Assign images for all created variants together so that they get mostly different images, instead of assigning each variant on its own.")
+		parser.add_argument("--overlap-penalty", metavar = "factor", type = float, default = 1.0, help = "With --joint-placement, how strongly images that are already used in another variant are avoided. With the default of %(default).1f, an unused image that fits is always preferred; lower values let better fitting images win over unused ones.")
+		parser.add_argument("--seed", metavar = "number", type = int, help = "Seed for the random image assignment. The same seed yields the same image assignment again. By default, a random seed is chosen and logged with -v.")
+		parser.add_argument("-j", "--max-jobs", metavar = "count", type = int, default = multiprocessing.cpu_count(), help = "Number of variants that are generated concurrently, in separate processes. Defaults to %(default)d.")
+		parser.add_argument("--full-rescan", action = "store_true", help = "Check every image of the pool for changes. By default, directories which have not changed since the last scan are skipped, which misses images that were modified in place.")
 		parser.add_argument("-V", "--only-variant", metavar = "variant_name", action = "append", default = [ ], help = "Only create these variants. Can be specified multiple times. By default, all variants are created that are defined in the template.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increases verbosity. Can be specified multiple times to increase.")
 		parser.add_argument("input_calendar_file", help = "JSON calendar definition input file.")
 	mc.register("create-layout", "Create layout files from a calendar definition template.", genparser, action = ActionCreateLayout)
 
+	def genparser(parser):
+		parser.add_argument("-t", "--tag-source", choices = [ "sidecar", "xmp", "iptc" ], action = "append", default = [ ], help = "Read image tags from this source. Can be specified multiple times, the first source that has tags for an image is used. Can be one of %(choices)s, defaults to sidecar.")
+		parser.add_argument("--debounce", metavar = "secs", type = float, default = 2, help = "Wait until no further changes happened for this many seconds before rescanning. Defaults to %(default).1f seconds.")
+		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increases verbosity. Can be specified multiple times to increase.")
+		parser.add_argument("image_directory", nargs = "+", help = "Image pool directory which should be watched.")
+	mc.register("watch-pool", "Keep the image pool cache up to date by watching the pool directories for changes.", genparser, action = ActionWatchPool)
+
 	def genparser(parser):
 		parser.add_argument("--job-graph", metavar = "filename", help = "Write a GraphViz document that plots the graph dependencies. Useful for debugging.")
+		parser.add_argument("--job-trace", metavar = "filename", help = "Write the timing of all jobs in Chrome trace event format (viewable in chrome://tracing or Perfetto) to the given file after rendering.")
+		parser.add_argument("--job-summary", action = "store_true", help = "After rendering, print a table of how much time was spent in each kind of job.")
 		parser.add_argument("-f", "--force", action = "store_true", help = "Force overwriting of already rendered files if they exist.")
 		parser.add_argument("--wait-keypress", action = "store_true", help = "Wait for keypress before finishing to be able to debug the temporary files which were generated.")
 		parser.add_argument("--no-flatten-output", action = "store_true", help = "Do not flatten the output image.")
@@ -58,6 +77,14 @@ def main():
 		parser.add_argument("-r", "--output-format", choices = [ "jpg", "png", "svg" ], default = "jpg", help = "Determines what the rendered output is. Can be one of %(choices)s, defaults to %(default)s.")
 		parser.add_argument("-o", "--output-dir", metavar = "dirname", default = "generated_calendars", help = "Output directory in which genereated calendars reside. Defaults to %(default)s.")
 		parser.add_argument("-d", "--resolution-dpi", metavar = "dpi", type = int, default = 72, help = "Resolution to render target at, in dpi. Defaults to %(default)d dpi.")
+		parser.add_argument("--cache-dir", metavar = "dirname", default = "~/.cache/calendargen/render", help = "Directory in which rendered layers are cached so that unchanged layers do not need to be rendered again. Defaults to %(default)s.")
+		parser.add_argument("--image-oversampling", metavar = "factor", type = float, default = 1.0, help = "Placed images are downscaled to their size in the rendered page, at the rendering resolution, times this factor. Increase it if downscaled images look too soft. Defaults to %(default).1f.")
+		parser.add_argument("--crop-cache-dir", metavar = "dirname", default = "~/.cache/calendargen/crop", help = "Directory in which cropped images are cached so that the same image placed in the same geometry only needs to be cropped once. Defaults to %(default)s.")
+		parser.add_argument("--cache-max-size", metavar = "bytes", type = baseint_unit, default = "4Gi", help = "Maximum size of the render cache and of the crop cache each; least recently used entries are evicted once it is exceeded. Defaults to %(default)s.")
+		parser.add_argument("--no-cache", action = "store_true", help = "Do not use the render and crop caches, render all layers from scratch.")
+		parser.add_argument("--inkscape-backend", choices = InkscapeRenderer.BACKENDS, default = "shell", help = "Determines how inkscape is invoked to render layers. 'shell' keeps one long-lived inkscape process per concurrent job, 'oneshot' starts a new inkscape process for every layer. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("-j", "--max-jobs", metavar = "count", type = int, default = multiprocessing.cpu_count(), help = "Maximum number of jobs which run concurrently. Defaults to %(default)d.")
+		parser.add_argument("--max-memory", metavar = "bytes", type = baseint_unit, help = "Memory budget for concurrently running jobs. Memory-heavy jobs (e.g., high resolution renders) are delayed until their estimated memory usage fits into the budget. By default, memory is not limited.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increases verbosity. Can be specified multiple times to increase.")
 		parser.add_argument("input_layout_file", nargs = "+", help = "JSON definition input file(s) which should be rendered")
 	mc.register("render", "Render the pages of a layout file into multiple images, one per page.", genparser, action = ActionRender)
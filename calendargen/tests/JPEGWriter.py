@@ -0,0 +1,71 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import struct
+
+class JPEGWriter():
+	"""Writes the headers of a JPEG file for tests: optionally EXIF data with a
+	timestamp, an XMP packet and IPTC keywords, followed by the start of frame
+	marker. There is no image data, JPEGMetadata does not read it anyway."""
+
+	def __init__(self, width, height, snaptime = None, xmp = None, iptc_keywords = None):
+		self._width = width
+		self._height = height
+		self._snaptime = snaptime
+		self._xmp = xmp
+		self._iptc_keywords = iptc_keywords
+
+	@staticmethod
+	def segment(marker, payload):
+		return bytes([ 0xff, marker ]) + struct.pack(">H", len(payload) + 2) + payload
+
+	def _exif(self):
+		# Little endian TIFF with IFD0 only pointing to the EXIF IFD, which
+		# holds DateTimeOriginal.
+		snaptime = self._snaptime.encode("ascii") + b"\x00"
+		tiff = b"II" + struct.pack("<HL", 42, 8)
+		tiff += struct.pack("<H", 1) + struct.pack("<HHLL", 0x8769, 4, 1, 26) + struct.pack("<L", 0)
+		tiff += struct.pack("<H", 1) + struct.pack("<HHLL", 0x9003, 2, len(snaptime), 44) + struct.pack("<L", 0)
+		tiff += snaptime
+		return b"Exif\x00\x00" + tiff
+
+	def _photoshop(self):
+		iptc = b"".join(b"\x1c\x02\x19" + struct.pack(">H", len(keyword.encode("utf-8"))) + keyword.encode("utf-8") for keyword in self._iptc_keywords)
+		resource = b"8BIM" + struct.pack(">H", 0x0404) + b"\x00\x00" + struct.pack(">L", len(iptc)) + iptc
+		if len(iptc) % 2 == 1:
+			resource += b"\x00"
+		return b"Photoshop 3.0\x00" + resource
+
+	def data(self):
+		data = b"\xff\xd8"
+		if self._snaptime is not None:
+			data += self.segment(0xe1, self._exif())
+		if self._xmp is not None:
+			data += self.segment(0xe1, b"http://ns.adobe.com/xap/1.0/\x00" + self._xmp)
+		if self._iptc_keywords is not None:
+			data += self.segment(0xed, self._photoshop())
+		data += self.segment(0xc0, struct.pack(">BHHB", 8, self._height, self._width, 1) + b"\x01\x11\x00")
+		data += b"\xff\xd9"
+		return data
+
+	def write(self, filename):
+		with open(filename, "wb") as f:
+			f.write(self.data())
@@ -0,0 +1,86 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import sys
+import json
+import tempfile
+import subprocess
+import unittest
+from calendargen.tests.JPEGWriter import JPEGWriter
+
+class EntryPointTests(unittest.TestCase):
+	_CALGEN = os.path.realpath(os.path.dirname(__file__) + "/../../calgen")
+
+	@classmethod
+	def setUpClass(cls):
+		try:
+			import calendargen.__main__
+		except ImportError as e:
+			raise unittest.SkipTest("calendargen cannot be run: %s" % (str(e)))
+
+	def _create_layout(self, temp_dir, definition, *args):
+		with open(temp_dir + "/calendar.json", "w") as f:
+			json.dump(definition, f)
+		env = dict(os.environ)
+		env["HOME"] = temp_dir
+		subprocess.run([ sys.executable, self._CALGEN, "create-layout", "-c", "-o", temp_dir + "/output" ] + list(args) + [ temp_dir + "/calendar.json" ], cwd = temp_dir, env = env, check = True, timeout = 120)
+		layouts = { }
+		for filename in os.listdir(temp_dir + "/output"):
+			if filename.endswith(".json"):
+				with open(temp_dir + "/output/" + filename) as f:
+					layouts[filename[:-5]] = json.load(f)
+		return layouts
+
+	def test_pool_scan_in_process_pool(self):
+		# Scanning the pool runs as CPU-bound jobs in a forkserver process
+		# pool, whose workers import the launcher script again.
+		with tempfile.TemporaryDirectory(prefix = "calendargen_test_") as temp_dir:
+			os.makedirs(temp_dir + "/pool")
+			for image_no in range(3):
+				JPEGWriter(400, 300, snaptime = "2021:05:%02d 12:00:00" % (image_no + 1)).write("%s/pool/image%d.jpg" % (temp_dir, image_no))
+			definition = {
+				"type":			"calendar",
+				"meta":			{ "locale": "de", "year": 2021 },
+				"pages":		[ ],
+				"image_pool":	{ "directories": [ temp_dir + "/pool" ] },
+				"variants":		[ { "name": "test" } ],
+			}
+			layouts = self._create_layout(temp_dir, definition, "-j", "1")
+			self.assertEqual(layouts["test"]["pages"], [ ])
+
+	def test_without_image_pool(self):
+		# Neither pool candidates nor a joint assignment can be created without
+		# a pool, but a calendar without images must still be laid out.
+		with tempfile.TemporaryDirectory(prefix = "calendargen_test_") as temp_dir:
+			definition = {
+				"type":			"calendar",
+				"meta":			{ "locale": "de", "year": 2021 },
+				"pages":		[ { "type": "only_month_calendar", "month": 1 } ],
+				"variants":		[ { "name": "a" }, { "name": "b" } ],
+			}
+			layouts = self._create_layout(temp_dir, definition, "--joint-placement")
+			self.assertEqual(sorted(layouts), [ "a", "b" ])
+			self.assertEqual(len(layouts["a"]["pages"]), 1)
+			self.assertEqual(layouts["a"]["images"], { })
+
+if __name__ == "__main__":
+	unittest.main()
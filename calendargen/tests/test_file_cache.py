@@ -0,0 +1,90 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import tempfile
+import unittest
+from calendargen.FileCache import FileCache
+
+class FileCacheTests(unittest.TestCase):
+	def setUp(self):
+		self._temp_dir = tempfile.TemporaryDirectory()
+		self._source_filename = self._temp_dir.name + "/source.bin"
+		with open(self._source_filename, "wb") as f:
+			f.write(bytes(100))
+
+	def tearDown(self):
+		self._temp_dir.cleanup()
+
+	def _cache(self, max_size_bytes = None):
+		return FileCache(self._temp_dir.name + "/cache", suffix = ".bin", max_size_bytes = max_size_bytes)
+
+	def _store_aged(self, cache, names):
+		"""Stores one entry per name, the first one being the oldest."""
+		keys = { }
+		for (age, name) in enumerate(names):
+			keys[name] = FileCache.key("test", name)
+			filename = cache.store(keys[name], self._source_filename)
+			os.utime(filename, (1000 + age, 1000 + age))
+		return keys
+
+	def test_store_retrieve(self):
+		cache = self._cache()
+		key = FileCache.key("test", FileCache.file_identity(self._source_filename))
+		self.assertIsNone(cache.lookup(key))
+		cache.store(key, self._source_filename)
+		self.assertIsNotNone(cache.lookup(key))
+		destination = self._temp_dir.name + "/destination.bin"
+		cache.retrieve(key, destination)
+		with open(destination, "rb") as f:
+			self.assertEqual(f.read(), bytes(100))
+		self.assertEqual(cache.stats, { "hit": 1, "miss": 1 })
+
+	def test_lru_eviction(self):
+		cache = self._cache(max_size_bytes = 250)
+		keys = self._store_aged(cache, [ "a", "b", "c" ])
+
+		# Using "a" makes "b" the least recently used entry.
+		self.assertIsNotNone(cache.lookup(keys["a"]))
+		cache.cleanup()
+		self.assertTrue(os.path.isfile(cache.filename_for(keys["a"])))
+		self.assertFalse(os.path.exists(cache.filename_for(keys["b"])))
+		self.assertTrue(os.path.isfile(cache.filename_for(keys["c"])))
+
+	def test_eviction_down_to_limit(self):
+		cache = self._cache(max_size_bytes = 150)
+		keys = self._store_aged(cache, [ "a", "b", "c", "d" ])
+		cache.cleanup()
+		self.assertEqual([ name for (name, key) in keys.items() if os.path.exists(cache.filename_for(key)) ], [ "d" ])
+
+	def test_no_eviction_below_limit(self):
+		cache = self._cache(max_size_bytes = 300)
+		keys = self._store_aged(cache, [ "a", "b", "c" ])
+		cache.cleanup()
+		self.assertTrue(all(os.path.isfile(cache.filename_for(key)) for key in keys.values()))
+
+		unlimited = self._cache()
+		self._store_aged(unlimited, [ "d" ])
+		unlimited.cleanup()
+		self.assertTrue(all(os.path.isfile(cache.filename_for(key)) for key in keys.values()))
+
+if __name__ == "__main__":
+	unittest.main()
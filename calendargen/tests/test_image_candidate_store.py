@@ -0,0 +1,101 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import random
+import datetime
+import unittest
+import collections
+from calendargen.ImageCandidateStore import ImageCandidateStore
+
+Candidate = collections.namedtuple("Candidate", [ "filename", "snaptime", "width", "height", "tag_sets" ])
+
+class ImageCandidateStoreTests(unittest.TestCase):
+	_T0 = datetime.datetime(2021, 1, 1, 12, 0, 0)
+
+	def _candidate(self, filename, width = 400, height = 300, offset_secs = None, groups = None):
+		snaptime = None if (offset_secs is None) else self._T0 + datetime.timedelta(0, offset_secs)
+		tag_sets = { } if (groups is None) else { "grp": set(groups) }
+		return Candidate(filename = filename, snaptime = snaptime, width = width, height = height, tag_sets = tag_sets)
+
+	def test_compatible_matches_brute_force(self):
+		rng = random.Random(1)
+		candidates = [ self._candidate("img%04d.jpg" % (i), width = rng.randint(100, 1000), height = rng.randint(100, 1000)) for i in range(1000) ]
+		# Exactly at the edge of the usable ratio for crops of 4:3 and 2:1
+		candidates += [ self._candidate("edge1.jpg", width = 400, height = 400), self._candidate("edge2.jpg", width = 600, height = 400) ]
+		store = ImageCandidateStore(candidates)
+		for crop_aspect_ratio in [ 4 / 3, 2, 3 / 4, 1, 16 / 9, 0.5 ] + [ rng.uniform(0.2, 5) for _ in range(20) ]:
+			expected = set(candidate.filename for candidate in candidates if store.compatible(candidate, crop_aspect_ratio))
+			self.assertEqual(set(candidate.filename for candidate in store.find_compatible(crop_aspect_ratio)), expected)
+			self.assertEqual(store.count_compatible(crop_aspect_ratio), len(expected))
+			choice = store.choose_compatible(crop_aspect_ratio, rng = rng)
+			if len(expected) == 0:
+				self.assertIsNone(choice)
+			else:
+				self.assertIn(choice.filename, expected)
+		self.assertIn("edge1.jpg", set(candidate.filename for candidate in store.find_compatible(4 / 3)))
+		self.assertIn("edge2.jpg", set(candidate.filename for candidate in store.find_compatible(2)))
+
+	def test_time_window(self):
+		candidates = [ self._candidate("a.jpg", offset_secs = 0), self._candidate("b.jpg", offset_secs = 1800), self._candidate("c.jpg", offset_secs = 3600), self._candidate("d.jpg", offset_secs = 3601), self._candidate("e.jpg", offset_secs = -3600), self._candidate("f.jpg", offset_secs = -3601), self._candidate("g.jpg") ]
+		store = ImageCandidateStore(candidates, exclusion_window_secs = 3600)
+		removed = store.remove_with_dependencies(candidates[0])
+		self.assertEqual(sorted(candidate.filename for candidate in removed), [ "a.jpg", "b.jpg", "c.jpg", "e.jpg" ])
+		self.assertEqual(sorted(candidate.filename for candidate in store), [ "d.jpg", "f.jpg", "g.jpg" ])
+		self.assertTrue(store.conflicting(candidates[0], candidates[2]))
+		self.assertFalse(store.conflicting(candidates[0], candidates[3]))
+		self.assertFalse(store.conflicting(candidates[0], candidates[6]))
+
+		store.restore(removed)
+		self.assertEqual(len(store), len(candidates))
+
+	def test_group_remove_and_restore(self):
+		candidates = [ self._candidate("a.jpg", groups = [ "x" ]), self._candidate("b.jpg", groups = [ "x", "y" ]), self._candidate("c.jpg", groups = [ "y" ]), self._candidate("d.jpg") ]
+		store = ImageCandidateStore(candidates)
+		removed = store.remove_with_dependencies(candidates[0])
+		self.assertEqual(sorted(candidate.filename for candidate in removed), [ "a.jpg", "b.jpg" ])
+		self.assertIn(candidates[2], store)
+		store.restore(removed)
+		removed = store.remove_with_dependencies(candidates[1])
+		self.assertEqual(sorted(candidate.filename for candidate in removed), [ "a.jpg", "b.jpg", "c.jpg" ])
+
+	def test_restore_does_not_grow_indices(self):
+		candidates = [ self._candidate("img%02d.jpg" % (i), offset_secs = i * 7200, groups = [ "g%d" % (i // 2) ]) for i in range(10) ]
+		store = ImageCandidateStore(candidates)
+		dependency_counts = [ store.dependency_count(candidate) for candidate in candidates ]
+		for _ in range(50):
+			for candidate in candidates:
+				# Removing without dependencies leaves the index entries behind.
+				store.remove(candidate)
+				store.add(candidate)
+				store.restore(store.remove_with_dependencies(candidate, remove_timewindow = False))
+		self.assertEqual([ store.dependency_count(candidate) for candidate in candidates ], dependency_counts)
+		self.assertEqual(len(store), len(candidates))
+
+	def test_copy_is_independent(self):
+		candidates = [ self._candidate("img%02d.jpg" % (i), offset_secs = i * 7200) for i in range(10) ]
+		store = ImageCandidateStore(candidates)
+		copy = store.copy()
+		copy.remove_with_dependencies(candidates[0])
+		self.assertEqual(len(store), 10)
+		self.assertEqual(len(copy), 9)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,61 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import tempfile
+import unittest
+import unittest.mock
+from calendargen.ImageCropper import ImageCropper
+
+class ImageCropperTests(unittest.TestCase):
+	def setUp(self):
+		self._temp_dir = tempfile.TemporaryDirectory()
+		self._image_filename = self._temp_dir.name + "/image.jpg"
+		open(self._image_filename, "wb").close()
+
+	def tearDown(self):
+		self._temp_dir.cleanup()
+
+	def test_shared_crop(self):
+		cropper = ImageCropper(self._temp_dir.name)
+		crop = cropper.crop(self._image_filename, (400, 300))
+		self.assertIs(cropper.crop(self._image_filename, (400, 300)), crop)
+		self.assertIsNot(cropper.crop(self._image_filename, (400, 300), gravity = "north"), crop)
+		self.assertEqual((cropper.requested_count, cropper.unique_count), (3, 2))
+
+	def test_downscale(self):
+		cropper = ImageCropper(self._temp_dir.name, oversampling = 1.5)
+		self.assertEqual(cropper._output_dimensions((400, 300), (100, 75)), (150, 112))
+		self.assertIsNone(cropper._output_dimensions((400, 300), (300, 225)))
+		self.assertIsNone(cropper._output_dimensions((400, 300), None))
+
+	def test_thread_limit(self):
+		cropper = ImageCropper(self._temp_dir.name, threads = 3)
+		crop = cropper.crop(self._image_filename, (400, 300))
+		self.assertEqual(crop.job.threads, 3)
+		with unittest.mock.patch("subprocess.check_call") as check_call:
+			crop.job.run()
+		(crop_cmd, ) = check_call.call_args.args
+		self.assertEqual(crop_cmd[0], "convert")
+		self.assertEqual(check_call.call_args.kwargs["env"]["MAGICK_THREAD_LIMIT"], "3")
+
+if __name__ == "__main__":
+	unittest.main()
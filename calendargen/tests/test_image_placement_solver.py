@@ -0,0 +1,100 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import random
+import datetime
+import unittest
+import collections
+from calendargen.ImageCandidateStore import ImageCandidateStore
+from calendargen.ImagePlacementSolver import ImagePlacementSolver
+
+Candidate = collections.namedtuple("Candidate", [ "filename", "snaptime", "width", "height", "tag_sets" ])
+Slot = collections.namedtuple("Slot", [ "name", "aspect_ratio" ])
+
+class ImagePlacementSolverTests(unittest.TestCase):
+	_T0 = datetime.datetime(2021, 1, 1, 12, 0, 0)
+
+	def _candidate(self, filename, width = 400, height = 300, offset_secs = None, groups = None):
+		snaptime = None if (offset_secs is None) else self._T0 + datetime.timedelta(0, offset_secs)
+		tag_sets = { } if (groups is None) else { "grp": set(groups) }
+		return Candidate(filename = filename, snaptime = snaptime, width = width, height = height, tag_sets = tag_sets)
+
+	def _assert_valid(self, store, slots, assignment):
+		self.assertEqual(sorted(assignment), sorted(slot.name for slot in slots))
+		for slot in slots:
+			self.assertTrue(store.compatible(assignment[slot.name], slot.aspect_ratio))
+		placed = list(assignment.values())
+		for (index, candidate1) in enumerate(placed):
+			for candidate2 in placed[index + 1 : ]:
+				self.assertFalse(store.conflicting(candidate1, candidate2))
+
+	def test_solves_where_greedy_can_fail(self):
+		# The square image fits both slots, the landscape one only the
+		# landscape slot; placing the square image in the landscape slot first
+		# leaves nothing for the portrait slot.
+		store = ImageCandidateStore([ self._candidate("square.jpg", width = 300, height = 300), self._candidate("landscape.jpg", width = 400, height = 300) ])
+		slots = [ Slot(name = "landscape", aspect_ratio = 4 / 3), Slot(name = "portrait", aspect_ratio = 3 / 4) ]
+		for seed in range(20):
+			assignment = ImagePlacementSolver(store, slots, rng = random.Random(seed)).solve()
+			self._assert_valid(store, slots, assignment)
+			self.assertEqual(assignment["portrait"].filename, "square.jpg")
+		self.assertEqual(len(store), 2)
+
+	def test_time_windows_and_groups(self):
+		rng = random.Random(0)
+		candidates = [ self._candidate("img%02d.jpg" % (i), offset_secs = i * 1800, groups = [ "g%d" % (i // 4) ]) for i in range(40) ]
+		store = ImageCandidateStore(candidates, exclusion_window_secs = 3600)
+		slots = [ Slot(name = "slot%02d" % (i), aspect_ratio = 4 / 3) for i in range(10) ]
+		assignment = ImagePlacementSolver(store, slots, rng = rng).solve()
+		self._assert_valid(store, slots, assignment)
+
+	def test_forced_images(self):
+		candidates = [ self._candidate("img%02d.jpg" % (i), offset_secs = i * 7200) for i in range(20) ]
+		forced = [ candidates[3], candidates[17] ]
+		store = ImageCandidateStore(candidates)
+		slots = [ Slot(name = "slot%d" % (i), aspect_ratio = 4 / 3) for i in range(3) ]
+		for seed in range(10):
+			assignment = ImagePlacementSolver(store, slots, forced_images = forced, rng = random.Random(seed)).solve()
+			self._assert_valid(store, slots, assignment)
+			self.assertTrue(all(candidate in assignment.values() for candidate in forced))
+
+	def test_conflicting_forced_images(self):
+		candidates = [ self._candidate("img%02d.jpg" % (i), offset_secs = i * 7200) for i in range(10) ] + [ self._candidate("twin.jpg", offset_secs = 60) ]
+		store = ImageCandidateStore(candidates)
+		slots = [ Slot(name = "slot%d" % (i), aspect_ratio = 4 / 3) for i in range(3) ]
+		forced = [ candidates[0], candidates[-1] ]
+		self.assertIsNone(ImagePlacementSolver(store, slots, forced_images = forced).solve())
+		assignment = ImagePlacementSolver(store, slots, forced_images = forced, require_forced = False).solve()
+		self._assert_valid(store, slots, assignment)
+
+	def test_infeasible_pool(self):
+		# Only two images are far enough apart in time for three slots.
+		candidates = [ self._candidate("img%02d.jpg" % (i), offset_secs = i * 600) for i in range(6) ] + [ self._candidate("late.jpg", offset_secs = 86400) ]
+		store = ImageCandidateStore(candidates, exclusion_window_secs = 3600)
+		slots = [ Slot(name = "slot%d" % (i), aspect_ratio = 4 / 3) for i in range(3) ]
+		self.assertIsNone(ImagePlacementSolver(store, slots).solve())
+
+		# No image fits the aspect ratio at all.
+		slots = [ Slot(name = "panorama", aspect_ratio = 4) ]
+		self.assertIsNone(ImagePlacementSolver(store, slots).solve())
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,141 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import tempfile
+import unittest
+import unittest.mock
+from calendargen.ImagePool import ImagePool
+from calendargen.tests.JPEGWriter import JPEGWriter
+
+class ImagePoolTests(unittest.TestCase):
+	_SIDECAR = """<?xml version="1.0" encoding="UTF-8"?>
+<x:xmpmeta xmlns:x="adobe:ns:meta/">
+	<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+		<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/">
+			<dc:subject><rdf:Bag>%s</rdf:Bag></dc:subject>
+		</rdf:Description>
+	</rdf:RDF>
+</x:xmpmeta>
+"""
+
+	@classmethod
+	def setUpClass(cls):
+		# Scan workers are forked from a forkserver that keeps the environment
+		# it was started with, so all tests need to share the same HOME.
+		cls._home_dir = tempfile.TemporaryDirectory(prefix = "calendargen_test_")
+		cls._home = unittest.mock.patch.dict(os.environ, { "HOME": cls._home_dir.name })
+		cls._home.start()
+
+	@classmethod
+	def tearDownClass(cls):
+		cls._home.stop()
+		cls._home_dir.cleanup()
+
+	def setUp(self):
+		self._temp_dir = tempfile.TemporaryDirectory(prefix = "test_", dir = self._home_dir.name)
+		self._pool_dir = os.path.realpath(self._temp_dir.name) + "/pool"
+		os.makedirs(self._pool_dir)
+
+	def tearDown(self):
+		self._temp_dir.cleanup()
+
+	def _write_image(self, name, sidecar_data = None, **kwargs):
+		filename = "%s/%s" % (self._pool_dir, name)
+		JPEGWriter(400, 300, **kwargs).write(filename)
+		if sidecar_data is not None:
+			sidecar_filename = ImagePool._get_geeqie_metadata_filename(filename)
+			os.makedirs(os.path.dirname(sidecar_filename), exist_ok = True)
+			with open(sidecar_filename, "w") as f:
+				f.write(sidecar_data)
+		return filename
+
+	def _sidecar(self, *tags):
+		return self._SIDECAR % ("".join("<rdf:li>%s</rdf:li>" % (tag) for tag in tags))
+
+	def _scanned_filenames(self, **kwargs):
+		# Collects the files which are scanned instead of taken from the cache.
+		scanned = [ ]
+		flush_scan_queue = ImagePool._flush_scan_queue
+		def record(pool, job_server, cache):
+			scanned.extend(filename for (filename, mtimes) in pool._scan_queue)
+			flush_scan_queue(pool, job_server, cache)
+		with unittest.mock.patch.object(ImagePool, "_flush_scan_queue", record):
+			pool = ImagePool([ self._pool_dir ], **kwargs)
+		return (pool, sorted(scanned))
+
+	def _write_outside_image(self, name):
+		outside_dir = os.path.realpath(self._temp_dir.name) + "/outside"
+		os.makedirs(outside_dir, exist_ok = True)
+		target = "%s/%s" % (outside_dir, name)
+		JPEGWriter(300, 400).write(target)
+		os.symlink(target, "%s/%s" % (self._pool_dir, name))
+		return target
+
+	def test_symlink_outside_pool_cached(self):
+		image = self._write_image("image.jpg")
+		outside = self._write_outside_image("outside.jpg")
+		(pool, scanned) = self._scanned_filenames()
+		self.assertEqual(scanned, sorted([ image, outside ]))
+		self.assertEqual(tuple(pool[outside]["meta"]["geometry"]), (300, 400))
+
+		# The directory changed, so it is listed again; only the new image is
+		# scanned.
+		added = self._write_image("added.jpg")
+		(pool, scanned) = self._scanned_filenames()
+		self.assertEqual(scanned, [ added ])
+		self.assertEqual(tuple(pool[outside]["meta"]["geometry"]), (300, 400))
+
+	def test_symlink_outside_unchanged_directory(self):
+		self._write_image("image.jpg")
+		outside = self._write_outside_image("outside.jpg")
+		self._scanned_filenames()
+		(pool, scanned) = self._scanned_filenames()
+		self.assertEqual(scanned, [ ])
+		self.assertEqual(tuple(pool[outside]["meta"]["geometry"]), (300, 400))
+
+	def test_corrupt_sidecar_in_chunk(self):
+		filenames = [ self._write_image("image%02d.jpg" % (image_no), sidecar_data = self._sidecar("grp=g%d" % (image_no))) for image_no in range(5) ]
+		broken_filename = self._write_image("broken.jpg", sidecar_data = "<x:xmpmeta><rdf:RDF>")
+		results = ImagePool._scan_metadata([ (filename, [ 1, 1 ]) for filename in filenames + [ broken_filename ] ], [ "sidecar" ])
+		results = { filename: (entry, error) for (filename, entry, error) in results }
+		for (image_no, filename) in enumerate(filenames):
+			(entry, error) = results[filename]
+			self.assertIsNone(error)
+			self.assertEqual(entry["tags"], { "grp": [ "g%d" % (image_no) ] })
+			self.assertEqual(entry["meta"]["geometry"], (400, 300))
+		(entry, error) = results[broken_filename]
+		self.assertIsNone(entry)
+		self.assertIn("XMLSyntaxError", error)
+
+	def test_tag_sources(self):
+		sidecar = self._write_image("sidecar.jpg", sidecar_data = self._sidecar("only=alice"), iptc_keywords = [ "only=bob" ])
+		iptc = self._write_image("iptc.jpg", iptc_keywords = [ "only=bob", "grp=x+y" ])
+		untagged = self._write_image("untagged.jpg", snaptime = "2021:05:01 12:30:00")
+		pool = ImagePool([ self._pool_dir ], tag_sources = [ "sidecar", "iptc" ])
+		self.assertEqual(pool[sidecar]["tags"], { "only": [ "alice" ] })
+		self.assertEqual(pool[iptc]["tags"]["only"], [ "bob" ])
+		self.assertEqual(sorted(pool[iptc]["tags"]["grp"]), [ "x", "y" ])
+		self.assertEqual(pool[untagged]["tags"], { })
+		self.assertEqual(pool[untagged]["meta"]["snaptime"], "2021-05-01T12:30:00")
+
+if __name__ == "__main__":
+	unittest.main()
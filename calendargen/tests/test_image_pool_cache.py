@@ -0,0 +1,104 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import json
+import tempfile
+import unittest
+from calendargen.ImagePoolCache import ImagePoolCache
+from calendargen.Exceptions import IllegalImagePoolActionException
+
+class ImagePoolCacheTests(unittest.TestCase):
+	def setUp(self):
+		self._temp_dir = tempfile.TemporaryDirectory(prefix = "calendargen_test_")
+		self._filename = self._temp_dir.name + "/cache.sqlite3"
+		self._json_filename = self._temp_dir.name + "/cache.json"
+
+	def tearDown(self):
+		self._temp_dir.cleanup()
+
+	@staticmethod
+	def _entry(mtime, snaptime = None):
+		return { "mtimes": [ mtime, None ], "version": 1, "tags": { }, "meta": { "geometry": [ 400, 300 ], "snaptime": snaptime } }
+
+	def _open(self, **kwargs):
+		return ImagePoolCache(filename = self._filename, legacy_json_filename = self._json_filename, **kwargs)
+
+	def test_json_migration(self):
+		with open(self._json_filename, "w") as f:
+			json.dump({ "/pool/a.jpg": self._entry(1), "/pool/b.jpg": self._entry(2) }, f)
+		with self._open() as cache:
+			self.assertEqual(cache.get("/pool/a.jpg"), self._entry(1))
+			self.assertEqual(cache.get("/pool/b.jpg"), self._entry(2))
+
+		# The JSON file is only imported once.
+		with open(self._json_filename, "w") as f:
+			json.dump({ "/pool/a.jpg": self._entry(99) }, f)
+		with self._open() as cache:
+			self.assertEqual(cache.get("/pool/a.jpg"), self._entry(1))
+
+	def test_persistence(self):
+		with self._open() as cache:
+			cache.put("/pool/a.jpg", self._entry(1))
+		with self._open() as cache:
+			self.assertEqual(cache.get("/pool/a.jpg"), self._entry(1))
+			self.assertIsNone(cache.get("/pool/missing.jpg"))
+
+	def test_prefix_queries(self):
+		with self._open() as cache:
+			for filename in [ "/pool/a.jpg", "/pool/sub/b.jpg", "/pool0/c.jpg", "/pool-x/d.jpg", "/poo/e.jpg" ]:
+				cache.put(filename, self._entry(1))
+			self.assertEqual(sorted(cache.get_below("/pool")), [ "/pool/a.jpg", "/pool/sub/b.jpg" ])
+			self.assertEqual(sorted(cache.get_below("/pool/")), [ "/pool/a.jpg", "/pool/sub/b.jpg" ])
+			self.assertEqual(sorted(cache.get_below("/pool/sub")), [ "/pool/sub/b.jpg" ])
+
+			cache.put_directory("/pool", [ 1, None ], [ "/pool/a.jpg" ], [ "/pool/sub" ])
+			cache.put_directory("/pool/sub", [ 2, None ], [ "/pool/sub/b.jpg" ], [ ])
+			cache.put_directory("/pool0", [ 3, None ], [ "/pool0/c.jpg" ], [ ])
+			self.assertEqual(sorted(cache.get_directories_below("/pool")), [ "/pool", "/pool/sub" ])
+
+			cache.delete_below("/pool/sub")
+			self.assertIsNone(cache.get("/pool/sub/b.jpg"))
+			self.assertEqual(sorted(cache.get_directories_below("/pool")), [ "/pool" ])
+			self.assertIsNotNone(cache.get("/pool/a.jpg"))
+			self.assertIsNotNone(cache.get("/pool0/c.jpg"))
+
+	def test_pending_entries_visible(self):
+		# With a long flush interval, entries are only pending or in flight,
+		# but must be found nevertheless.
+		with self._open(batch_size = 2, flush_interval_secs = 60) as cache:
+			for image_no in range(101):
+				cache.put("/pool/%03d.jpg" % (image_no), self._entry(image_no))
+				self.assertEqual(cache.get("/pool/%03d.jpg" % (image_no)), self._entry(image_no))
+			self.assertEqual(len(cache.get_below("/pool")), 101)
+			cache.delete([ "/pool/000.jpg" ])
+			self.assertIsNone(cache.get("/pool/000.jpg"))
+		with self._open() as cache:
+			self.assertEqual(len(cache.get_below("/pool")), 100)
+
+	def test_put_after_close(self):
+		cache = self._open()
+		cache.put("/pool/a.jpg", self._entry(1))
+		cache.close()
+		with self.assertRaises(IllegalImagePoolActionException):
+			cache.put("/pool/b.jpg", self._entry(2))
+
+if __name__ == "__main__":
+	unittest.main()
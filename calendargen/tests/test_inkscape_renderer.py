@@ -0,0 +1,94 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import os
+import sys
+import stat
+import tempfile
+import unittest
+import unittest.mock
+from calendargen.InkscapeRenderer import InkscapeShellWorker, InkscapeShellRenderer
+from calendargen.Exceptions import InkscapeRenderException
+
+class InkscapeShellRendererTests(unittest.TestCase):
+	# Stands in for "inkscape --shell": exports an empty file for every command
+	# line, but hangs when asked to open a file whose name contains "hang".
+	_FAKE_INKSCAPE = """#!%s
+import sys
+import time
+sys.stdout.write("> ")
+sys.stdout.flush()
+for line in sys.stdin:
+	if line.strip() == "quit":
+		break
+	actions = dict(action.split(":", maxsplit = 1) for action in line.strip().split(";") if ":" in action)
+	if "hang" in actions.get("file-open", ""):
+		time.sleep(3600)
+	if "export-filename" in actions:
+		open(actions["export-filename"], "wb").close()
+	sys.stdout.write("> ")
+	sys.stdout.flush()
+"""
+
+	def setUp(self):
+		self._temp_dir = tempfile.TemporaryDirectory()
+		bin_dir = self._temp_dir.name + "/bin"
+		os.makedirs(bin_dir)
+		with open(bin_dir + "/inkscape", "w") as f:
+			f.write(self._FAKE_INKSCAPE % (sys.executable))
+		os.chmod(bin_dir + "/inkscape", stat.S_IRWXU)
+		self._path = unittest.mock.patch.dict(os.environ, { "PATH": bin_dir + os.pathsep + os.environ["PATH"] })
+		self._path.start()
+
+	def tearDown(self):
+		self._path.stop()
+		self._temp_dir.cleanup()
+
+	def _render(self, renderer, svg_name):
+		png_filename = self._temp_dir.name + "/out.png"
+		renderer.render(self._temp_dir.name + "/" + svg_name, png_filename, 90)
+		return os.path.isfile(png_filename)
+
+	def test_render(self):
+		with InkscapeShellRenderer(worker_count = 1) as renderer:
+			self.assertTrue(self._render(renderer, "page.svg"))
+			self.assertTrue(self._render(renderer, "page.svg"))
+
+	def test_hung_worker_respawned(self):
+		worker = InkscapeShellWorker(0, timeout_secs = 0.5)
+		try:
+			with self.assertRaises(InkscapeRenderException):
+				self._render(worker, "hang.svg")
+			self.assertFalse(worker.alive)
+			self.assertTrue(self._render(worker, "page.svg"))
+			self.assertTrue(worker.alive)
+		finally:
+			worker.close()
+
+	def test_hung_render_fails(self):
+		with InkscapeShellRenderer(worker_count = 1, timeout_secs = 0.5) as renderer:
+			with self.assertRaises(InkscapeRenderException):
+				self._render(renderer, "hang.svg")
+			self.assertTrue(self._render(renderer, "page.svg"))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,130 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import time
+import threading
+import unittest
+from calendargen.JobServer import JobServer, Job
+
+class JobServerTests(unittest.TestCase):
+	def _blocked_server(self, **kwargs):
+		# A single worker that is kept busy until the returned event is set, so
+		# that all jobs added in the meantime are queued before any of them
+		# starts.
+		release = threading.Event()
+		job_server = JobServer(concurrent_job_count = 1, **kwargs)
+		started = threading.Event()
+		def block():
+			started.set()
+			release.wait()
+		job_server.add_jobs(Job(block, info = "block"))
+		started.wait()
+		return (job_server, release)
+
+	def test_priority_order(self):
+		(job_server, release) = self._blocked_server()
+		order = [ ]
+		job_server.add_jobs(*[ Job(order.append, (priority, ), priority = priority) for priority in [ 1, 3, 0, 2 ] ])
+		release.set()
+		job_server.await_completion()
+		self.assertEqual(order, [ 3, 2, 1, 0 ])
+
+	def test_critical_path_order(self):
+		(job_server, release) = self._blocked_server()
+		order = [ ]
+		short = Job(order.append, ("short", ))
+		long = Job(order.append, ("long", )).then(Job(order.append, ("long-child", )).then(Job(order.append, ("long-grandchild", ))))
+		job_server.add_jobs(short, long)
+		release.set()
+		job_server.await_completion()
+		# Once only the grandchild is left, both paths are equally long.
+		self.assertEqual(order[ : 2], [ "long", "long-child" ])
+
+	def test_critical_path_uses_observed_durations(self):
+		# The whole DAG is added up front. Once a "slow" and a "fast" job have
+		# been observed, a single slow job outweighs a chain of fast ones.
+		job_server = JobServer(concurrent_job_count = 1)
+		order = [ ]
+		def run(name, duration = 0):
+			time.sleep(duration)
+			order.append(name)
+		calibration = [ Job(run, ("calibrate-slow", 0.05), info = "slow"), Job(run, ("calibrate-fast", ), info = "fast") ]
+		gate = Job(run, ("gate", ), info = "gate").depends_on(*calibration)
+		gate.then(Job(run, ("slow-chain", ), info = "fast").then(Job(run, ("slow-chain-end", 0.05), info = "slow")))
+		gate.then(Job(run, ("fast-chain", ), info = "fast").then(Job(run, ("fast-chain-2", ), info = "fast").then(Job(run, ("fast-chain-end", ), info = "fast"))))
+		job_server.add_jobs(*calibration)
+		job_server.await_completion()
+		self.assertLess(order.index("slow-chain"), order.index("fast-chain"))
+
+	def test_memory_budget(self):
+		job_server = JobServer(concurrent_job_count = 4, max_memory = 100)
+		lock = threading.Lock()
+		running = [ 0 ]
+		peak_memory = [ 0 ]
+		def run(memory):
+			with lock:
+				running[0] += memory
+				peak_memory[0] = max(peak_memory[0], running[0])
+			time.sleep(0.02)
+			with lock:
+				running[0] -= memory
+		jobs = [ Job(run, (60, ), memory = 60) for _ in range(3) ] + [ Job(run, (30, ), memory = 30) for _ in range(2) ]
+		job_server.add_jobs(*jobs)
+		job_server.await_completion()
+		self.assertLessEqual(peak_memory[0], 100)
+
+	def test_thread_budget(self):
+		job_server = JobServer(concurrent_job_count = 4)
+		lock = threading.Lock()
+		running = [ 0 ]
+		peak_threads = [ 0 ]
+		def run(threads):
+			with lock:
+				running[0] += threads
+				peak_threads[0] = max(peak_threads[0], running[0])
+			time.sleep(0.02)
+			with lock:
+				running[0] -= threads
+		jobs = [ Job(run, (3, ), threads = 3) for _ in range(3) ] + [ Job(run, (1, ), threads = 1) for _ in range(4) ]
+		job_server.add_jobs(*jobs)
+		job_server.await_completion()
+		self.assertLessEqual(peak_threads[0], 4)
+
+	def test_oversized_job_runs_alone(self):
+		job_server = JobServer(concurrent_job_count = 2, max_memory = 100)
+		order = [ ]
+		job_server.add_jobs(Job(order.append, ("huge", ), memory = 1000), Job(order.append, ("small", ), memory = 10))
+		job_server.await_completion()
+		self.assertEqual(sorted(order), [ "huge", "small" ])
+
+	def test_failure_propagates(self):
+		job_server = JobServer(concurrent_job_count = 2, exception_on_failed = False)
+		order = [ ]
+		failing = Job(int, ("not a number", ))
+		child = Job(order.append, ("child", )).depends_on(failing)
+		cleanup = Job(order.append, ("cleanup", )).depends_unconditionally_on(failing)
+		job_server.add_jobs(failing)
+		job_server.await_completion()
+		self.assertEqual(order, [ "cleanup" ])
+		self.assertEqual(child.state.name, "Failed")
+
+if __name__ == "__main__":
+	unittest.main()
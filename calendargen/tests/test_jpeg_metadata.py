@@ -0,0 +1,111 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import struct
+import tempfile
+import unittest
+from calendargen.JPEGMetadata import JPEGMetadata
+from calendargen.Exceptions import InvalidJPEGException
+from calendargen.tests.JPEGWriter import JPEGWriter
+
+class JPEGMetadataTests(unittest.TestCase):
+	_XMP = b"<x:xmpmeta xmlns:x=\"adobe:ns:meta/\"></x:xmpmeta>"
+
+	def setUp(self):
+		self._temp_dir = tempfile.TemporaryDirectory()
+
+	def tearDown(self):
+		self._temp_dir.cleanup()
+
+	def _parse(self, data):
+		filename = self._temp_dir.name + "/image.jpg"
+		with open(filename, "wb") as f:
+			f.write(data)
+		return JPEGMetadata(filename)
+
+	def test_geometry_only(self):
+		metadata = self._parse(JPEGWriter(640, 480).data())
+		self.assertEqual(metadata.geometry, (640, 480))
+		self.assertEqual(metadata.exif, { })
+		self.assertIsNone(metadata.snaptime)
+		self.assertIsNone(metadata.xmp)
+		self.assertEqual(metadata.iptc_keywords, [ ])
+
+	def test_all_metadata(self):
+		metadata = self._parse(JPEGWriter(300, 400, snaptime = "2021:05:01 12:30:00", xmp = self._XMP, iptc_keywords = [ "holiday", "Überlingen", "abc" ]).data())
+		self.assertEqual(metadata.geometry, (300, 400))
+		self.assertEqual(metadata.snaptime, "2021:05:01 12:30:00")
+		self.assertEqual(metadata.xmp, self._XMP)
+		self.assertEqual(metadata.iptc_keywords, [ "holiday", "Überlingen", "abc" ])
+
+	def test_skipped_segments(self):
+		data = JPEGWriter(800, 600, snaptime = "2020:01:02 03:04:05").data()
+		# A DHT segment (which lies within the SOF marker range, but is none)
+		# and fill bytes in front of the start of frame marker.
+		sof_offset = data.index(b"\xff\xc0")
+		data = data[:sof_offset] + JPEGWriter.segment(0xc4, bytes(20)) + b"\xff\xff" + data[sof_offset:]
+		metadata = self._parse(data)
+		self.assertEqual(metadata.geometry, (800, 600))
+		self.assertEqual(metadata.snaptime, "2020:01:02 03:04:05")
+
+	def test_progressive(self):
+		data = JPEGWriter(800, 600).data().replace(b"\xff\xc0", b"\xff\xc2")
+		self.assertEqual(self._parse(data).geometry, (800, 600))
+
+	def test_big_endian_exif(self):
+		snaptime = b"2019:12:24 18:00:00\x00"
+		tiff = b"MM" + struct.pack(">HL", 42, 8)
+		tiff += struct.pack(">H", 1) + struct.pack(">HHLL", 0x0132, 2, len(snaptime), 26) + struct.pack(">L", 0)
+		tiff += snaptime
+		data = b"\xff\xd8" + JPEGWriter.segment(0xe1, b"Exif\x00\x00" + tiff) + JPEGWriter(10, 20).data()[2:]
+		metadata = self._parse(data)
+		self.assertEqual(metadata.snaptime, "2019:12:24 18:00:00")
+		self.assertEqual(metadata.geometry, (10, 20))
+
+	def test_corrupt_exif(self):
+		# EXIF data that points beyond its segment is ignored, the image itself
+		# is still usable.
+		tiff = b"II" + struct.pack("<HL", 42, 1000)
+		data = b"\xff\xd8" + JPEGWriter.segment(0xe1, b"Exif\x00\x00" + tiff) + JPEGWriter(10, 20).data()[2:]
+		metadata = self._parse(data)
+		self.assertEqual(metadata.exif, { })
+		self.assertEqual(metadata.geometry, (10, 20))
+
+	def test_truncated(self):
+		data = JPEGWriter(300, 400, snaptime = "2021:05:01 12:30:00", xmp = self._XMP, iptc_keywords = [ "holiday" ]).data()
+		sof_end = data.index(b"\xff\xc0") + 9
+		for length in range(sof_end):
+			with self.subTest(length = length), self.assertRaises(InvalidJPEGException):
+				self._parse(data[:length])
+		self.assertEqual(self._parse(data[:sof_end]).geometry, (300, 400))
+
+	def test_not_a_jpeg(self):
+		with self.assertRaises(InvalidJPEGException):
+			self._parse(b"\x89PNG\r\n\x1a\n" + bytes(100))
+
+	def test_no_start_of_frame(self):
+		with self.assertRaises(InvalidJPEGException):
+			self._parse(b"\xff\xd8" + JPEGWriter.segment(0xda, bytes(10)) + b"\xff\xd9")
+		with self.assertRaises(InvalidJPEGException):
+			self._parse(b"\xff\xd8" + JPEGWriter.segment(0xe0, bytes(10)) + b"\x00\x00")
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,107 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import tempfile
+import unittest
+from calendargen.Enums import LayerCompositionMethod
+from calendargen.Exceptions import IllegalLayoutDefinitionException
+
+from calendargen.LayerCompositor import LayerCompositor
+
+try:
+	import numpy
+	import PIL.Image
+except ImportError as e:
+	raise unittest.SkipTest("Pillow and NumPy are required for composing layers: %s" % (str(e)))
+
+class LayerCompositorTests(unittest.TestCase):
+	def setUp(self):
+		self._compositor = LayerCompositor()
+
+	@staticmethod
+	def _image(color, size = (4, 3)):
+		return PIL.Image.new("RGBA", size, color)
+
+	def assertPixel(self, image, expected, xy = (0, 0), delta = 1):
+		pixel = image.getpixel(xy)
+		for (channel, (value, expected_value)) in enumerate(zip(pixel, expected)):
+			self.assertAlmostEqual(value, expected_value, delta = delta, msg = "channel %d of %s, expected %s" % (channel, str(pixel), str(expected)))
+
+	def test_alpha_order(self):
+		red = self._image((255, 0, 0, 255))
+		blue = self._image((0, 0, 255, 128))
+		self.assertPixel(self._compositor.compose(red, blue, LayerCompositionMethod.AlphaCompose), (127, 0, 128, 255))
+		self.assertPixel(self._compositor.compose(blue, red, LayerCompositionMethod.AlphaCompose), (255, 0, 0, 255))
+
+	def test_alpha_associative(self):
+		# LayerMergePlanner relies on this to merge runs as a balanced tree.
+		layers = [ self._image((255, 0, 0, 255)), self._image((0, 255, 0, 100)), self._image((0, 0, 255, 50)) ]
+		alpha = LayerCompositionMethod.AlphaCompose
+		left = self._compositor.compose(self._compositor.compose(layers[0], layers[1], alpha), layers[2], alpha)
+		right = self._compositor.compose(layers[0], self._compositor.compose(layers[1], layers[2], alpha), alpha)
+		# Up to rounding of the 8 bit intermediate results.
+		self.assertPixel(left, right.getpixel((0, 0)), delta = 3)
+
+	def test_inverted(self):
+		lower = self._image((51, 102, 255, 200))
+		# The color of the upper layer is ignored, the alpha channel of the
+		# lower layer is retained.
+		opaque = self._compositor.compose(lower, self._image((12, 34, 56, 255)), LayerCompositionMethod.InvertedCompose)
+		self.assertPixel(opaque, (204, 153, 0, 200))
+		transparent = self._compositor.compose(lower, self._image((12, 34, 56, 0)), LayerCompositionMethod.InvertedCompose)
+		self.assertPixel(transparent, (51, 102, 255, 200))
+
+	def test_inverted_not_commutative(self):
+		# Which is why LayerMergePlanner treats inverted layers as barriers.
+		lower = self._image((51, 102, 255, 255))
+		upper = self._image((0, 0, 0, 255))
+		self.assertPixel(self._compositor.compose(lower, upper, LayerCompositionMethod.InvertedCompose), (204, 153, 0, 255))
+		self.assertPixel(self._compositor.compose(upper, lower, LayerCompositionMethod.InvertedCompose), (255, 255, 255, 255))
+
+	def test_inverted_stripes(self):
+		self._compositor._STRIPE_HEIGHT = 2
+		lower = self._image((51, 102, 255, 255), size = (3, 5))
+		upper = self._image((0, 0, 0, 0), size = (3, 5))
+		for y in range(0, 5, 2):
+			for x in range(3):
+				upper.putpixel((x, y), (0, 0, 0, 255))
+		composed = self._compositor.compose(lower, upper, LayerCompositionMethod.InvertedCompose)
+		for y in range(5):
+			with self.subTest(y = y):
+				self.assertPixel(composed, (204, 153, 0, 255) if (y % 2 == 0) else (51, 102, 255, 255), xy = (2, y))
+
+	def test_size_mismatch(self):
+		with self.assertRaises(IllegalLayoutDefinitionException):
+			self._compositor.compose(self._image((0, 0, 0, 0), size = (4, 3)), self._image((0, 0, 0, 0), size = (3, 4)), LayerCompositionMethod.AlphaCompose)
+
+	def test_write_flattened(self):
+		self.assertTrue(LayerCompositor.can_write("page.PNG"))
+		self.assertFalse(LayerCompositor.can_write("page.pdf"))
+		with tempfile.TemporaryDirectory() as temp_dir:
+			filename = temp_dir + "/page.png"
+			self._compositor.write(self._image((0, 0, 0, 0)), filename, flatten = True)
+			with PIL.Image.open(filename) as image:
+				self.assertEqual(image.mode, "RGB")
+				self.assertEqual(image.getpixel((0, 0)), (255, 255, 255))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,113 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import threading
+import unittest
+from calendargen.JobServer import JobServer, Job
+from calendargen.Enums import LayerCompositionMethod
+from calendargen.LayerMergePlanner import LayerMergePlanner
+
+class RecordingCompositor():
+	"""Stands in for LayerCompositor; "images" are strings that describe how
+	they were composed."""
+	_OPERATORS = {
+		LayerCompositionMethod.AlphaCompose:	"+",
+		LayerCompositionMethod.InvertedCompose:	"^",
+	}
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self.composed = [ ]
+		self.composed_event = threading.Event()
+
+	def load(self, filename):
+		return filename
+
+	def compose(self, lower, upper, composition_method):
+		result = "(%s %s %s)" % (lower, self._OPERATORS[composition_method], upper)
+		with self._lock:
+			self.composed.append(result)
+		self.composed_event.set()
+		return result
+
+class LayerMergePlannerTests(unittest.TestCase):
+	def _merge(self, layers, render_jobs = None, compositor = None):
+		"""Takes (name, composition_method) tuples, bottom layer first, and
+		returns the composed result of the planned merge."""
+		compositor = compositor or RecordingCompositor()
+		render_jobs = render_jobs or { }
+		planned_layers = [ (render_jobs.get(name, Job(lambda: None, info = "render")), name, composition_method) for (name, composition_method) in layers ]
+		root = LayerMergePlanner(compositor).plan(planned_layers)
+		with JobServer(concurrent_job_count = 4) as job_server:
+			job_server.add_jobs(*[ render_job for (render_job, name, composition_method) in planned_layers ])
+			job_server.await_completion()
+		return (root.take(compositor), compositor)
+
+	@staticmethod
+	def _alpha(*names):
+		return [ (name, LayerCompositionMethod.AlphaCompose) for name in names ]
+
+	@staticmethod
+	def _inverted(name):
+		return [ (name, LayerCompositionMethod.InvertedCompose) ]
+
+	def test_single_layer(self):
+		(result, compositor) = self._merge(self._alpha("a"))
+		self.assertEqual(result, "a")
+		self.assertEqual(compositor.composed, [ ])
+
+	def test_balanced_alpha_order(self):
+		(result, compositor) = self._merge(self._alpha("a", "b", "c", "d", "e"))
+		self.assertEqual(result, "((a + b) + (c + (d + e)))")
+		self.assertEqual(len(compositor.composed), 4)
+
+	def test_inverted_barrier(self):
+		(result, compositor) = self._merge(self._alpha("a", "b") + self._inverted("i") + self._alpha("c", "d"))
+		self.assertEqual(result, "(((a + b) ^ i) + (c + d))")
+
+	def test_consecutive_inverted(self):
+		(result, compositor) = self._merge(self._alpha("a") + self._inverted("i") + self._inverted("j") + self._alpha("b"))
+		self.assertEqual(result, "(((a ^ i) ^ j) + b)")
+
+	def test_inverted_bottom_layer(self):
+		(result, compositor) = self._merge(self._inverted("i") + self._alpha("a"))
+		self.assertEqual(result, "(i + a)")
+
+	def test_run_above_barrier_in_parallel(self):
+		# The layers above the inverted one are merged while the inverted layer
+		# is still being rendered.
+		compositor = RecordingCompositor()
+		merged_above = [ None ]
+		def render_inverted():
+			merged_above[0] = compositor.composed_event.wait(timeout = 5)
+		(result, compositor) = self._merge(self._alpha("a") + self._inverted("i") + self._alpha("c", "d"), render_jobs = { "i": Job(render_inverted, info = "render") }, compositor = compositor)
+		self.assertTrue(merged_above[0])
+		self.assertEqual(compositor.composed[0], "(c + d)")
+		self.assertEqual(result, "((a ^ i) + (c + d))")
+
+	def test_merge_jobs_prioritized(self):
+		compositor = RecordingCompositor()
+		root = LayerMergePlanner(compositor, page_pixels = (10, 20)).plan([ (Job(lambda: None), name, LayerCompositionMethod.AlphaCompose) for name in [ "a", "b" ] ])
+		self.assertEqual(root.job.priority, LayerMergePlanner.MERGE_PRIORITY)
+		self.assertEqual(root.job.memory, 10 * 20 * 4 * 3)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,125 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import tempfile
+import unittest
+from calendargen.Exceptions import IllegalLayoutDefinitionException
+
+try:
+	from calendargen.SVGTemplate import SVGTemplate
+	from calendargen.SVGProcessor import SVGProcessor
+except ImportError as e:
+	raise unittest.SkipTest("SVGProcessor not importable: %s" % (str(e)))
+
+class SVGProcessorTests(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls._template = SVGTemplate.load("30x20_month_calendar.svg")
+
+	def setUp(self):
+		self._temp_dir = tempfile.TemporaryDirectory()
+		SVGProcessor._restyle.cache_clear()
+
+	def tearDown(self):
+		self._temp_dir.cleanup()
+
+	def _svg(self, processor):
+		filename = os.path.join(self._temp_dir.name, "out.svg")
+		processor.write(filename)
+		with open(filename, "rb") as f:
+			return f.read()
+
+	@staticmethod
+	def _month_transform():
+		transform = {
+			"month_text":	[ { "cmd": "noop" }, { "cmd": "set_text", "text": "September" } ],
+			"year_text":	[ { "cmd": "set_text", "text": "2021" }, { "cmd": "set_style", "fill": "#00ff00" } ],
+		}
+		for day_no in range(1, 31 + 1):
+			if day_no <= 30:
+				day_style = { "fill": "#ff0000" } if (day_no % 7 == 0) else { }
+				transform["day_box_%02d" % (day_no)] = [ dict(cmd = "set_style", **day_style) ]
+				transform["dow_%02d_text" % (day_no)] = [ { "cmd": "set_text", "text": "Mo" }, dict(cmd = "set_style", **day_style), { "cmd": "set_style", "opacity": "0.5" } ]
+				transform["star_%02d" % (day_no)] = [ { "cmd": "set_style", "hide": True } ]
+			else:
+				transform["group_%02d" % (day_no)] = [ { "cmd": "set_style", "hide": True } ]
+				transform["day_box_%02d" % (day_no)] = [ { "cmd": "noop" } ]
+		return transform
+
+	def test_plan_matches_per_instruction(self):
+		transform = self._month_transform()
+		per_instruction = SVGProcessor(self._template)
+		for (element_name, instructions) in transform.items():
+			for instruction in instructions:
+				per_instruction.handle_instruction(element_name, { }, instruction)
+
+		planned = SVGProcessor(self._template)
+		planned.transform(transform, { })
+
+		self.assertEqual(self._svg(per_instruction), self._svg(planned))
+		self.assertNotEqual(self._svg(planned), self._svg(SVGProcessor(self._template)))
+		self.assertEqual(per_instruction.unused_elements, planned.unused_elements)
+		self.assertNotIn("day_box_31", planned.unused_elements)
+
+	def test_plan_reuse(self):
+		transform = self._month_transform()
+		processor = SVGProcessor(self._template)
+		plan = processor.compile_transform(transform, { })
+		processor.apply_transform(plan, { })
+
+		other = SVGProcessor(self._template)
+		other.apply_transform(plan, { })
+		self.assertEqual(self._svg(processor), self._svg(other))
+
+	def _assert_rejected_unmodified(self, transform, image_metadata = None):
+		processor = SVGProcessor(self._template)
+		with self.assertRaises(IllegalLayoutDefinitionException):
+			processor.transform(transform, image_metadata or { })
+		self.assertEqual(self._svg(processor), self._svg(SVGProcessor(self._template)))
+		self.assertEqual(processor.unused_elements, set(self._template.element_names))
+
+	def test_unknown_element(self):
+		self._assert_rejected_unmodified({
+			"month_text":	[ { "cmd": "set_text", "text": "September" } ],
+			"no_such_element":	[ { "cmd": "noop" } ],
+		})
+
+	def test_unknown_command(self):
+		self._assert_rejected_unmodified({
+			"month_text":	[ { "cmd": "set_text", "text": "September" } ],
+			"year_text":	[ { "cmd": "no_such_cmd" } ],
+		})
+
+	def test_unknown_image(self):
+		self._assert_rejected_unmodified({
+			"month_text":	[ { "cmd": "set_text", "text": "September" } ],
+			"day_box_01":	[ { "cmd": "set_style", "fill": "#ff0000" }, { "cmd": "place_image", "img_ref": "missing" } ],
+		}, image_metadata = { "other": { "filename": "other.jpg", "dimensions": [ 400, 300 ] } })
+
+	def test_missing_text(self):
+		self._assert_rejected_unmodified({
+			"month_text":	[ { "cmd": "set_text", "text": "September" } ],
+			"year_text":	[ { "cmd": "set_text" } ],
+		})
+
+if __name__ == "__main__":
+	unittest.main()
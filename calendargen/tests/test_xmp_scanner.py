@@ -0,0 +1,89 @@
+#	calendargen - Photo calendar generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of calendargen.
+#
+#	calendargen is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	calendargen is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with calendargen; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import gc
+import tempfile
+import warnings
+import unittest
+import lxml.etree
+from calendargen.XMPScanner import XMPScanner
+
+class XMPScannerTests(unittest.TestCase):
+	_SIDECAR = """<?xml version="1.0" encoding="UTF-8"?>
+<x:xmpmeta xmlns:x="adobe:ns:meta/">
+	<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+		<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/">
+			<dc:subject><rdf:Bag>%s</rdf:Bag></dc:subject>
+		</rdf:Description>
+		<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/">
+			<dc:subject><rdf:Bag><rdf:li>only=ignored</rdf:li></rdf:Bag></dc:subject>
+		</rdf:Description>
+	</rdf:RDF>
+</x:xmpmeta>
+"""
+
+	def setUp(self):
+		self._temp_dir = tempfile.TemporaryDirectory()
+
+	def tearDown(self):
+		self._temp_dir.cleanup()
+
+	def _write(self, name, data):
+		filename = "%s/%s" % (self._temp_dir.name, name)
+		with open(filename, "w") as f:
+			f.write(data)
+		return filename
+
+	def _sidecar(self, name, *tags):
+		return self._write(name, self._SIDECAR % ("".join("<rdf:li>%s</rdf:li>" % (tag) for tag in tags)))
+
+	def test_scan(self):
+		filename = self._sidecar("a.xmp", "grp=x+y", "only=alice", "no tag")
+		tags = XMPScanner(filename).scan()
+		self.assertEqual(sorted(tags), [ "grp", "only" ])
+		self.assertEqual(sorted(tags["grp"]), [ "x", "y" ])
+		self.assertEqual(tags["only"], [ "alice" ])
+
+	def test_scan_closes_file(self):
+		filename = self._sidecar("a.xmp", "grp=x")
+		with warnings.catch_warnings(record = True) as caught:
+			warnings.simplefilter("always")
+			XMPScanner(filename).scan()
+			gc.collect()
+		self.assertEqual([ warning for warning in caught if issubclass(warning.category, ResourceWarning) ], [ ])
+
+	def test_scan_many(self):
+		good = self._sidecar("good.xmp", "grp=x")
+		untagged = self._sidecar("untagged.xmp")
+		broken = self._write("broken.xmp", "<x:xmpmeta><rdf:RDF>")
+		missing = self._temp_dir.name + "/missing.xmp"
+		(all_tags, errors) = XMPScanner.scan_many(iter([ good, broken, missing, untagged ]))
+		self.assertEqual(all_tags, { good: { "grp": [ "x" ] }, untagged: { }, missing: { } })
+		self.assertEqual(list(errors), [ broken ])
+		self.assertIsInstance(errors[broken], lxml.etree.XMLSyntaxError)
+
+	def test_scan_data(self):
+		self.assertEqual(XMPScanner.scan_data(b"<x:xmpmeta xmlns:x=\"adobe:ns:meta/\">\x00"), { })
+		self.assertEqual(XMPScanner.scan_data(b"no xml"), { })
+
+if __name__ == "__main__":
+	unittest.main()